@@ -0,0 +1,70 @@
+"""Decodes images on Kivy's loader threads, and always reports back.
+
+Kivy's Loader only reports errors for downloads. A local file that is missing or can't be decoded raises in its
+worker thread, so neither on_load nor on_error fires and the file stays marked as loading in its cache forever.
+load_image_async checks that the file exists, decodes it itself so a failure comes back as the loader's error
+image, and gives up after a timeout, so exactly one of its callbacks is always called. A timeout gets its own
+callback when one is given: it says nothing about the file, so the caller can try again later.
+"""
+import os
+
+from kivy.clock import Clock
+
+LOAD_TIMEOUT = 10.0
+
+# late import to prevent recursion
+Loader = None
+ImageLoader = None
+
+
+def load_image_async(path, on_load, on_error, on_timeout=None, timeout=LOAD_TIMEOUT):
+    """Calls on_load(image) with the decoded image, on_error(error) or on_timeout(error), from the main thread."""
+    global Loader, ImageLoader
+    if Loader is None:
+        from kivy.loader import Loader
+    if ImageLoader is None:
+        from kivy.core.image import ImageLoader
+
+    if not os.path.isfile(path):
+        on_error(FileNotFoundError("No such file: " + path))
+        return
+    error_image = Loader.error_image
+    finished = []
+
+    def decode(filename):
+        try:
+            image = ImageLoader.load(filename, keep_data=True)
+        except Exception:
+            image = None
+        return image if image is not None else error_image
+
+    def finish(handler, argument):
+        if finished:
+            return
+        finished.append(True)
+        if watchdog is not None:
+            watchdog.cancel()
+        handler(argument)
+
+    def on_proxy_load(proxy, *args):
+        if proxy.image is error_image:
+            Loader.remove_from_cache(path)
+            finish(on_error, ValueError("Couldn't decode " + path))
+        else:
+            finish(on_load, proxy.image)
+
+    def on_proxy_error(proxy, error=None):
+        Loader.remove_from_cache(path)
+        finish(on_error, error)
+
+    def on_watchdog(dt):
+        Loader.remove_from_cache(path)
+        finish(on_timeout or on_error, TimeoutError("Gave up on {} after {}s".format(path, timeout)))
+
+    watchdog = None
+    proxy = Loader.image(path, load_callback=decode)
+    if proxy.loaded:
+        on_proxy_load(proxy)
+        return
+    watchdog = Clock.schedule_once(on_watchdog, timeout)
+    proxy.bind(on_load=on_proxy_load, on_error=on_proxy_error)
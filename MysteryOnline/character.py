@@ -1,19 +1,41 @@
 from kivy.config import ConfigParser
 from kivy.atlas import Atlas
 from kivy.logger import Logger
-from MysteryOnline.icarus import Icarus
+from MysteryOnline.async_image import load_image_async
+from MysteryOnline.icarus import Icarus, PreloadedAtlas
 from kivy.app import App
 from MysteryOnline.mopopup import MOPopup
+from MysteryOnline.texture_cache import texture_cache, texture_bytes, ICONS
+from MysteryOnline.manifest import asset_manifest, CHARACTERS
+import json
 import os
+from functools import partial
 
 
 main_series_list = ["OC"]
 extra_series_list = []
 
+NO_WHITELIST = object()
+
+
+def read_whitelist():
+    """The whitelisted_series setting, NO_WHITELIST when mysteryonline.ini doesn't have it."""
+    config = ConfigParser()
+    config.read('mysteryonline.ini')
+    try:
+        whitelist = config.get('other', 'whitelisted_series')
+    except:
+        return NO_WHITELIST
+    whitelist = whitelist.strip('[]')
+    whitelist = whitelist.replace("'", "")
+    whitelist = whitelist.split(',')
+    return [x.strip() for x in whitelist]
+
 
 class Character:
 
-    def __init__(self, name):
+    def __init__(self, name, settings=None, whitelist=None):
+        """settings are the parsed settings.ini of the character, read from disk when None."""
         self.name = name
         self.path = "characters/{0}/".format(self.name)
         self.display_name = None
@@ -25,30 +47,75 @@ class Character:
         self.loaded_sprites = False
         self.loaded_icons = False
         self.sprites = None
+        self.sprite_regions = None
         self.icons = None
         self.link = None
         self.version = None
+        self.config = None
+        self.settings = None
         # Hash tables for faster membership checking
         self.nsfw_sprites = {}
         self.spoiler_sprites = {}
         self.cg_sprites = {}
         try:
-            self.config = ConfigParser(self.name)
-        except ValueError:
-            self.config = ConfigParser.get_configparser(self.name)
-        try:
-            self.read_config()
-        except (KeyError, AttributeError):
+            if settings is None:
+                self.read_config()
+            else:
+                self.apply_settings(settings, whitelist)
+        except (KeyError, AttributeError, TypeError):
             Logger.exception('Problematic character located in: ' + self.path)
 
+    def get_config(self):
+        if self.config is None:
+            try:
+                self.config = ConfigParser(self.name)
+            except ValueError:
+                self.config = ConfigParser.get_configparser(self.name)
+        return self.config
+
     def read_config(self):
+        config = self.get_config()
+        config.read(self.path + "settings.ini")
+        self.apply_settings(self.parse_settings(config))
+
+    @staticmethod
+    def parse_settings(config) -> dict:
+        """The settings.ini of a character as plain data, which the asset manifest keeps."""
+        char = config['character']
+        settings = {'name': char['name'], 'series': [s.strip() for s in char['series'].split(',')],
+                    'sprites': char['sprites'], 'icons': char['icons'], 'nsfw': [], 'spoiler': [], 'cg': []}
+        try:
+            settings['link'] = char['download']
+        except KeyError:
+            settings['link'] = "no link"
+        try:
+            settings['version'] = char['ver']
+        except KeyError:
+            try:
+                settings['version'] = char['version']
+            except KeyError:
+                settings['version'] = 0
+        try:
+            settings['nsfw'] = config['nsfw']['sprites'].split(',')
+        except KeyError:
+            pass
+        try:
+            spoiler_section = config['spoiler']
+            settings['spoiler'] = [spoiler_section[key].split(',') for key in sorted(spoiler_section)]
+        except KeyError:
+            pass
+        try:
+            settings['cg'] = config['CG']['sprites'].split(',')
+        except KeyError:
+            pass
+        return settings
+
+    def apply_settings(self, settings, whitelist=None):
+        """whitelist is the whitelisted_series setting, read from mysteryonline.ini when None."""
         global main_series_list
-        self.config.read(self.path + "settings.ini")
-        char = self.config['character']
-        self.display_name = char['name']
-        con_series = char['series']
-        con_series = con_series.split(',')
-        con_series = [s.strip() for s in con_series]
+        self.settings = settings
+        self.display_name = settings['name']
+        con_series = settings['series']
         main_series = con_series[0]
         if len(con_series) > 1:
             extra_series = con_series[1:]
@@ -59,72 +126,31 @@ class Character:
             if s not in extra_series_list:
                 extra_series_list.append(s)
         self.series = main_series
-        self.sprites_path = self.path + char['sprites']
-        self.icons_path = self.path + char['icons']
+        self.sprites_path = self.path + settings['sprites']
+        self.icons_path = self.path + settings['icons']
         self.avatar = self.path + "avatar.png"
-        self.read_nsfw_sprites()
-        self.read_spoiler_sprites()
-        self.read_cg_sprites()
-        try:
-            self.link = char['download']
-        except KeyError:
-            self.link = "no link"
-        try:
-            self.version = char['ver']
-        except KeyError:
-            try:
-                self.version = char['version']
-            except KeyError:
-                self.version = 0
-
-    def read_nsfw_sprites(self):
-        try:
-            nsfw_list = self.config['nsfw']['sprites']
-        except KeyError:
-            return
-        nsfw_list = nsfw_list.split(',')
-        for sprite_name in nsfw_list:
+        self.sprite_regions = settings.get('sprite_regions')
+        for sprite_name in settings['nsfw']:
             self.nsfw_sprites[sprite_name] = None
+        self.read_spoiler_sprites(settings['spoiler'], whitelist if whitelist is not None else read_whitelist())
+        for sprite_name in settings['cg']:
+            self.cg_sprites[sprite_name] = None
+        self.link = settings['link']
+        self.version = settings['version']
 
-    def read_spoiler_sprites(self):
-        try:
-            spoiler_section = self.config['spoiler']
-        except KeyError:
+    def read_spoiler_sprites(self, spoiler_lists, whitelist):
+        """Every spoiler list but those of whitelisted series, all of them when there is no whitelist setting."""
+        if not spoiler_lists:
             return
         spoiler_list = []
         series = self.extra_series[:]
         series.insert(0, self.series)
-        config = ConfigParser()
-        config.read('mysteryonline.ini')
-        try:
-            whitelist = config.get('other', 'whitelisted_series')
-        except:
-            for key, s in zip(sorted(spoiler_section), series):
-                spoiler_sprites = spoiler_section[key].split(',')
-                spoiler_list.extend(spoiler_sprites)
-            for sprite_name in spoiler_list:
-                self.spoiler_sprites[sprite_name] = None
-            return
-        whitelist = whitelist.strip('[]')
-        whitelist = whitelist.replace("'", "")
-        whitelist = whitelist.split(',')
-        whitelist = [x.strip() for x in whitelist]
-        for key, s in zip(sorted(spoiler_section), series):
-            if s not in whitelist:
-                spoiler_sprites = spoiler_section[key].split(',')
-                spoiler_list.extend(spoiler_sprites)
+        for sprites, s in zip(spoiler_lists, series):
+            if whitelist is NO_WHITELIST or s not in whitelist:
+                spoiler_list.extend(sprites)
         for sprite_name in spoiler_list:
             self.spoiler_sprites[sprite_name] = None
 
-    def read_cg_sprites(self):
-        try:
-            cg_list = self.config['CG']['sprites']
-        except KeyError:
-            return
-        cg_list = cg_list.split(',')
-        for sprite_name in cg_list:
-            self.cg_sprites[sprite_name] = None
-
     def get_display_name(self):
         return self.display_name
 
@@ -142,11 +168,58 @@ class Character:
 
 
     def load_icons(self):
-        self.icons = Atlas(self.icons_path)
+        self.set_icons(Atlas(self.icons_path))
+
+    def load_icons_async(self, callback):
+        """Decodes the icon pages on Kivy's loader threads, then builds the atlas and calls callback()."""
+        if self.loaded_icons:
+            callback()
+            return
+        try:
+            with open(self.icons_path, 'r') as fd:
+                meta = json.load(fd)
+        except (OSError, TypeError, ValueError):
+            callback()
+            return
+        pages = {}
+        waiting = set(meta)
+
+        def on_load(page, image):
+            pages[page] = image.texture
+            on_done(page)
+
+        def on_error(page, error):
+            Logger.error('Icons: Could not load {}: {}'.format(page, error))
+            on_done(page)
+
+        def on_done(page):
+            waiting.discard(page)
+            if waiting:
+                return
+            if not self.loaded_icons and len(pages) == len(meta):
+                self.set_icons(PreloadedAtlas(self.icons_path, meta, pages))
+            callback()
+
+        directory = os.path.dirname(self.icons_path)
+        for page in list(meta):
+            load_image_async(os.path.join(directory, page), partial(on_load, page), partial(on_error, page))
+
+    def set_icons(self, icons):
+        self.icons = icons
         self.loaded_icons = True
+        pages = [getattr(texture, 'owner', texture) for texture in self.icons.textures.values()]
+        pages = {id(page): page for page in pages}
+        size = sum(texture_bytes(page.width, page.height) for page in pages.values())
+        texture_cache.add((ICONS, self.icons_path), size, self.unload_icons)
+
+    def unload_icons(self):
+        self.icons = None
+        self.loaded_icons = False
 
     def load_sprites(self):
         self.sprites = Icarus(self.sprites_path)
+        if self.sprite_regions is not None:
+            self.sprites.set_regions(self.sprite_regions)
         self.loaded_sprites = True
 
     def load_without_icons(self):
@@ -155,6 +228,9 @@ class Character:
 
     def get_icons(self):
         try:
+            if not self.loaded_icons and self.icons_path is not None:
+                self.load_icons()
+            texture_cache.touch((ICONS, self.icons_path))
             return self.icons
         except AttributeError:
             Logger.error("Icons: The icons aren't loaded into memory")
@@ -178,8 +254,49 @@ class Character:
             Logger.error("Sprites: The sprites aren't loaded into memory")
             raise
 
+    def is_sprite_loaded(self, sprite_name):
+        return self.sprites is not None and self.sprites.is_loaded(sprite_name)
+
+    def load_sprite_async(self, sprite_name, callback):
+        self.load_without_icons()
+        self.sprites.load_async(sprite_name, callback)
+
+    def is_cg(self, sprite_name):
+        return sprite_name in self.cg_sprites
+
     def get_spoiler_icons(self):
         return self.spoiler_sprites
 
 
-characters = {name: Character(name) for name in os.listdir("characters") if os.path.isdir("characters/" + name)}
+def read_atlas(path):
+    try:
+        with open(path, 'r') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def load_characters():
+    """Builds every character, from the asset manifest when their directory didn't change since last time."""
+    asset_manifest.ensure_loaded()
+    whitelist = read_whitelist()
+    loaded = {}
+    for name in os.listdir("characters"):
+        path = "characters/" + name
+        if not os.path.isdir(path):
+            continue
+        settings = asset_manifest.get(CHARACTERS, name, path)
+        if settings is not None:
+            loaded[name] = Character(name, settings, whitelist)
+            continue
+        character = loaded[name] = Character(name)
+        if character.settings is None:
+            continue
+        character.sprite_regions = character.settings['sprite_regions'] = read_atlas(character.sprites_path)
+        asset_manifest.put(CHARACTERS, name, path, ['settings.ini', character.settings['sprites']], character.settings)
+    asset_manifest.prune(CHARACTERS, loaded)
+    asset_manifest.save()
+    return loaded
+
+
+characters = load_characters()
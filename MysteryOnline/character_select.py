@@ -7,6 +7,7 @@ from kivy.properties import ObjectProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.clock import Clock
 from MysteryOnline.character import characters, main_series_list
+from MysteryOnline.prefetch import prefetcher
 from math import ceil
 from MysteryOnline.utils import binary_search
 
@@ -145,6 +146,7 @@ class CharacterSelect(Popup):
             inst.text = '[size=9]'+inst.name+'[/size]'
             self.picked_char = None
             self.picked_char = inst.char
+            prefetcher.warm_icons(inst.char)
         else:
             inst.text = ''
             if self.picked_char == inst.char:
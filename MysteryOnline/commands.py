@@ -7,6 +7,7 @@ from kivy.app import App
 from kivy.core.window import Window
 from MysteryOnline.character import characters
 from MysteryOnline.mopopup import MOPopup
+from MysteryOnline.texture_cache import texture_cache
 
 
 class CommandError(Exception):
@@ -167,6 +168,10 @@ class CommandProcessor:
 
             'random': CommandHandler('random', 'str:option'),
 
+            'stats': CommandHandler('stats'),
+
+            'statsdump': CommandHandler('statsdump', 'str:path'),
+
             'help': CommandHandler('help')
         }
 
@@ -268,6 +273,22 @@ class CommandProcessor:
     def process_startim(self):
         Window.set_title("Sonata's Revenge")
 
+    def process_stats(self):
+        log = App.get_running_app().get_main_screen().log_window
+        connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        summary = connection_manager.irc_connection.profiler.format_summary() or "Nothing executed yet."
+        log.add_entry("\nMessage handlers:\n{}\n{}\n\n".format(summary, texture_cache.format_summary()))
+
+    def process_statsdump(self):
+        log = App.get_running_app().get_main_screen().log_window
+        connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        try:
+            connection_manager.irc_connection.profiler.dump(self.command['path'])
+        except OSError as e:
+            log.add_entry("Couldn't write the stats: {}\n".format(e))
+            return
+        log.add_entry("Stats written to {}\n".format(self.command['path']))
+
     def process_help(self):
         log = App.get_running_app().get_main_screen().log_window
         log.add_entry("\nAvailable commands:\n")
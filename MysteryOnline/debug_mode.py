@@ -7,6 +7,7 @@ from kivy.clock import Clock
 from kivy.app import App
 from MysteryOnline.user import User
 from MysteryOnline.character import characters
+from MysteryOnline.load_generator import LoadScript, PM, load_characters, load_locations
 from random import randint, choice
 from functools import partial
 
@@ -84,11 +85,59 @@ class UserManagementInterface(ModalView):
         self.dismiss()
 
 
+class LoadGeneratorInterface(ModalView):
+
+    users_input = ObjectProperty(None)
+    chat_rate_input = ObjectProperty(None)
+    nullpost_rate_input = ObjectProperty(None)
+    move_rate_input = ObjectProperty(None)
+    ooc_rate_input = ObjectProperty(None)
+    pm_rate_input = ObjectProperty(None)
+
+    def __init__(self, caller, **kwargs):
+        super(LoadGeneratorInterface, self).__init__(**kwargs)
+        self.caller = caller
+
+    def on_start(self):
+        self.caller.debug_mode.start_load(int(self.users_input.text or 0), float(self.chat_rate_input.text or 0),
+                                          float(self.nullpost_rate_input.text or 0),
+                                          float(self.move_rate_input.text or 0), float(self.ooc_rate_input.text or 0),
+                                          float(self.pm_rate_input.text or 0))
+        self.dismiss()
+
+    def on_stop_load(self):
+        self.caller.debug_mode.stop_load()
+        self.dismiss()
+
+
+class TelemetryInterface(ModalView):
+
+    telemetry_label = ObjectProperty(None)
+
+    def __init__(self, **kwargs):
+        super(TelemetryInterface, self).__init__(**kwargs)
+        self.refresh_event = None
+
+    def on_open(self):
+        self.refresh()
+        self.refresh_event = Clock.schedule_interval(self.refresh, 1)
+
+    def on_dismiss(self):
+        if self.refresh_event is not None:
+            self.refresh_event.cancel()
+
+    def refresh(self, *args):
+        connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        depth, age = connection_manager.get_backlog()
+        self.telemetry_label.text = "{}\nBacklog: {} messages, oldest {:.1f} s".format(
+            connection_manager.irc_connection.telemetry.format_summary(), depth, age)
+
+
 class DebugModeInterface(BoxLayout):
 
     def __init__(self, **kwargs):
         super(DebugModeInterface, self).__init__(**kwargs)
-        self.debug_mode = DebugMode()
+        self.debug_mode = debug_mode
 
     def open_user_creation(self):
         popup = UserCreationInterface(self)
@@ -99,6 +148,14 @@ class DebugModeInterface(BoxLayout):
         popup.ready()
         popup.open()
 
+    def open_load_generator(self):
+        popup = LoadGeneratorInterface(self)
+        popup.open()
+
+    def open_telemetry(self):
+        popup = TelemetryInterface()
+        popup.open()
+
     def create_user(self, username, character, location, sublocation, position):
         self.debug_mode.create_user(username, character, location, sublocation, position)
 
@@ -110,6 +167,7 @@ class DebugMode:
 
     def __init__(self):
         self.created_users = {}
+        self.load_generator = None
 
     def create_user(self, username, character_name, location_name, sublocation_name, position):
         user = User(username)
@@ -121,6 +179,7 @@ class DebugMode:
         main_screen = App.get_running_app().get_main_screen()
         main_screen.users[username] = user
         main_screen.ooc_window.add_user(user)
+        main_screen.room_state.add_user(username)
 
     def add_character_to_user(self, user, character_name):
         character = characters.get(character_name, None)
@@ -146,7 +205,7 @@ class DebugMode:
         Clock.schedule_once(partial(self.scheduled_send_message, user, message), int(delay_in_s))
 
     def get_random_sprite(self, user):
-        icons = user.character.icons.textures
+        icons = user.character.get_icons().textures
         sprite_name = choice(list(icons.keys()))
         return sprite_name
 
@@ -169,3 +228,57 @@ class DebugMode:
 
     def get_created_users(self):
         return self.created_users
+
+    def start_load(self, users, chat_rate, nullpost_rate, move_rate, ooc_rate, pm_rate):
+        self.stop_load()
+        script = LoadScript(load_characters(), load_locations(), chat_rate, nullpost_rate, move_rate, ooc_rate,
+                            pm_rate, message_factory=App.get_running_app().get_message_factory())
+        self.load_generator = LoadGenerator(self, script)
+        self.load_generator.start(users)
+
+    def stop_load(self):
+        if self.load_generator is not None:
+            self.load_generator.stop()
+            self.load_generator = None
+
+
+class LoadGenerator:
+    """Creates fake users through DebugMode and drives them with a LoadScript, on the Kivy clock.
+
+    Their messages go through the local message queue, so they are executed like the ones from the channel.
+    """
+
+    def __init__(self, debug_mode, script, interval=0.1):
+        self.debug_mode = debug_mode
+        self.script = script
+        self.interval = interval
+        self.event = None
+
+    def start(self, count):
+        connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        usernames = ["LoadUser{}".format(i) for i in range(count)]
+        for user, message in self.script.spawn(usernames):
+            self.debug_mode.create_user(user.username, user.character, user.location, user.sublocation,
+                                        user.position)
+            connection_manager.send_local(message)
+        self.event = Clock.schedule_interval(self.update, self.interval)
+
+    def update(self, dt):
+        connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        for kind, user, message, target in self.script.tick(dt):
+            if kind == PM:
+                connection_manager.irc_connection.p_msg_q.enqueue(message, user.username)
+            else:
+                connection_manager.send_local(message)
+
+    def stop(self):
+        if self.event is not None:
+            self.event.cancel()
+            self.event = None
+        connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        for user in self.script.users:
+            self.debug_mode.created_users.pop(user.username, None)
+            connection_manager.on_disconnect(user.username)
+
+
+debug_mode = DebugMode()
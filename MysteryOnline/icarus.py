@@ -1,10 +1,15 @@
 import json
+from collections import OrderedDict
+from functools import partial
 # noinspection PyUnresolvedReferences
 from os.path import dirname, join
+from kivy.atlas import Atlas
 from kivy.event import EventDispatcher
 from kivy.logger import Logger
 from kivy.properties import AliasProperty, DictProperty
+from MysteryOnline.async_image import load_image_async
 from MysteryOnline.sprite import Sprite, NullSprite
+from MysteryOnline.texture_cache import texture_cache, texture_bytes, PAGE
 import os
 
 # late import to prevent recursion
@@ -13,6 +18,14 @@ CoreImage = None
 
 class Icarus(EventDispatcher):
     """Modified version of Kivy's Atlas class.
+
+    The atlas file is parsed once into a sprite name -> (page, region) index. Pages are decoded on first use and
+    cached independently in the texture cache, which evicts them when it runs over its budget. max_pages
+    optionally caps the pages decoded at once for this atlas. textures holds the sprites of every decoded page.
+
+    load_async decodes a page on Kivy's loader threads instead, only the texture upload happens on the main thread.
+    A page that can't be decoded is remembered as failed, its sprites are NullSprites from then on. A page that
+    timed out isn't, it is decoded again on the next request.
     """
 
     textures = DictProperty({})
@@ -22,12 +35,19 @@ class Icarus(EventDispatcher):
 
     filename = AliasProperty(_get_filename, None)
 
-    def __init__(self, filename):
+    def __init__(self, filename, max_pages=None):
         self._filename = filename
+        self.max_pages = max_pages
+        self.index = None
+        self.regions = {}
+        self.pages = OrderedDict()
+        self.pending = {}
+        self.failed = set()
         super(Icarus, self).__init__()
 
     def __getitem__(self, key):
         if key in self.textures:
+            self.touch(key)
             return self.textures[key]
         self.load(key)
         return self.textures[key]
@@ -35,54 +55,146 @@ class Icarus(EventDispatcher):
     def __contains__(self, item):
         return item in self.textures
 
-    def load(self, image_name):
-        # late import to prevent recursive import.
-        global CoreImage
-        if CoreImage is None:
-            from kivy.core.image import Image as CoreImage
+    @staticmethod
+    def build_index(meta):
+        """Maps every sprite name of parsed atlas metadata to its (page, region)."""
+        return {name: (page, tuple(region)) for page, ids in meta.items() for name, region in ids.items()}
+
+    def set_regions(self, meta):
+        """Uses atlas metadata parsed elsewhere, such as the asset manifest, instead of reading the file."""
+        self.regions = meta
+        self.index = self.build_index(meta)
 
-        # must be a name finished by .atlas ?
+    def load_index(self):
+        if self.index is not None:
+            return self.index
+        self.index = {}
         filename = self._filename
         try:
             assert(filename.endswith('.atlas'))
             # noinspection PyUnresolvedReferences
             filename = filename.replace('/', os.sep)
-
             Logger.debug('Atlas: Load <%s>' % filename)
         except AttributeError:
-            self.textures[image_name] = NullSprite(image_name)
-            return
-
+            return self.index
         try:
             with open(filename, 'r') as fd:
-                meta = json.load(fd)
+                self.regions = json.load(fd)
+            self.index = self.build_index(self.regions)
         except FileNotFoundError:
+            pass
+        return self.index
+
+    def get_cache_key(self, page):
+        return PAGE, self._filename, page
+
+    def get_page_path(self, page):
+        return join(dirname(self._filename.replace('/', os.sep)), page)
+
+    def is_loaded(self, image_name):
+        """True when the sprite can be handed out without decoding anything."""
+        if image_name in self.textures:
+            return True
+        entry = self.load_index().get(image_name)
+        return entry is None or entry[0] in self.pages or entry[0] in self.failed
+
+    def touch(self, image_name):
+        entry = self.index.get(image_name) if self.index is not None else None
+        if entry is not None and entry[0] in self.pages:
+            self.pages.move_to_end(entry[0])
+            texture_cache.touch(self.get_cache_key(entry[0]))
+
+    def load(self, image_name):
+        # late import to prevent recursive import.
+        global CoreImage
+        if CoreImage is None:
+            from kivy.core.image import Image as CoreImage
+
+        entry = self.load_index().get(image_name)
+        if entry is None:
+            if self.index:
+                Logger.error('Icarus: ' + image_name + ' not found')
+            # noinspection PyTypeChecker
             self.textures[image_name] = NullSprite(image_name)
             return
-        d = dirname(filename)
-        textures = {}
-        found = None
-        ids_found = None
-        for sub, ids in meta.items():
-            if image_name in ids:
-                found = sub
-                ids_found = ids
-        if found is None:
-            Logger.error('Icarus: ' + image_name + ' not found')
-            # noinspection PyTypeChecker
+        page = entry[0]
+        if page in self.pages:
+            self.touch(image_name)
+            return
+        if page in self.failed:
             self.textures[image_name] = NullSprite(image_name)
             return
-        subfilename = join(d, found)
+        subfilename = self.get_page_path(page)
         Logger.debug('Atlas: Load <%s>' % subfilename)
 
         # load the image
         ci = CoreImage(subfilename)
-        atlas_texture = ci.texture
-
-        # for all the uid, load the image, get the region, and put
-        # it in our dict.
-        for meta_id, meta_coords in ids_found.items():
-            x, y, w, h = meta_coords
-            textures[meta_id] = Sprite(meta_id, atlas_texture.get_region(*meta_coords))
+        self.add_page(page, ci.texture)
 
+    def load_async(self, image_name, callback):
+        """Decodes the page of the sprite in the background, then calls callback() from the main thread."""
+        if self.is_loaded(image_name):
+            callback()
+            return
+        page = self.index[image_name][0]
+        if page in self.pending:
+            if callback not in self.pending[page]:
+                self.pending[page].append(callback)
+            return
+        self.pending[page] = [callback]
+        Logger.debug('Atlas: Load <%s> in the background' % self.get_page_path(page))
+        load_image_async(self.get_page_path(page), partial(self.on_page_loaded, page),
+                         partial(self.on_page_error, page), partial(self.on_page_timeout, page))
+
+    def on_page_loaded(self, page, image):
+        if page not in self.pages:
+            self.add_page(page, image.texture)
+        for callback in self.pending.pop(page, ()):
+            callback()
+
+    def on_page_error(self, page, error):
+        Logger.error('Icarus: Could not load {}: {}'.format(self.get_page_path(page), error))
+        self.failed.add(page)
+        for callback in self.pending.pop(page, ()):
+            callback()
+
+    def on_page_timeout(self, page, error):
+        """The loader is only slow, the page is requested again the next time one of its sprites is needed."""
+        Logger.warning('Icarus: {}'.format(error))
+        self.pending.pop(page, None)
+
+    def add_page(self, page, atlas_texture):
+        # for all the uid of the page, get the region, and put it in our dict.
+        key = self.get_cache_key(page)
+        textures = {}
+        for meta_id, meta_coords in self.regions[page].items():
+            textures[meta_id] = Sprite(meta_id, atlas_texture.get_region(*meta_coords), cache_key=key)
+        self.pages[page] = list(textures)
+        self.textures.update(textures)
+        texture_cache.add(key, texture_bytes(atlas_texture.width, atlas_texture.height), partial(self.evict_page, page))
+        while self.max_pages is not None and len(self.pages) > self.max_pages:
+            self.evict_page(next(iter(self.pages)))
+
+    def evict_page(self, page):
+        """Drops the sprites of a decoded page, they are decoded again when next needed."""
+        texture_cache.discard(self.get_cache_key(page))
+        names = self.pages.pop(page, ())
+        for name in names:
+            self.textures.pop(name, None)
+
+
+class PreloadedAtlas(Atlas):
+    """Kivy Atlas built from page textures that were already decoded, see Character.load_icons_async."""
+
+    def __init__(self, filename, meta, pages):
+        self.meta = meta
+        self.pages = pages
+        super(PreloadedAtlas, self).__init__(filename)
+
+    def _load(self):
+        textures = {}
+        for page, ids in self.meta.items():
+            atlas_texture = self.pages[page]
+            for meta_id, meta_coords in ids.items():
+                textures[meta_id] = atlas_texture.get_region(*meta_coords)
         self.textures = textures
@@ -8,6 +8,8 @@ from kivy.uix.image import Image
 from kivy.uix.modalview import ModalView
 import gc
 
+from MysteryOnline.texture_cache import texture_cache, ICONS
+
 
 class Icon(Image):
     def __init__(self, name, texture, **kwargs):
@@ -98,6 +100,7 @@ class IconsLayout(BoxLayout):
 
     def load_icons(self, char):
         icons = char.get_icons()
+        texture_cache.pin(self, (ICONS, char.icons_path))
         spoiler_icons = char.get_spoiler_icons()
         config = App.get_running_app().config
         if len(self.children) > 1:
@@ -200,10 +200,12 @@ class ItemCreator(Popup):
 
     def create_item(self, name, description, image_link, user):
         message_len = len(name) + len(description) + len(image_link) + len(user)
-        if message_len > 420:
-            error_popup = MOPopup("Character limit exceeded", "IRC has a character limit of roughly 500, please make"
+        connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        max_length = connection_manager.get_max_message_length(420)
+        if message_len > max_length:
+            error_popup = MOPopup("Character limit exceeded", "Items are limited to {} characters, please make"
                                                               " sure your item's combined description, name, and image"
-                                                              " link don't exceed it.", "Close")
+                                                              " link don't exceed it.".format(max_length), "Close")
             error_popup.size = (900, 200)
             error_popup.open()
             return
@@ -1,4 +1,10 @@
+import queue
+import random
+import threading
+import time
 import traceback
+from collections import deque
+from functools import partial
 
 import irc.client
 from MysteryOnline.mopopup import MOPopup
@@ -16,6 +22,13 @@ import re
 
 from MysteryOnline.mainscreen import MainScreen
 from MysteryOnline.user import CurrentUserHandler
+from MysteryOnline import protocol
+from MysteryOnline.prefetch import prefetcher
+from MysteryOnline.telemetry import Telemetry, HandlerProfiler, PARSE, QUEUE, EXECUTE, DISPLAY_START, DISPLAY, RTT, SEND_WAIT
+from MysteryOnline.traffic import TrafficRecorder, TrafficReplay, FrameTimes, RECORDED_EVENTS, load_capture
+from MysteryOnline.protocol import IncorrectMessageTypeError, MessageTooLong, PROTOCOL_VERSION, \
+    DELTA_PROTOCOL_VERSION, FRAGMENT_PROTOCOL_VERSION, FRAME_PROTOCOL_VERSION, MAX_MESSAGE_LENGTH, \
+    PRESENCE_MAX_LENGTH, STATE_LANE, OOC_LANE, CHAT_LANE
 from jaraco.stream import buffer
 
 
@@ -23,144 +36,32 @@ class ChannelConnectionError(Exception):
     pass
 
 
-class IncorrectMessageTypeError(Exception):
-    pass
-
-
-class MessageFactory:
-
-    def __init__(self):
-        pass
+# Reconnection backoff, in seconds
+RECONNECT_BASE_DELAY = 2
+RECONNECT_MAX_DELAY = 120
+RECONNECT_JOIN_TIMEOUT = 30
+OUTGOING_QUEUE_SIZE = 50
 
-    def build_chat_message(self, **kwargs):
-        username = kwargs.get('username', None)
-        if username is not None:
-            result = ChatMessage(username, **kwargs)
-        else:
-            result = ChatMessage("default", **kwargs)
-        return result
+# A join is answered after a random delay, in seconds, by whoever answers first.
+PRESENCE_MIN_DELAY = 1.0
+PRESENCE_MAX_DELAY = 3.0
 
-    def build_icon_message(self, **kwargs):
-        username = kwargs.get('username', None)
-        if username is not None:
-            result = IconMessage(username, **kwargs)
-        else:
-            result = IconMessage("default", **kwargs)
-        return result
-
-    def build_character_message(self, character, link=None, version=None):
-        result = CharacterMessage("default", character, link, version)
-        return result
-
-    def build_location_message(self, location):
-        result = LocationMessage("default", location)
-        return result
-
-    def build_ooc_message(self, content):
-        result = OOCMessage("default", content)
-        return result
-
-    def build_looc_message(self, location, content):
-        result = LOOCMessage("default", location, content)
-        return result
-
-    def build_music_message(self, track_name, url):
-        result = MusicMessage("default", track_name, url)
-        return result
-
-    def build_roll_message(self, roll):
-        result = RollMessage("default", roll)
-        return result
-
-    def build_item_message(self, item):
-        result = ItemMessage("default", item)
-        return result
-
-    def build_clear_message(self, location):
-        result = ClearMessage("default", location)
-        return result
-
-    def build_choice_message(self, sender, text, options, list_of_users):
-        result = ChoiceMessage(sender, text, options, list_of_users)
-        return result
-
-    def build_choice_return_message(self, sender, questioner, whisper, selected_option):
-        result = ChoiceReturnMessage(sender, questioner, whisper, selected_option)
-        return result
-
-    def build_from_irc(self, irc_message, username):
-        if irc_message.count('#') >= 8:
-            result = ChatMessage(username)
-        elif irc_message.startswith("sc#"):
-            result = IconMessage(username)
-        elif irc_message.startswith('c#'):
-            result = CharacterMessage(username)
-        elif irc_message.startswith('LOOC#'):
-            result = LOOCMessage(username)
-        elif irc_message.startswith('OOC#'):
-            result = OOCMessage(username)
-        elif irc_message.startswith('m#'):
-            result = MusicMessage(username)
-        elif irc_message.startswith('l#'):
-            result = LocationMessage(username)
-        elif irc_message.startswith('r#'):
-            result = RollMessage(username)
-        elif irc_message.startswith('i#'):
-            result = ItemMessage(username)
-        elif irc_message.startswith('cl#'):
-            result = ClearMessage(username)
-        elif irc_message.startswith('ch#'):
-            result = ChoiceMessage(username)
-        elif irc_message.startswith('ch2#'):
-            result = ChoiceReturnMessage(username)
-        else:
-            result = OOCMessage(username)
-        result.from_irc(irc_message)
-        return result
+# How a chat message is shown, depending on the chat backlog.
+NORMAL_DISPLAY = 'normal'
+INSTANT_DISPLAY = 'instant'
+LOG_ONLY_DISPLAY = 'log'
 
 
-class ChatMessage:
-
-    def __init__(self, sender, **kwargs):
-        # TODO Try to reduce the number of arguments
-        self.components = kwargs
-        self.sender = sender
-        self.content = kwargs.get('content')
-        self.location = kwargs.get('location')
-        self.sublocation = kwargs.get('sublocation')
-        self.character = kwargs.get('character')
-        self.sprite = kwargs.get('sprite')
-        self.position = kwargs.get('position')
-        self.color_id = kwargs.get('color_id')
-        self.sprite_option = kwargs.get('sprite_option')
-        self.sfx_name = kwargs.get('sfx_name')
-        self.remove_line_breaks()
-
-    def remove_line_breaks(self):
-        if self.content is None:
-            return
-        if '\n' in self.content or '\r' in self.content:
-            self.content = self.content.replace('\n', ' ')
-            self.content = self.content.replace('\r', ' ')
-
-    def to_irc(self):
-        if self.components['sfx_name'] is None:
-            self.components['sfx_name'] = '0'
-        msg = "{0[location]}#{0[sublocation]}#{0[character]}#{0[sprite]}#" \
-              "{0[position]}#{0[color_id]}#{0[sprite_option]}#{0[sfx_name]}#{0[content]}".format(self.components)
-        return msg
-
-    def from_irc(self, message):
-        arguments = tuple(message.split('#', 8))
-        self.location, self.sublocation, self.character, self.sprite, self.position, \
-            self.color_id, self.sprite_option, self.sfx_name, self.content = arguments
-        if self.sfx_name == '0':
-            self.sfx_name = None
+class ChatMessage(protocol.ChatMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         if main_screen.text_box.is_displaying_msg:
             connection_manager.irc_connection.put_back_msg(self)
             return
+        display_mode = connection_manager.get_chat_display_mode()
+        # The sender's newer location or sprite is already applied, so only show the text.
+        superseded = connection_manager.irc_connection.msg_q.is_superseded(self)
         username = self.sender
         if username == "default":
             user = App.get_running_app().get_user()
@@ -170,33 +71,39 @@ class ChatMessage:
             if user is None:
                 connection_manager.on_join(username)
             try:
-                user.set_from_msg(self.location, self.sublocation, self.position, self.sprite, self.character)
+                if not superseded:
+                    user.set_from_msg(self.location, self.sublocation, self.position, self.sprite, self.character)
             except (AttributeError, KeyError) as e:
                 Logger.warning(traceback.format_exc())
                 return
-        if self.location == user_handler.get_current_loc().name and user not in main_screen.ooc_window.muted_users:
+        if self.location == user_handler.get_current_loc().name and not main_screen.room_state.is_muted(username):
             try:
                 option = int(self.sprite_option)
             except ValueError:
                 return
-            try:
-                user.set_sprite_option(option)
-                main_screen.sprite_window.set_subloc(user.get_subloc())
-                main_screen.sprite_window.set_sprite(user)
-            except AttributeError:
-                Logger.warning(traceback.format_exc())
-                pass
+            if not superseded:
+                try:
+                    user.set_sprite_option(option)
+                    if display_mode == LOG_ONLY_DISPLAY:
+                        main_screen.sprite_window.set_sprite(user, False)
+                    else:
+                        main_screen.sprite_window.set_subloc(user.get_subloc())
+                        main_screen.sprite_window.set_sprite(user)
+                except AttributeError:
+                    Logger.warning(traceback.format_exc())
+                    pass
             try:
                 col = user.color_ids[int(self.color_id)]
             except (ValueError, IndexError) as e:
                 Logger.warning(traceback.format_exc())
                 return
-            if self.sfx_name is not None:
-                main_screen.text_box.play_sfx(self.sfx_name)
-            main_screen.text_box.display_text(self.content, user, col, username)
-        if user.subloc is not None:
-            main_screen.ooc_window.update_subloc(user.username, user.subloc.name)
-
+            if display_mode == LOG_ONLY_DISPLAY:
+                main_screen.text_box.log_text(self.content, user, col, username)
+            else:
+                if self.sfx_name is not None:
+                    main_screen.text_box.play_sfx(self.sfx_name)
+                main_screen.text_box.display_text(self.content, user, col, username,
+                                                  instant=display_mode == INSTANT_DISPLAY)
         if self.need_to_notify(self.content, user_handler.get_user().username):
             App.get_running_app().flash_window()
             if not Window.focus:
@@ -206,36 +113,9 @@ class ChatMessage:
         mention: str = "@{0}".format(username)
         return msg == mention or mention+" " in msg
 
-class IconMessage:
 
-    def __init__(self, sender, **kwargs):
-        self.components = kwargs
-        self.sender = sender
-        self.location = kwargs.get('location')
-        self.sublocation = kwargs.get('sublocation')
-        self.character = kwargs.get('character')
-        self.sprite = kwargs.get('sprite')
-        self.position = kwargs.get('position')
-        self.sprite_option = kwargs.get('sprite_option')
-        self.dance = kwargs.get('dance')
-
-    def to_irc(self):
-        msg = "sc#{0[location]}#{0[sublocation]}#{0[character]}#{0[sprite]}#" \
-              "{0[position]}#{0[sprite_option]}#{0[dance]}".format(self.components)
-        return msg
-
-    def from_irc(self, message):
-        try:
-            arguments = message.split('#', 7)
-            arguments.remove("sc")
-            self.location, self.sublocation, self.character, self.sprite, self.position, \
-            self.sprite_option, self.dance = arguments
-        except ValueError:
-            arguments = message.split('#', 6)
-            arguments.remove("sc")
-            self.location, self.sublocation, self.character, self.sprite, self.position, \
-            self.sprite_option = arguments
-            self.dance = False
+class IconMessage(protocol.IconMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         username = self.sender
@@ -251,47 +131,24 @@ class IconMessage:
         if user is not None:
             user.set_from_msg(self.location, self.sublocation, self.position, self.sprite, self.character, self.dance)
 
-        if self.location == user_handler.get_current_loc().name and user not in main_screen.ooc_window.muted_users:
+        if self.location == user_handler.get_current_loc().name and not main_screen.room_state.is_muted(username):
             try:
                 option = int(self.sprite_option)
                 old_subloc = main_screen.sprite_window.subloc
-                if user.get_char().get_sprite(self.sprite).is_cg():
+                if user.get_char().is_cg(self.sprite):
                     return # No nullposting for cgs!
                 user.set_sprite_option(option)
                 if username != "default" and user.get_dance() and local_user.get_subloc().name == self.sublocation and local_user.get_dance():
                     main_screen.sprite_settings.check_flip_h.active = user.sprite_option == 0
                 main_screen.sprite_window.set_sprite(user, False)
-                main_screen.ooc_window.update_subloc(user.username, user.subloc.name)
                 main_screen.sprite_window.display_sub(old_subloc)
             except (AttributeError, KeyError, ValueError) as e:
                 Logger.warning(traceback.format_exc())
                 return
-        else:
-            main_screen.ooc_window.update_subloc(user.username, self.sublocation)
-
-class ChoiceMessage:
-
-    def __init__(self, sender, text=None, options=None, list_of_users=None):
-        if text is None:
-            text = 'Text'
-        if options is None:
-            options = 'Options'
-        if list_of_users is None:
-            list_of_users = 'everyone'
-        self.components = {'text': text, 'options': options, 'list_of_users': list_of_users}
-        self.sender = sender
-        self.text = text
-        self.options = options
-        self.list_of_users = list_of_users
 
-    def to_irc(self):
-        msg = "ch#{0[text]}#{0[options]}#{0[list_of_users]}".format(self.components)
-        return msg
 
-    def from_irc(self, message):
-        arguments = message.split('#', 3)
-        arguments.remove('ch')
-        self.text, self.options, self.list_of_users = arguments
+class ChoiceMessage(protocol.ChoiceMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         user = user_handler.get_user()
@@ -305,37 +162,21 @@ class ChoiceMessage:
                     return
         except KeyError:
             pass
-        self.list_of_users = self.list_of_users.replace('@', '')
+        list_of_users = self.list_of_users.replace('@', '')
         if user.has_choice_popup:
             ChoicePopup('', self.sender, self.text, options, user_handler.get_user())
-        elif self.list_of_users != 'everyone':
-            list_of_users = self.list_of_users.split(', ')
-            if username in list_of_users:
+        elif list_of_users != 'everyone':
+            if username in list_of_users.split(', '):
                 choice_popup = ChoicePopup('', self.sender, self.text, options, user_handler.get_user())
                 choice_popup.open()
         elif username != self.sender:
             choice_popup = ChoicePopup('', self.sender, self.text, options, user_handler.get_user())
             choice_popup.open()
-        log.add_entry(self.sender+' gave '+self.list_of_users+' a choice.\n')
-
+        log.add_entry(self.sender+' gave '+list_of_users+' a choice.\n')
 
-class ChoiceReturnMessage:
 
-    def __init__(self, sender, questioner=None, whisper=False, selected_option=None):
-        self.components = {'questioner': questioner, 'whisper': whisper, 'selected_option': selected_option}
-        self.questioner = questioner
-        self.whisper = whisper
-        self.selected_option = selected_option
-        self.sender = sender
-
-    def to_irc(self):
-        msg = "ch2#{0[questioner]}#{0[whisper]}#{0[selected_option]}".format(self.components)
-        return msg
-
-    def from_irc(self, message):
-        arguments = message.split('#')
-        arguments.remove('ch2')
-        self.questioner, self.whisper, self.selected_option = arguments
+class ChoiceReturnMessage(protocol.ChoiceReturnMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         log = main_screen.log_window
@@ -354,45 +195,19 @@ class ChoiceReturnMessage:
                 user_handler.send_message(self.selected_option)
 
 
-class CharacterMessage:
-
-    def __init__(self, sender, character=None, link=None, version=None):
-        self.sender = sender
-        self.character = character
-        self.character_link = link
-        self.version = version
-
-    def to_irc(self):
-        msg = "c#{0}#{1}#{2}".format(self.character, self.character_link, self.version)
-        return msg
-
-    def from_irc(self, message):
-        arguments = message.split('#', 3)
-        self.character = arguments[1]
-        if len(arguments) > 2: #If it works...
-            self.character_link = arguments[2]
-        if len(arguments) > 3:
-            self.version = arguments[3]
-        else:
-            self.version = ''
+class CharacterMessage(protocol.CharacterMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         connection_manager.update_char(main_screen, self.character, self.sender, self.character_link, self.version)
+        user = main_screen.users.get(self.sender)
+        if user is not None and user.get_loc() is not None \
+                and user.get_loc().get_name() == user_handler.get_current_loc().name:
+            prefetcher.warm_user(user)
 
 
-class LocationMessage:
-
-    def __init__(self, sender, location=None):
-        self.sender = sender
-        self.location = location
-
-    def to_irc(self):
-        msg = "l#{0}".format(self.location)
-        return msg
-
-    def from_irc(self, message):
-        arguments = message.split('#', 1)
-        self.location = arguments[1]
+class LocationMessage(protocol.LocationMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler: CurrentUserHandler):
         username = self.sender
@@ -407,71 +222,21 @@ class LocationMessage:
         user = main_screen.users.get(username, None)
         if user.get_loc() is not None and user.get_loc().get_name() != loc:
             main_screen.log_window.add_entry("{} moved to {}. \n".format(user.username, loc))
-            main_screen.ooc_window.update_subloc(user.username, user.get_loc().get_real_first_sub())
-        else:
-            main_screen.ooc_window.update_subloc(user.username, "Missingno")
         user.set_loc(loc, True)
-        main_screen.ooc_window.update_loc(user.username, loc)
+        if loc == user_handler.get_current_loc().name and user.get_char() is not None:
+            prefetcher.warm_user(user)
         main_screen.sprite_window.refresh_sub()
 
-class OOCMessage:
-
-    def __init__(self, sender, content=None):
-        self.sender = sender
-        self.content = content
-        self.remove_line_breaks()
-
-    def remove_line_breaks(self):
-        if self.content is None:
-            return
-        if '\n' in self.content or '\r' in self.content:
-            self.content = self.content.replace('\n', ' ')
-            self.content = self.content.replace('\r', ' ')
-
-    def to_irc(self):
-        msg = "OOC#{0}".format(self.content)
-        return msg
-
-    def from_irc(self, message):
-        try:
-            arguments = message.split('#', 1)
-            self.content = arguments[1]
-        except IndexError:
-            self.content = message
 
-        self.remove_line_breaks()
+class OOCMessage(protocol.OOCMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         main_screen.ooc_window.update_ooc(self.content, self.sender)
 
-class LOOCMessage:
 
-    def __init__(self, sender, location=None, content=None):
-        self.sender = sender
-        self.location = location
-        self.content = content
-        self.remove_line_breaks()
-
-    def remove_line_breaks(self):
-        if self.content is None:
-            return
-        if '\n' in self.content or '\r' in self.content:
-            self.content = self.content.replace('\n', ' ')
-            self.content = self.content.replace('\r', ' ')
-
-    def to_irc(self):
-        msg = "LOOC#{0}#{1}".format(self.location, self.content)
-        return msg
-
-    def from_irc(self, message):
-        try:
-            arguments = message.split('#', 2)
-            self.location = arguments[1]
-            self.content = arguments[2]
-        except IndexError:
-            self.content = message
-
-        self.remove_line_breaks()
+class LOOCMessage(protocol.LOOCMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler: CurrentUserHandler):
         username = self.sender
@@ -483,36 +248,12 @@ class LOOCMessage:
             if user is None:
                 connection_manager.on_join(username)
 
-        if self.location == user_handler.get_current_loc().name and user not in main_screen.ooc_window.muted_users:
+        if self.location == user_handler.get_current_loc().name and not main_screen.room_state.is_muted(username):
             main_screen.ooc_window.update_ooc(self.content, self.sender, True)
 
 
-class MusicMessage:
-
-    def __init__(self, sender, track_name=None, url=None):
-        self.sender = sender
-        self.track_name = track_name
-        self.url = url
-
-    def to_irc(self):
-        if self.track_name is None:
-            self.track_name = "0"
-        if self.url is None:
-            self.url = "0"
-        msg = "m#{0}#{1}".format(self.track_name, self.url)
-        return msg
-
-    def from_irc(self, message):
-        arguments = message.split('#', 2)
-        self.track_name = arguments[1]
-        if self.track_name == "0":
-            self.track_name = None
-        try:
-            self.url = arguments[2]
-        except IndexError:
-            self.url = None
-        if self.url == "0":
-            self.url = None
+class MusicMessage(protocol.MusicMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         username = self.sender
@@ -531,19 +272,8 @@ class MusicMessage:
                                                            self.track_name)
 
 
-class RollMessage:
-
-    def __init__(self, sender, roll=None):
-        self.sender = sender
-        self.roll = roll
-
-    def to_irc(self):
-        msg = "r#{0}".format(self.roll)
-        return msg
-
-    def from_irc(self, message):
-        arguments = message.split('#', 1)
-        self.roll = arguments[1]
+class RollMessage(protocol.RollMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         username = self.sender
@@ -556,27 +286,8 @@ class RollMessage:
         main_screen.log_window.add_entry("{} rolled {}.\n".format(username, self.roll))
 
 
-class ItemMessage:
-
-    def __init__(self, sender, item=None):
-        self.sender = sender
-        self.item = item
-        self.remove_line_breaks()
-
-    def remove_line_breaks(self):
-        if self.item is None:
-            return
-        if '\n' in self.item or '\r' in self.item:
-            self.item = self.item.replace('\n', ' ')
-            self.item = self.item.replace('\r', ' ')
-
-    def to_irc(self):
-        msg = "i#{0}".format(self.item)
-        return msg
-
-    def from_irc(self, message):
-        arguments = message.split('#', 1)
-        self.item = arguments[1]
+class ItemMessage(protocol.ItemMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         item_string = self.item
@@ -595,19 +306,8 @@ class ItemMessage:
         main_screen.log_window.add_entry("{} presented {}{}.\n".format(username, dcdi[0], entry_text))
 
 
-class ClearMessage:
-
-    def __init__(self, sender, location=None):
-        self.sender = sender
-        self.location = location
-
-    def to_irc(self):
-        msg = "cl#{0}".format(self.location)
-        return msg
-
-    def from_irc(self, message):
-        arguments = message.split('#', 1)
-        self.location = arguments[1]
+class ClearMessage(protocol.ClearMessage):
+    __slots__ = ()
 
     def execute(self, connection_manager, main_screen, user_handler):
         # TODO Make it work only for the person who is currently speaking
@@ -620,28 +320,308 @@ class ClearMessage:
             return None
 
 
+class FrameMessage(protocol.FrameMessage):
+    __slots__ = ()
+
+    def execute(self, connection_manager, main_screen, user_handler):
+        for msg in self.messages:
+            connection_manager.execute(msg, main_screen, user_handler)
+
+
+class HelloMessage(protocol.HelloMessage):
+    __slots__ = ()
+
+    def execute(self, connection_manager, main_screen, user_handler):
+        connection_manager.on_hello(self.sender, self.version)
+
+
+class PresenceMessage(protocol.PresenceMessage):
+    __slots__ = ()
+
+    def execute(self, connection_manager, main_screen, user_handler):
+        connection_manager.on_presence(self)
+
+    def apply(self, connection_manager, main_screen, user_handler):
+        """Replays every entry as the location, character and nullpost messages the users would have sent."""
+        own_username = user_handler.get_user().username
+        for username, location, sublocation, position, character, sprite, sprite_option, dance, link, version, \
+                protocol in self.entries:
+            if username == own_username:
+                continue
+            messages = []
+            if location:
+                messages.append(LocationMessage(username, location))
+            if character:
+                messages.append(CharacterMessage(username, character, link, version))
+            if location and character and sprite:
+                messages.append(IconMessage(username, location=location, sublocation=sublocation, character=character,
+                                            sprite=sprite, position=position, sprite_option=sprite_option,
+                                            dance=dance))
+            for msg in messages:
+                main_screen.room_state.apply(msg)
+                connection_manager.execute(msg, main_screen, user_handler)
+                connection_manager.presence_book.observe(msg)
+
+
+class MessageFactory(protocol.MessageFactory):
+    message_classes = (ChatMessage, IconMessage, ChoiceMessage, ChoiceReturnMessage, CharacterMessage, LocationMessage,
+                       OOCMessage, LOOCMessage, MusicMessage, RollMessage, ItemMessage, ClearMessage, FrameMessage,
+                       HelloMessage, PresenceMessage)
+
+
+class PresenceBook:
+    """Remembers the last state every user announced, as they announced it, to answer joins on their behalf."""
+
+    def __init__(self):
+        self.states = {}
+
+    def observe(self, msg):
+        if msg.sender == "default":
+            return
+        if isinstance(msg, protocol.FrameMessage):
+            for sub_message in msg.messages:
+                self.observe(sub_message)
+        elif isinstance(msg, (protocol.ChatMessage, protocol.IconMessage)):
+            state = self.states.setdefault(msg.sender, {})
+            state.update(location=msg.location, sublocation=msg.sublocation, position=msg.position,
+                         character=msg.character, sprite=msg.sprite, sprite_option=msg.sprite_option)
+            if isinstance(msg, protocol.IconMessage):
+                state['dance'] = msg.dance
+        elif isinstance(msg, protocol.CharacterMessage):
+            state = self.states.setdefault(msg.sender, {})
+            state.update(character=msg.character, link=msg.character_link, version=msg.version)
+        elif isinstance(msg, protocol.LocationMessage):
+            self.states.setdefault(msg.sender, {})['location'] = msg.location
+
+    def forget(self, username):
+        self.states.pop(username, None)
+
+    def get_entry(self, username):
+        state = self.states.get(username, {})
+        if not state.get('location') or not state.get('character'):
+            return None
+        fields = ('location', 'sublocation', 'position', 'character', 'sprite', 'sprite_option', 'dance', 'link',
+                  'version')
+        return (username,) + tuple('' if state.get(field) is None else str(state.get(field)) for field in fields)
+
+
 class MessageQueue:
     """Standard First-In-First-Out queue for irc messages.
+
+    Every message is stored along with the time it was enqueued, so the queue
+    can tell how far behind the channel the client is running.
     """
 
     def __init__(self):
-        self.messages = []
+        self.messages = deque()
+        self.last_enqueue_time = None
 
     def is_empty(self):
-        return self.messages == []
+        return not self.messages
 
-    def enqueue(self, msg):
-        self.messages.insert(0, msg)
+    def enqueue(self, msg, enqueue_time=None):
+        """enqueue_time defaults to now; received messages pass the time they came off the socket."""
+        if enqueue_time is None:
+            enqueue_time = time.monotonic()
+        self.messages.append((enqueue_time, msg))
 
     def dequeue(self):
         try:
-            return self.messages.pop()
+            self.last_enqueue_time, msg = self.messages.popleft()
+        except IndexError:
+            return None
+        return msg
+
+    def put_back(self, msg):
+        """Puts a message back at the head of the queue, keeping its original enqueue time."""
+        enqueue_time = self.last_enqueue_time
+        if enqueue_time is None:
+            enqueue_time = time.monotonic()
+        self.messages.appendleft((enqueue_time, msg))
+
+    def peek(self):
+        try:
+            return self.messages[0][1]
         except IndexError:
             return None
 
     def size(self):
         return len(self.messages)
 
+    def oldest_age(self):
+        """Seconds the message at the head of the queue has been waiting."""
+        try:
+            return time.monotonic() - self.messages[0][0]
+        except IndexError:
+            return 0.0
+
+
+class MessageScheduler:
+    """Splits incoming messages into lanes so chat animations don't stall state updates.
+
+    State/control messages and OOC/LOOC messages are handed out as soon as they arrive.
+    IC chat needs the text box, so its lane is held while a message is being displayed
+    and woken up by the text box once the animation is over.
+
+    Since state overtakes chat, a chat line can come out after a location or sprite its sender sent later.
+    Messages are numbered as they arrive so is_superseded() can tell, and the chat line only shows its text.
+    """
+    SPRITE_STATE_TYPES = (protocol.LocationMessage, protocol.IconMessage, protocol.CharacterMessage,
+                          protocol.FrameMessage)
+
+    def __init__(self):
+        self.lanes = {STATE_LANE: MessageQueue(), OOC_LANE: MessageQueue(), CHAT_LANE: MessageQueue()}
+        self.chat_held = False
+        self.last_enqueue_time = None
+        self.sequence = 0
+        self.last_sequence = 0
+        self.state_sequences = {}
+
+    def enqueue(self, msg, enqueue_time=None):
+        self.sequence += 1
+        self.lanes[msg.lane].enqueue((self.sequence, msg), enqueue_time)
+
+    def dequeue(self):
+        for lane, msg_q in self.lanes.items():
+            if lane == CHAT_LANE and self.chat_held:
+                continue
+            item = msg_q.dequeue()
+            if item is not None:
+                self.last_enqueue_time = msg_q.last_enqueue_time
+                self.last_sequence, msg = item
+                if isinstance(msg, self.SPRITE_STATE_TYPES):
+                    self.state_sequences[msg.sender] = self.last_sequence
+                elif isinstance(msg, protocol.PresenceMessage):
+                    for entry in msg.entries:
+                        self.state_sequences[entry[0]] = self.last_sequence
+                return msg
+        return None
+
+    def is_superseded(self, msg):
+        """True when msg, the chat line just dequeued, is older than a state its sender already got applied."""
+        return msg.lane == CHAT_LANE and self.last_sequence < self.state_sequences.get(msg.sender, 0)
+
+    def forget_sender(self, username):
+        self.state_sequences.pop(username, None)
+
+    def put_back(self, msg):
+        self.lanes[msg.lane].put_back((self.last_sequence, msg))
+        if msg.lane == CHAT_LANE:
+            self.hold_chat()
+
+    def hold_chat(self):
+        self.chat_held = True
+
+    def wake_chat(self):
+        self.chat_held = False
+
+    def has_ready(self):
+        for lane, msg_q in self.lanes.items():
+            if lane == CHAT_LANE and self.chat_held:
+                continue
+            if not msg_q.is_empty():
+                return True
+        return False
+
+    def is_empty(self):
+        return all(msg_q.is_empty() for msg_q in self.lanes.values())
+
+    def size(self):
+        return sum(msg_q.size() for msg_q in self.lanes.values())
+
+    def oldest_age(self):
+        return max(msg_q.oldest_age() for msg_q in self.lanes.values())
+
+
+class OutgoingQueue:
+    """Messages waiting to be sent, released by a token bucket to stay under the server's flood limits.
+
+    State updates only matter in their latest version, so a new icon, location or character message replaces
+    the one from the same sender still waiting in the queue, and goes behind what was queued after it. When the queue is full the oldest message is dropped,
+    except chat lines, which are always sent.
+    """
+    COALESCED_TYPES = (protocol.IconMessage, protocol.LocationMessage, protocol.CharacterMessage)
+
+    def __init__(self, burst=5, interval=0.5, max_size=OUTGOING_QUEUE_SIZE):
+        self.messages = deque()
+        self.burst = burst
+        self.interval = interval
+        self.max_size = max_size
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.last_enqueue_time = None
+        self.queued = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def configure(self, burst, interval):
+        self.burst = max(1, burst)
+        self.interval = max(0.0, interval)
+        self.tokens = min(self.tokens, self.burst)
+
+    def enqueue(self, msg, args=()):
+        self.queued += 1
+        if isinstance(msg, self.COALESCED_TYPES):
+            for i, (queued_msg, queued_args, enqueue_time) in enumerate(self.messages):
+                if type(queued_msg) is type(msg) and queued_msg.sender == msg.sender:
+                    del self.messages[i]
+                    self.messages.append((msg, args, enqueue_time))
+                    self.coalesced += 1
+                    return
+        if len(self.messages) >= self.max_size:
+            self.drop_oldest()
+        self.messages.append((msg, args, time.monotonic()))
+
+    def drop_oldest(self):
+        for i, (queued_msg, queued_args, enqueue_time) in enumerate(self.messages):
+            if not isinstance(queued_msg, protocol.ChatMessage):
+                del self.messages[i]
+                self.dropped += 1
+                return
+
+    def put_back(self, msg, args=()):
+        """Returns a message that couldn't be sent to the head of the queue, giving its token back."""
+        self.messages.appendleft((msg, args, self.last_enqueue_time))
+        self.tokens = min(self.tokens + 1, self.burst)
+
+    def refill(self):
+        now = time.monotonic()
+        if self.interval == 0:
+            self.tokens = self.burst
+        else:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) / self.interval)
+        self.last_refill = now
+
+    def dequeue(self):
+        """Returns the next message and its arguments if a token is available, None otherwise."""
+        if not self.messages:
+            return None
+        self.refill()
+        if self.tokens < 1:
+            return None
+        self.tokens -= 1
+        msg, args, self.last_enqueue_time = self.messages.popleft()
+        return msg, args
+
+    def consume(self, count):
+        """Takes tokens for the extra lines a message was split into; the balance can go below zero."""
+        self.tokens -= count
+
+    def time_until_ready(self):
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) * self.interval
+
+    def size(self):
+        return len(self.messages)
+
+    def is_empty(self):
+        return not self.messages
+
+    def get_metrics(self):
+        return {'queued': self.queued, 'dropped': self.dropped, 'coalesced': self.coalesced,
+                'waiting': len(self.messages)}
+
 
 class PrivateMessage:
     def __init__(self, msg, sender="default", receiver="default"):
@@ -658,52 +638,81 @@ class PrivateConversation:
 
 class PrivateMessageQueue:
     """Standard First-In-First-Out queue for irc messages.
+
+    Appending and popping from the deque are atomic, so the network thread can enqueue safely.
     """
     def __init__(self):
-        self.private_messages = []
+        self.private_messages = deque()
 
     def enqueue(self, msg, sender):
         message = PrivateMessage(msg, sender, "no")
-        self.private_messages.insert(0, message)
+        self.private_messages.append(message)
 
     def dequeue(self):
         try:
-            return self.private_messages.pop()
+            return self.private_messages.popleft()
         except IndexError:
             return None
 
 
 class IrcConnection:
 
-    def __init__(self, server, port, channel, username, password=None):
+    def __init__(self, server, port, channel, username, password=None, message_factory=None):
         irc.client.ServerConnection.buffer_class = buffer.LenientDecodingLineBuffer
         self.reactor = irc.client.Reactor()
         self.username = username
         self.server = server
         self.channel = channel
         self._joined = False
-        self.msg_q = MessageQueue()
+        self.msg_q = MessageScheduler()
+        self.inbox = queue.Queue()
+        self.telemetry = Telemetry()
+        self.profiler = HandlerProfiler()
+        self.pending_bytes = {}
         self.p_msg_q = PrivateMessageQueue()
+        self.network_thread = None
+        self.running = False
         self.on_join_handler = None
+        self.on_self_join_handler = None
         self.on_users_handler = None
+        self.on_users_end_handler = None
         self.on_disconnect_handler = None
+        self.on_connection_lost_handler = None
         self.connection_manager = None
+        self.recorder = None
+        if message_factory is None:
+            message_factory = App.get_running_app().get_message_factory()
+        self.message_factory = message_factory
 
         if password is not None:
             if not password.strip():
                 password = None
 
         self.password = password
+        self.connection = self.connect(port, username)
 
+        events = ["welcome", "join", "quit", "pubmsg", "nicknameinuse", "namreply", "endofnames", "privnotice",
+                  "privmsg", "pong", "disconnect", "ctcp"]
+        for e in events:
+            self.connection.add_global_handler(e, getattr(self, "on_" + e))
+
+    def connect(self, port, username):
         try:
-            self.connection = self.reactor.server().connect(self.server, port, username)
+            return self.reactor.server().connect(self.server, port, username)
         except irc.client.ServerConnectionError:
             Logger.warning('IRC: Could not connect to server')
             raise
 
-        events = ["welcome", "join", "quit", "pubmsg", "nicknameinuse", "namreply", "privnotice", "privmsg", "pong"]
-        for e in events:
-            self.connection.add_global_handler(e, getattr(self, "on_" + e))
+    def start_recording(self, path):
+        """Writes every incoming message, join and quit to path, to replay them later with ReplayConnection."""
+        self.recorder = TrafficRecorder(path)
+        for e in RECORDED_EVENTS:
+            self.connection.add_global_handler(e, self.recorder.on_event, -10)
+        Logger.info('IRC: Recording the traffic to {}'.format(path))
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
 
     def set_connection_manager(self, connection_manager):
         self.connection_manager = connection_manager
@@ -711,8 +720,19 @@ class IrcConnection:
     def get_msg(self):
         return self.msg_q.dequeue()
 
+    def pump_inbox(self):
+        """Moves the messages parsed by the network side into the scheduler. Called from the UI thread."""
+        while True:
+            try:
+                msg, received, parse_time, size = self.inbox.get_nowait()
+            except queue.Empty:
+                return
+            self.telemetry.record(PARSE, parse_time)
+            self.profiler.record_received(type(msg).__name__, size)
+            self.msg_q.enqueue(msg, received)
+
     def put_back_msg(self, msg):
-        self.msg_q.messages.append(msg)
+        self.msg_q.put_back(msg)
 
     def get_pm(self):
         return self.p_msg_q.dequeue()
@@ -729,11 +749,18 @@ class IrcConnection:
 
     def send_private_msg(self, receiver, sender, msg):
         pm = PrivateMessage(msg, sender, receiver)
-        self.p_msg_q.private_messages.insert(0, pm)
+        self.p_msg_q.private_messages.append(pm)
+        if self.connection_manager.can_fragment(receiver):
+            for line in self.message_factory.fragment(msg):
+                self.connection.privmsg(receiver, line)
+            return
         if len(msg) > 480:  # controls the msg length so it doesn't crash
             msg = (msg[:480] + '..')
         self.connection.privmsg(receiver, msg)
 
+    def send_ctcp(self, ctcp_type, data):
+        self.connection.ctcp(ctcp_type, self.channel, data)
+
     def send_mode(self, username, msg):
         self.connection.mode(username, msg)
 
@@ -743,9 +770,61 @@ class IrcConnection:
     def is_connected(self):
         return self._joined
 
+    def reconnect(self):
+        """Reconnects with the same server, port and nickname. Raises ServerConnectionError on failure."""
+        self._joined = False
+        self.connection.reconnect()
+
+    def reconnect_async(self, on_success, on_failure):
+        """Reconnects on the network thread when there is one, so resolving and connecting don't freeze the UI.
+
+        on_success() or on_failure() is then called from the UI thread.
+        """
+        def attempt():
+            try:
+                self.reconnect()
+            except irc.client.ServerConnectionError:
+                self.run_on_ui(on_failure)
+                return
+            self.run_on_ui(on_success)
+
+        if not self.is_threaded():
+            attempt()
+            return
+        with self.reactor.mutex:
+            self.reactor.scheduler.execute_after(0, attempt)
+
     def process(self):
         self.reactor.process_once()
 
+    def start_network_thread(self):
+        """Runs the reactor on a background thread instead of polling it from the Kivy Clock."""
+        if self.network_thread is not None:
+            return
+        self.running = True
+        self.network_thread = threading.Thread(target=self.run_network_loop, name='irc-network', daemon=True)
+        self.network_thread.start()
+
+    def stop_network_thread(self):
+        self.running = False
+
+    def is_threaded(self):
+        return self.network_thread is not None
+
+    def run_network_loop(self):
+        while self.running:
+            try:
+                self.reactor.process_once(timeout=0.2)
+            except Exception:
+                Logger.warning(traceback.format_exc())
+
+    def run_on_ui(self, callback, *args):
+        """Handlers that touch widgets have to run on the UI thread."""
+        if self.is_threaded():
+            Clock.schedule_once(lambda dt: callback(*args))
+        else:
+            callback(*args)
+
     def on_welcome(self, c, e):
         if irc.client.is_channel(self.channel):
             c.join(self.channel, self.password)
@@ -756,29 +835,60 @@ class IrcConnection:
         self._joined = True
         nick = e.source.nick
         if c.nickname != nick:
-            self.on_join_handler(nick)
+            self.run_on_ui(self.on_join_handler, nick)
+        elif self.on_self_join_handler is not None:
+            self.run_on_ui(self.on_self_join_handler)
 
     def on_quit(self, c, e):
         nick = e.source.nick
-        self.on_disconnect_handler(nick)
+        self.run_on_ui(self.on_disconnect_handler, nick)
 
     def on_pubmsg(self, c, e):
+        received = time.monotonic()
+        start = time.perf_counter()
         msg = e.arguments[0]
-        message_factory = App.get_running_app().get_message_factory()
+        size = len(msg.encode('utf-8')) + self.pending_bytes.pop(e.source.nick, 0)
+        message_factory = self.message_factory
         try:
             message = message_factory.build_from_irc(msg, e.source.nick)
         except IncorrectMessageTypeError:
             return
-        self.msg_q.enqueue(message)
+        if message is None:
+            self.pending_bytes[e.source.nick] = size  # Only a fragment, counted with the whole message
+            return
+        self.inbox.put((message, received, time.perf_counter() - start, size))
+
+    def on_ctcp(self, c, e):
+        received = time.monotonic()
+        start = time.perf_counter()
+        message_factory = self.message_factory
+        try:
+            message = message_factory.build_from_ctcp(e.arguments, e.source.nick)
+        except IncorrectMessageTypeError:
+            return
+        size = sum(len(argument.encode('utf-8')) for argument in e.arguments)
+        self.inbox.put((message, received, time.perf_counter() - start, size))
 
     def on_namreply(self, c, e):
-        self.on_users_handler(e.arguments[2])
+        self.run_on_ui(self.on_users_handler, e.arguments[2])
+
+    def on_endofnames(self, c, e):
+        if self.on_users_end_handler is not None:
+            self.run_on_ui(self.on_users_end_handler)
+
+    def on_disconnect(self, c, e):
+        self._joined = False
+        if self.on_connection_lost_handler is not None:
+            self.run_on_ui(self.on_connection_lost_handler)
 
     def on_privnotice(self, c, e):
         server_response = e.arguments[0]
         Logger.info('IRC: {}'.format(server_response))
 
     def on_nicknameinuse(self, c, e):
+        self.run_on_ui(self.pick_new_nickname, c)
+
+    def pick_new_nickname(self, c):
         if len(App.get_running_app().get_user().username) < 16:
             c.nick(App.get_running_app().get_user().username + '_')
             App.get_running_app().get_user().username += '_'
@@ -794,11 +904,87 @@ class IrcConnection:
         temp_pop.open()
 
     def on_privmsg(self, c, e):
-        msg = e.arguments[0]
+        message_factory = self.message_factory
+        try:
+            msg = message_factory.reassemble(e.arguments[0], e.source.nick)
+        except IncorrectMessageTypeError:
+            return
+        if msg is None:
+            return
         self.p_msg_q.enqueue(msg, e.source.nick)
 
     def on_pong(self, c, e):
-        self.connection_manager.receive_pong()
+        self.run_on_ui(self.connection_manager.receive_pong)
+
+
+class ReplayServerConnection:
+    """Takes the place of the server connection during a replay: whatever the client sends goes nowhere."""
+
+    def __init__(self, nickname):
+        self.nickname = nickname
+
+    def add_global_handler(self, event, handler, priority=0):
+        pass
+
+    def join(self, channel, key=""):
+        pass
+
+    def nick(self, new_nick):
+        self.nickname = new_nick
+
+    def privmsg(self, target, text):
+        pass
+
+    def ctcp(self, ctcp_type, target, parameter=""):
+        pass
+
+    def mode(self, target, command):
+        pass
+
+    def ping(self, target, target2=""):
+        pass
+
+    def reconnect(self):
+        pass
+
+
+class ReplayConnection(IrcConnection):
+    """Feeds a capture made with --record through the IrcConnection handlers, without a network.
+
+    Events are handed out from process(), on the UI thread, speed times faster than they were recorded
+    (0 for as fast as possible). Once the capture has been played and executed, the frame times are logged.
+    """
+
+    def __init__(self, path, speed, channel, username, message_factory=None):
+        self.replay = TrafficReplay(load_capture(path), speed)
+        self.frame_times = FrameTimes()
+        self.last_frame = None
+        self.reported = False
+        super().__init__("replay", 0, channel, username, message_factory=message_factory)
+
+    def connect(self, port, username):
+        Logger.info('IRC: Replaying {} events'.format(len(self.replay.events)))
+        return ReplayServerConnection(username)
+
+    def start_network_thread(self):
+        pass
+
+    def process(self):
+        now = time.perf_counter()
+        if self.last_frame is not None:
+            self.frame_times.add(now - self.last_frame)
+        self.last_frame = now
+        if not self._joined:
+            self._joined = True
+            if self.on_self_join_handler is not None:
+                self.on_self_join_handler()
+        for record in self.replay.due(now):
+            event = irc.client.Event(record["type"], irc.client.NickMask(record["source"]), record["target"],
+                                     record["arguments"])
+            getattr(self, "on_" + record["type"])(self.connection, event)
+        if not self.reported and self.replay.is_done() and self.inbox.empty() and self.msg_q.is_empty():
+            self.reported = True
+            Logger.info('Replay: {}'.format(self.frame_times.format_summary()))
 
 
 class ConnectionManager:
@@ -808,15 +994,57 @@ class ConnectionManager:
         self.irc_connection.set_connection_manager(self)
         self.not_again_flag = False
         self.ping_event = None
+        self.ping_sent = None
+        self.display_started = None
         self.disconnected_event = None
+        self.frame_budget = 0.008
+        self.catch_up_instant_depth = 5
+        self.catch_up_log_depth = 15
+        self.catching_up = False
+        self.last_backlog_warning = 0.0
+        self.reconnecting = False
+        self.reconnect_attempt = 0
+        self.reconnect_event = None
+        self.outgoing = OutgoingQueue()
+        self.flush_event = None
+        self.names_seen = None
+        self.presence_book = PresenceBook()
+        self.peer_versions = {}
+        self.pending_presence = {}
+        self.setup_settings()
         self.reschedule_ping()
 
+    def setup_settings(self):
+        config = App.get_running_app().config
+        for key in ('chat_frame_budget', 'catch_up_instant_depth', 'catch_up_log_depth', 'send_burst',
+                    'send_interval'):
+            config.add_callback(self.on_setting_change, 'other', key)
+        self.load_settings()
+
+    def load_settings(self):
+        config = App.get_running_app().config
+        try:
+            self.frame_budget = config.getdefaultint('other', 'chat_frame_budget', 8) / 1000.0
+            self.catch_up_instant_depth = config.getdefaultint('other', 'catch_up_instant_depth', 5)
+            self.catch_up_log_depth = config.getdefaultint('other', 'catch_up_log_depth', 15)
+        except ValueError:
+            Logger.warning('IRC: Invalid chat backlog settings')
+        try:
+            self.outgoing.configure(config.getdefaultint('other', 'send_burst', 5),
+                                    config.getdefaultint('other', 'send_interval', 500) / 1000.0)
+        except ValueError:
+            Logger.warning('IRC: Invalid flood control settings')
+
+    def on_setting_change(self, s, k, v):
+        self.load_settings()
+
     def reschedule_ping(self):
         if self.ping_event is not None:
             self.ping_event.cancel()
         self.ping_event = Clock.schedule_interval(self.ping, 15)
 
     def ping(self, dt):
+        self.ping_sent = time.monotonic()
         try:
             self.irc_connection.send_ping()
         except irc.client.ServerNotConnectedError:
@@ -824,15 +1052,77 @@ class ConnectionManager:
         self.disconnected_event = Clock.schedule_once(self.get_disconnected, 10)
 
     def get_disconnected(self, *args):
+        if self.reconnecting:
+            return
+        self.ping_event.cancel()
         if self.not_again_flag is False:
-            self.ping_event.cancel()
-            popup = MOPopup("Disconnected", "Seems you might be disconnected from IRC :(", "Okay.")
+            popup = MOPopup("Disconnected", "Seems you might be disconnected from IRC :(\nTrying to reconnect.",
+                            "Okay.")
             popup.create_button("Don't show this again", False, btn_command=self.set_flag())
             popup.size = 800 / 2, 600 / 3
             popup.pos_hint = {'top': 1}
             popup.background_color = [0, 0, 0, 0]
             popup.open()
-            # TODO Implement reconnection strategy
+        self.start_reconnecting()
+
+    def start_reconnecting(self):
+        if self.reconnecting:
+            return
+        self.reconnecting = True
+        self.reconnect_attempt = 0
+        if self.disconnected_event is not None:
+            self.disconnected_event.cancel()
+        self.schedule_reconnect()
+
+    def schedule_reconnect(self):
+        """Waits a jittered, exponentially growing delay before the next reconnection attempt."""
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** self.reconnect_attempt)
+        delay = random.uniform(delay / 2, delay)
+        self.reconnect_attempt += 1
+        main_scr = App.get_running_app().get_main_screen()
+        if main_scr is not None:
+            main_scr.log_window.add_entry("Connection lost, reconnecting in {:.0f}s...\n".format(delay))
+        self.reconnect_event = Clock.schedule_once(self.try_reconnect, delay)
+
+    def try_reconnect(self, *args):
+        self.reconnect_event = None
+        self.irc_connection.reconnect_async(self.on_reconnected, self.on_reconnect_failed)
+
+    def on_reconnected(self):
+        if not self.reconnecting:
+            return
+        self.reconnect_event = Clock.schedule_once(self.on_reconnect_timeout, RECONNECT_JOIN_TIMEOUT)
+
+    def on_reconnect_failed(self):
+        Logger.warning('IRC: Reconnection attempt {} failed'.format(self.reconnect_attempt))
+        self.schedule_reconnect()
+
+    def on_reconnect_timeout(self, *args):
+        Logger.warning("IRC: Reconnected but couldn't join the channel in time")
+        self.schedule_reconnect()
+
+    def on_channel_joined(self):
+        """Called every time we join the channel, resyncs the room if it was a reconnection."""
+        message_factory = App.get_running_app().get_message_factory()
+        message_factory.reset_sent_states()
+        self.send_msg(message_factory.build_hello_message())
+        if not self.reconnecting:
+            return
+        self.reconnecting = False
+        self.reconnect_attempt = 0
+        if self.reconnect_event is not None:
+            self.reconnect_event.cancel()
+            self.reconnect_event = None
+        self.names_seen = set()
+        self.reschedule_ping()
+        App.get_running_app().get_main_screen().log_window.add_entry("Reconnected.\n")
+        self.resync()
+
+    def resync(self):
+        """Sends what was typed while offline, then tells the channel where we are and what we look like."""
+        user = App.get_running_app().get_user()
+        self.irc_connection.send_mode(user.username, "-R")
+        self.send_current_state()
 
     def set_flag(self):
         self.not_again_flag = not self.not_again_flag
@@ -843,24 +1133,179 @@ class ConnectionManager:
     def receive_pong(self):
         if self.disconnected_event is not None:
             self.disconnected_event.cancel()
+        if self.ping_sent is not None:
+            self.irc_connection.telemetry.record(RTT, time.monotonic() - self.ping_sent)
+            self.ping_sent = None
 
     def send_msg(self, msg, *args):
-        try:
-            irc_message = msg.to_irc()
-            self.irc_connection.send_msg(irc_message, *args)
-        except irc.client.ServerNotConnectedError:
-            self.get_disconnected()
-        self.reschedule_ping()
+        """Queues a message for the channel; it is sent as soon as flood control allows it."""
+        self.outgoing.enqueue(msg, args)
+        self.flush_outgoing()
+
+    def flush_outgoing(self, *args):
+        """Sends queued messages while there are tokens left, and comes back when the next one is available.
+
+        Nothing is sent while reconnecting, the queue is flushed again once the channel is joined.
+        """
+        if self.flush_event is not None:
+            self.flush_event.cancel()
+            self.flush_event = None
+        message_factory = App.get_running_app().get_message_factory()
+        sent = False
+        while not self.reconnecting:
+            item = self.outgoing.dequeue()
+            if item is None:
+                break
+            msg, msg_args = item
+            try:
+                line_count = self.send_queued(message_factory, msg, msg_args)
+                self.irc_connection.telemetry.record(SEND_WAIT, time.monotonic() - self.outgoing.last_enqueue_time)
+            except irc.client.ServerNotConnectedError:
+                # The encoder already counted this message as sent, the next one has to be a keyframe.
+                message_factory.reset_sent_states()
+                self.outgoing.put_back(msg, msg_args)
+                self.get_disconnected()
+                return
+            except (irc.client.MessageTooLong, MessageTooLong):
+                Logger.warning('IRC: Dropped a message too long to send')
+                message_factory.reset_sent_states()
+                self.outgoing.dropped += 1
+                popup = MOPopup("Warning", "A message was too long to send", "OK")
+                popup.open()
+                continue
+            self.outgoing.consume(line_count - 1)
+            sent = True
+        if sent:
+            self.reschedule_ping()
+        if not self.reconnecting and not self.outgoing.is_empty():
+            self.flush_event = Clock.schedule_once(self.flush_outgoing, self.outgoing.time_until_ready())
+
+    def send_queued(self, message_factory, msg, msg_args):
+        """Sends a message taken from the outgoing queue and returns how many lines it took."""
+        if isinstance(msg, (HelloMessage, PresenceMessage)):
+            self.irc_connection.send_ctcp(*msg.to_ctcp())
+            return 1
+        lines = self.encode(message_factory, msg)
+        for line in lines:
+            self.irc_connection.send_msg(line, *msg_args)
+        return len(lines)
+
+    def encode(self, message_factory, msg):
+        """Returns the lines to send for a message, using what every client in the channel understands."""
+        delta = self.is_delta_allowed()
+        if isinstance(msg, FrameMessage) and not self.do_peers_support(FRAME_PROTOCOL_VERSION):
+            lines = [message_factory.encode(sub_message, delta) for sub_message in msg.messages]
+        else:
+            lines = [message_factory.encode(msg, delta)]
+        if self.can_fragment():
+            lines = [fragment for line in lines for fragment in message_factory.fragment(line)]
+        return lines
+
+    def do_peers_support(self, version):
+        """Tells if every other user in the channel runs at least that protocol version."""
+        main_scr = App.get_running_app().get_main_screen()
+        if main_scr is None:
+            return False
+        username = App.get_running_app().get_user().username
+        return all(self.peer_versions.get(other, 0) >= version for other in main_scr.users if other != username)
+
+    def is_delta_allowed(self):
+        """Delta encoding is only used when every other user in the channel can decode it."""
+        return self.do_peers_support(DELTA_PROTOCOL_VERSION)
+
+    def can_fragment(self, receiver=None):
+        """Tells if long messages can be split, for a private message to receiver or for the whole channel."""
+        if receiver is not None:
+            return self.peer_versions.get(receiver, 0) >= FRAGMENT_PROTOCOL_VERSION
+        return self.do_peers_support(FRAGMENT_PROTOCOL_VERSION)
+
+    def get_max_message_length(self, legacy_length, receiver=None):
+        """Returns how long a message can be: legacy_length unless it can be split into fragments."""
+        if self.can_fragment(receiver):
+            return MAX_MESSAGE_LENGTH
+        return legacy_length
 
     def send_local(self, msg):
         self.irc_connection.msg_q.enqueue(msg)
 
     def update_chat(self, dt):
-        msg = self.irc_connection.get_msg()
-        if msg is not None:
-            main_scr = App.get_running_app().get_main_screen()
-            user_handler = App.get_running_app().get_user_handler()
-            msg.execute(self, main_scr, user_handler)
+        """Executes queued messages until the queue is empty or the frame budget runs out."""
+        self.irc_connection.pump_inbox()
+        msg_q = self.irc_connection.msg_q
+        if not msg_q.has_ready():
+            return
+        main_scr = App.get_running_app().get_main_screen()
+        user_handler = App.get_running_app().get_user_handler()
+        deadline = time.perf_counter() + self.frame_budget
+        while msg_q.has_ready():
+            msg = self.irc_connection.get_msg()
+            if msg.lane == CHAT_LANE and main_scr.text_box.is_displaying_msg:
+                self.irc_connection.put_back_msg(msg)
+                continue
+            telemetry = self.irc_connection.telemetry
+            now = time.monotonic()
+            telemetry.record(QUEUE, now - msg_q.last_enqueue_time)
+            superseded = msg_q.is_superseded(msg)
+            if not superseded:
+                main_scr.room_state.apply(msg)
+            telemetry.record(EXECUTE, self.execute(msg, main_scr, user_handler))
+            if not superseded:
+                self.presence_book.observe(msg)
+            if msg.lane == CHAT_LANE and main_scr.text_box.is_displaying_msg:
+                telemetry.record(DISPLAY_START, now - msg_q.last_enqueue_time)
+                self.display_started = now
+                msg_q.hold_chat()
+            if time.perf_counter() >= deadline:
+                break
+        self.check_backlog()
+
+    def execute(self, msg, main_scr, user_handler):
+        """Executes a message, counting it in the handler profiler. Returns how long it took."""
+        start = time.perf_counter()
+        msg.execute(self, main_scr, user_handler)
+        elapsed = time.perf_counter() - start
+        self.irc_connection.profiler.record_execute(type(msg).__name__, elapsed)
+        return elapsed
+
+    def on_text_displayed(self, *args):
+        if self.display_started is not None:
+            self.irc_connection.telemetry.record(DISPLAY, time.monotonic() - self.display_started)
+            self.display_started = None
+        self.irc_connection.msg_q.wake_chat()
+
+    def get_chat_display_mode(self):
+        """Decides how the chat message being executed is displayed, based on how many are waiting behind it.
+
+        Past catch_up_instant_depth messages are displayed instantly. Past catch_up_log_depth, every message
+        but the newest one only goes to the log, so the client can't fall too far behind the channel.
+        A depth of 0 turns the corresponding behaviour off.
+        """
+        waiting = self.irc_connection.msg_q.lanes[CHAT_LANE].size()
+        if 0 < self.catch_up_log_depth <= waiting:
+            self.catching_up = True
+        if self.catching_up:
+            if waiting > 0:
+                return LOG_ONLY_DISPLAY
+            self.catching_up = False
+            return INSTANT_DISPLAY
+        if 0 < self.catch_up_instant_depth <= waiting:
+            return INSTANT_DISPLAY
+        return NORMAL_DISPLAY
+
+    def get_backlog(self):
+        """Returns the number of queued messages and how long the oldest one has been waiting."""
+        msg_q = self.irc_connection.msg_q
+        return msg_q.size(), msg_q.oldest_age()
+
+    def check_backlog(self):
+        depth, age = self.get_backlog()
+        if age < 2.0:
+            return
+        now = time.monotonic()
+        if now - self.last_backlog_warning < 10.0:
+            return
+        self.last_backlog_warning = now
+        Logger.warning('IRC: {} messages waiting, falling {:.1f}s behind the channel'.format(depth, age))
 
     def update_music(self, track_name, url=None):
         message_factory = App.get_running_app().get_message_factory()
@@ -868,7 +1313,6 @@ class ConnectionManager:
         self.send_msg(message)
 
     def update_char(self, main_scr, char, username, char_link, version):
-        main_scr.ooc_window.update_char(username, char)
         user = App.get_running_app().get_user()
         if username == user.username:
             return
@@ -887,25 +1331,108 @@ class ConnectionManager:
         user = user_handler.get_user()
         if user.username == username:
             return
+        App.get_running_app().get_message_factory().reset_sent_states()
         if username not in main_scr.users:
             main_scr.users[username] = User(username)
             main_scr.ooc_window.add_user(main_scr.users[username])
+        main_scr.room_state.add_user(username)
         main_scr.log_window.add_entry("{} has joined.\n".format(username))
-        loc = user_handler.get_current_loc().name
-        message_factory = App.get_running_app().get_message_factory()
-        loc_message = message_factory.build_location_message(loc)
-        self.send_msg(loc_message)
+        if username in self.pending_presence:
+            return
+        delay = random.uniform(PRESENCE_MIN_DELAY, PRESENCE_MAX_DELAY)
+        self.pending_presence[username] = Clock.schedule_once(partial(self.answer_join, username), delay)
+
+    def answer_join(self, username, *args):
+        """Answers a join after a random delay, unless another client already did it for us.
+
+        Clients that said hello get a single presence summary of the room, older ones get our location,
+        character and nullpost like before.
+        """
+        del self.pending_presence[username]
+        main_scr = App.get_running_app().get_main_screen()
+        if username not in main_scr.users:
+            return
+        if username in self.peer_versions:
+            self.send_presence(username)
+        else:
+            self.send_current_state()
+
+    def send_current_state(self):
+        """Sends our location, character and nullpost in a single frame."""
+        app = App.get_running_app()
+        user_handler: CurrentUserHandler = app.get_user_handler()
+        user = user_handler.get_user()
+        message_factory = app.get_message_factory()
+        messages = [message_factory.build_location_message(user_handler.get_current_loc().name)]
         char = user.get_char()
         if char is not None:
-            message_factory = App.get_running_app().get_message_factory()
-            char_msg = message_factory.build_character_message(char.name, char.link, char.version)
-            self.send_msg(char_msg)
-            App.get_running_app().send_current_nullpost()
+            messages.append(message_factory.build_character_message(char.name, char.link, char.version))
+            messages.append(app.build_current_nullpost())
+        self.send_msg(message_factory.build_frame_message(messages))
+
+    def send_presence(self, target):
+        """Sends our own state and the state of every client that understands summaries, split to fit in a line."""
+        entries = [self.get_own_presence_entry()]
+        for username, version in self.peer_versions.items():
+            entry = self.presence_book.get_entry(username)
+            if entry is not None and username != target:
+                entries.append(entry + (str(version),))
+        message_factory = App.get_running_app().get_message_factory()
+        chunk = []
+        length = len(target)
+        for entry in entries:
+            entry_length = sum(len(field) + 1 for field in entry)
+            if chunk and length + entry_length > PRESENCE_MAX_LENGTH:
+                self.send_msg(message_factory.build_presence_message(target, chunk))
+                chunk = []
+                length = len(target)
+            chunk.append(entry)
+            length += entry_length
+        self.send_msg(message_factory.build_presence_message(target, chunk))
+
+    def get_own_presence_entry(self):
+        app = App.get_running_app()
+        user_handler = app.get_user_handler()
+        user = user_handler.get_user()
+        char = user.get_char()
+        char_fields = (char.name, char.link, char.version) if char is not None else (None, None, None)
+        sprite_name = user.get_current_sprite_source()[1] if char is not None else None
+        fields = (user_handler.get_current_loc().name, user_handler.get_current_subloc_name(), user.get_pos(),
+                  char_fields[0], sprite_name, user_handler.get_current_sprite_option(), user.get_dance(),
+                  char_fields[1], char_fields[2], PROTOCOL_VERSION)
+        return (user.username,) + tuple('' if field is None else str(field) for field in fields)
+
+    def on_hello(self, username, version):
+        self.peer_versions[username] = version
+
+    def on_presence(self, msg):
+        """Another client answered a join: no need to answer it ourselves."""
+        self.peer_versions.setdefault(msg.sender, 1)
+        for entry in msg.entries:
+            try:
+                self.peer_versions[entry[0]] = int(entry[-1])
+            except ValueError:
+                self.peer_versions.setdefault(entry[0], 1)
+        event = self.pending_presence.pop(msg.target, None)
+        if event is not None:
+            event.cancel()
+        user_handler = App.get_running_app().get_user_handler()
+        if msg.target == user_handler.get_user().username:
+            main_scr = App.get_running_app().get_main_screen()
+            msg.apply(self, main_scr, user_handler)
 
     def on_disconnect(self, username):
+        self.presence_book.forget(username)
+        self.peer_versions.pop(username, None)
+        App.get_running_app().get_message_factory().forget_sender(username)
+        event = self.pending_presence.pop(username, None)
+        if event is not None:
+            event.cancel()
         main_scr = App.get_running_app().get_main_screen()
         main_scr.log_window.add_entry("{} has disconnected.\n".format(username))
         main_scr.ooc_window.delete_user(username)
+        main_scr.room_state.remove_user(username)
+        self.irc_connection.msg_q.forget_sender(username)
         try:
             main_scr.users[username].remove()
             del main_scr.users[username]
@@ -917,8 +1444,22 @@ class ConnectionManager:
         user = App.get_running_app().get_user()
         users = users.split()
         for u in users:
+            if self.names_seen is not None:
+                self.names_seen.add(u)
+                self.names_seen.add(u.lstrip('@+'))
             if u == "@" + user.username:
                 continue
-            if u != user.username:
+            if u != user.username and u not in main_scr.users:
                 main_scr.users[u] = User(u)
                 main_scr.ooc_window.add_user(main_scr.users[u])
+                main_scr.room_state.add_user(u)
+
+    def on_join_users_end(self):
+        """After a reconnection, drops the users that left while we were away."""
+        if self.names_seen is None:
+            return
+        main_scr = App.get_running_app().get_main_screen()
+        for username in list(main_scr.users):
+            if username not in self.names_seen:
+                self.on_disconnect(username)
+        self.names_seen = None
@@ -0,0 +1,390 @@
+"""Small IRC server for running Mystery Online clients on localhost, for integration and load tests.
+
+It implements what the client uses: NICK, USER, JOIN, PART, PRIVMSG, NOTICE, NAMES, PING, PONG, QUIT and MODE.
+Optional per-client flood limits mimic a real network, and latency, jitter and dropped messages can be injected
+into PRIVMSG/NOTICE delivery.
+
+Usage: python -m MysteryOnline.irc_server [--port 6667] [--flood-burst N --flood-interval S] [--latency S]
+[--jitter S] [--drop-rate P]
+Point irc_channel_name.ini at 127.0.0.1 and that port to connect the client to it.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SERVER_NAME = 'mo.localhost'
+MAX_LINE_LENGTH = 512
+
+
+class LocalClient:
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.nick = None
+        self.user = None
+        self.registered = False
+        self.channels = set()
+        self.modes = set()
+        self.tokens = server.flood_burst
+        self.last_refill = time.monotonic()
+        self.closed = False
+        self.outbox = deque()
+
+    @property
+    def prefix(self):
+        return "{}!{}@localhost".format(self.nick, self.user or self.nick)
+
+    def send(self, line):
+        if self.closed or self.writer.is_closing():
+            return
+        self.writer.write((line[:MAX_LINE_LENGTH - 2] + "\r\n").encode('utf-8', errors='replace'))
+
+    def send_at(self, deadline, line):
+        """Sends the line at the loop time deadline, never before the lines delayed earlier, so order is kept."""
+        if self.outbox:
+            deadline = max(deadline, self.outbox[-1][0])
+        self.outbox.append((deadline, line))
+        self.server.loop.call_at(deadline, self.flush_outbox)
+
+    def flush_outbox(self):
+        now = self.server.loop.time()
+        while self.outbox and self.outbox[0][0] <= now:
+            self.send(self.outbox.popleft()[1])
+
+    def reply(self, code, *params):
+        self.send(":{} {} {} {}".format(SERVER_NAME, code, self.nick or '*', " ".join(params)))
+
+    def take_token(self):
+        """Token bucket: every line costs a token, one comes back every flood_interval seconds."""
+        if self.server.flood_burst is None:
+            return True
+        now = time.monotonic()
+        refill = (now - self.last_refill) / self.server.flood_interval
+        self.tokens = min(self.server.flood_burst, self.tokens + refill)
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LocalIrcServer:
+
+    def __init__(self, host='127.0.0.1', port=0, flood_burst=None, flood_interval=2.0, latency=0.0, jitter=0.0,
+                 drop_rate=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.flood_burst = flood_burst
+        self.flood_interval = flood_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.clients = {}
+        self.channels = {}
+        self.channel_modes = {}
+        self.dropped = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = threading.Event()
+        self.error = None
+
+    def start(self):
+        """Runs the server on a background thread, returns the (host, port) it listens on."""
+        self.thread = threading.Thread(target=self.run, name="LocalIrcServer", daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+        return self.host, self.port
+
+    def stop(self):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_client, self.host, self.port))
+        except OSError as e:
+            self.error = e
+            self.loop.close()
+            self.loop = None
+            self.started.set()
+            return
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+    async def handle_client(self, reader, writer):
+        client = LocalClient(self, reader, writer)
+        try:
+            while not client.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not client.take_token():
+                    client.send("ERROR :Closing Link: {} (Excess Flood)".format(client.nick))
+                    break
+                self.handle_line(client, line.decode('utf-8', errors='replace').rstrip('\r\n'))
+                if not client.closed:
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.quit(client, "Connection closed")
+
+    def handle_line(self, client, line):
+        if not line:
+            return
+        if line.startswith(':'):
+            line = line.split(' ', 1)[1] if ' ' in line else ''
+        if ' :' in line:
+            line, trailing = line.split(' :', 1)
+            params = line.split() + [trailing]
+        else:
+            params = line.split()
+        if not params:
+            return
+        command = params.pop(0).upper()
+        handler = getattr(self, 'on_' + command.lower(), None)
+        if handler is None:
+            client.reply('421', command, ':Unknown command')
+            return
+        if not client.registered and command not in ('NICK', 'USER', 'PING', 'PONG', 'QUIT', 'PASS', 'CAP'):
+            client.reply('451', ':You have not registered')
+            return
+        handler(client, params)
+
+    def on_pass(self, client, params):
+        pass
+
+    def on_cap(self, client, params):
+        pass
+
+    def on_nick(self, client, params):
+        if not params:
+            client.reply('431', ':No nickname given')
+            return
+        nick = params[0]
+        if nick in self.clients and self.clients[nick] is not client:
+            client.reply('433', nick, ':Nickname is already in use')
+            return
+        if client.registered:
+            for other in self.get_neighbours(client, include_self=True):
+                other.send(":{} NICK :{}".format(client.prefix, nick))
+            del self.clients[client.nick]
+            self.clients[nick] = client
+            self.rename_member(client.nick, nick)
+            client.nick = nick
+            return
+        client.nick = nick
+        self.register(client)
+
+    def on_user(self, client, params):
+        if len(params) < 4:
+            client.reply('461', 'USER', ':Not enough parameters')
+            return
+        client.user = params[0]
+        self.register(client)
+
+    def register(self, client):
+        if client.registered or client.nick is None or client.user is None:
+            return
+        client.registered = True
+        self.clients[client.nick] = client
+        client.reply('001', ':Welcome to the local Mystery Online network {}'.format(client.prefix))
+        client.reply('376', ':End of MOTD command')
+
+    def on_ping(self, client, params):
+        client.send(":{} PONG {} :{}".format(SERVER_NAME, SERVER_NAME, params[0] if params else ''))
+
+    def on_pong(self, client, params):
+        pass
+
+    def on_join(self, client, params):
+        if not params:
+            client.reply('461', 'JOIN', ':Not enough parameters')
+            return
+        for channel in params[0].split(','):
+            if channel in client.channels:
+                continue
+            members = self.channels.setdefault(channel, [])
+            members.append(client.nick)
+            client.channels.add(channel)
+            for nick in members:
+                self.clients[nick].send(":{} JOIN {}".format(client.prefix, channel))
+            self.send_names(client, channel)
+
+    def on_part(self, client, params):
+        if not params:
+            return
+        for channel in params[0].split(','):
+            if channel not in client.channels:
+                continue
+            for nick in self.channels[channel]:
+                self.clients[nick].send(":{} PART {}".format(client.prefix, channel))
+            self.leave(client, channel)
+
+    def on_names(self, client, params):
+        for channel in params[0].split(',') if params else client.channels:
+            self.send_names(client, channel)
+
+    def send_names(self, client, channel):
+        members = self.channels.get(channel, [])
+        if members:
+            names = ["@" + nick if index == 0 else nick for index, nick in enumerate(members)]
+            client.reply('353', '=', channel, ':' + " ".join(names))
+        client.reply('366', channel, ':End of /NAMES list.')
+
+    def on_privmsg(self, client, params, command='PRIVMSG'):
+        if len(params) < 2:
+            client.reply('412', ':No text to send')
+            return
+        target, text = params[0], params[1]
+        line = ":{} {} {} :{}".format(client.prefix, command, target, text)
+        if target.startswith('#'):
+            if target not in client.channels:
+                client.reply('404', target, ':Cannot send to channel')
+                return
+            receivers = [self.clients[nick] for nick in self.channels[target] if nick != client.nick]
+        elif target in self.clients:
+            receivers = [self.clients[target]]
+        else:
+            client.reply('401', target, ':No such nick/channel')
+            return
+        for receiver in receivers:
+            self.deliver(receiver, line)
+
+    def on_notice(self, client, params):
+        self.on_privmsg(client, params, 'NOTICE')
+
+    def deliver(self, receiver, line):
+        """Sends a message line, applying the injected drop rate, latency and jitter.
+
+        Lines to the same receiver arrive in the order they were sent, jitter only spreads them in time.
+        """
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        if delay > 0 or receiver.outbox:
+            receiver.send_at(self.loop.time() + delay, line)
+        else:
+            receiver.send(line)
+
+    def on_mode(self, client, params):
+        if not params:
+            client.reply('461', 'MODE', ':Not enough parameters')
+            return
+        target = params[0]
+        if not target.startswith('#'):
+            if len(params) > 1:
+                self.apply_modes(client.modes, params[1])
+            client.send(":{} MODE {} :+{}".format(client.prefix, client.nick, "".join(sorted(client.modes))))
+            return
+        modes = self.channel_modes.setdefault(target, set())
+        if len(params) == 1:
+            client.reply('324', target, '+' + "".join(sorted(modes)))
+            return
+        self.apply_modes(modes, params[1])
+        for nick in self.channels.get(target, []):
+            self.clients[nick].send(":{} MODE {} {}".format(client.prefix, target, " ".join(params[1:])))
+
+    @staticmethod
+    def apply_modes(modes, change):
+        adding = True
+        for char in change:
+            if char in '+-':
+                adding = char == '+'
+            elif adding:
+                modes.add(char)
+            else:
+                modes.discard(char)
+
+    def on_quit(self, client, params):
+        self.quit(client, params[0] if params else "Quit")
+
+    def quit(self, client, reason):
+        if client.closed:
+            return
+        if client.registered:
+            for other in self.get_neighbours(client):
+                other.send(":{} QUIT :{}".format(client.prefix, reason))
+            for channel in list(client.channels):
+                self.leave(client, channel)
+            self.clients.pop(client.nick, None)
+        client.closed = True
+        client.writer.close()
+
+    def leave(self, client, channel):
+        client.channels.discard(channel)
+        members = self.channels[channel]
+        members.remove(client.nick)
+        if not members:
+            del self.channels[channel]
+            self.channel_modes.pop(channel, None)
+
+    def rename_member(self, old_nick, new_nick):
+        for members in self.channels.values():
+            if old_nick in members:
+                members[members.index(old_nick)] = new_nick
+
+    def get_neighbours(self, client, include_self=False):
+        """Every client sharing a channel with this one."""
+        nicks = set()
+        for channel in client.channels:
+            nicks.update(self.channels[channel])
+        if not include_self:
+            nicks.discard(client.nick)
+        return [self.clients[nick] for nick in nicks if nick in self.clients]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local IRC server for Mystery Online")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6667)
+    parser.add_argument('--flood-burst', type=int, default=None)
+    parser.add_argument('--flood-interval', type=float, default=2.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = LocalIrcServer(args.host, args.port, args.flood_burst, args.flood_interval, args.latency, args.jitter,
+                            args.drop_rate, args.seed)
+    host, port = server.start()
+    logger.info("Listening on %s:%s", host, port)
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,8 @@ from kivy.core.window import Window
 from kivy.uix.widget import Widget
 from kivy.app import App
 from MysteryOnline.character_select import CharacterSelect
-from MysteryOnline.character import Character, characters
+from MysteryOnline.character import characters, load_characters
 from MysteryOnline.location import location_manager
-import os
 
 
 class KeyboardListener(Widget):
@@ -88,5 +87,4 @@ class KeyboardListener(Widget):
     @staticmethod
     def refresh_characters():
         characters.clear()
-        char = {name: Character(name) for name in os.listdir("characters") if os.path.isdir("characters/" + name)}
-        characters.update(char)
+        characters.update(load_characters())
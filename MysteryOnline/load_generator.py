@@ -0,0 +1,278 @@
+"""Scripted synthetic load: fake users chatting, nullposting, moving, and sending OOC messages and PMs.
+
+LoadScript decides what every fake user does and builds the protocol messages for it. DebugMode feeds them to the
+running client; from the command line, every fake user is a separate IRC connection to a server, so a real client
+joining the same channel sees a crowded room.
+
+Usage: python -m MysteryOnline.load_generator [--server HOST:PORT] [--channel NAME] [--users N] [--duration S]
+[--chat-rate R] [--nullpost-rate R] [--move-rate R] [--ooc-rate R] [--pm-rate R] [--pm-target NICK] [--seed N]
+Rates are events per second for the whole room. Without --server, a local IRC server is started.
+"""
+import argparse
+import configparser
+import json
+import logging
+import os
+import random
+import time
+
+import irc.client
+
+from MysteryOnline.manifest import asset_manifest, CHARACTERS
+from MysteryOnline.protocol import MessageFactory
+from MysteryOnline.room_state import POSITIONS
+
+logger = logging.getLogger(__name__)
+
+CHAT = 'chat'
+NULLPOST = 'nullpost'
+MOVE = 'move'
+OOC = 'ooc'
+PM = 'pm'
+
+WORDS = ("the", "a", "knife", "library", "alibi", "who", "was", "there", "last", "night", "victim", "clue", "door",
+         "locked", "I", "saw", "you", "near", "body", "trial", "motive", "why", "no", "that's", "wrong", "evidence")
+
+
+class FakeUser:
+
+    def __init__(self, username, character, sprites, location, sublocation, position):
+        self.username = username
+        self.character = character
+        self.sprites = sprites
+        self.location = location
+        self.sublocation = sublocation
+        self.position = position
+        self.sprite = sprites[0]
+
+
+class LoadScript:
+    """Drives fake users at the given rates, in events per second for the whole room.
+
+    characters maps character names to their sprite names, locations maps location names to their sublocations.
+    """
+
+    def __init__(self, characters, locations, chat_rate=1.0, nullpost_rate=1.0, move_rate=0.1, ooc_rate=0.2,
+                 pm_rate=0.1, seed=None, message_factory=None):
+        self.characters = {name: list(sprites) for name, sprites in characters.items() if sprites}
+        self.locations = {name: list(sublocations) for name, sublocations in locations.items() if sublocations}
+        self.rates = [(CHAT, chat_rate), (NULLPOST, nullpost_rate), (MOVE, move_rate), (OOC, ooc_rate),
+                      (PM, pm_rate)]
+        self.random = random.Random(seed)
+        self.message_factory = message_factory or MessageFactory()
+        self.users = []
+        self.pending = {kind: 0.0 for kind, rate in self.rates}
+
+    def spawn(self, usernames):
+        """Creates a fake user for every username, returns the messages announcing them."""
+        messages = []
+        for username in usernames:
+            character = self.random.choice(sorted(self.characters))
+            location = self.random.choice(sorted(self.locations))
+            user = FakeUser(username, character, self.characters[character], location,
+                            self.random.choice(self.locations[location]), self.random.choice(POSITIONS))
+            self.users.append(user)
+            messages.append((user, self.build_state(user)))
+        return messages
+
+    def build_state(self, user):
+        factory = self.message_factory
+        messages = [factory.build_location_message(user.location, username=user.username),
+                    factory.build_character_message(user.character, "", "", username=user.username),
+                    self.build_icon(user)]
+        return factory.build_frame_message(messages, username=user.username)
+
+    def build_icon(self, user):
+        return self.message_factory.build_icon_message(location=user.location, sublocation=user.sublocation,
+                                                       character=user.character, sprite=user.sprite,
+                                                       position=user.position, sprite_option="0", dance=False,
+                                                       username=user.username)
+
+    def tick(self, dt):
+        """Returns the (kind, user, message, target) actions for the dt seconds that passed.
+
+        target is only set for PMs, whose message is the PM text.
+        """
+        if not self.users:
+            return []
+        actions = []
+        for kind, rate in self.rates:
+            self.pending[kind] += rate * dt
+            while self.pending[kind] >= 1.0:
+                self.pending[kind] -= 1.0
+                actions.append(self.act(kind, self.random.choice(self.users)))
+        return actions
+
+    def act(self, kind, user):
+        factory = self.message_factory
+        if kind == MOVE:
+            user.location = self.random.choice(sorted(self.locations))
+            user.sublocation = self.random.choice(self.locations[user.location])
+            return MOVE, user, self.build_state(user), None
+        if kind == OOC:
+            return OOC, user, factory.build_ooc_message(self.make_sentence(), username=user.username), None
+        if kind == PM:
+            target = self.random.choice(self.users).username
+            return PM, user, self.make_sentence(), target
+        user.sprite = self.random.choice(user.sprites)
+        if kind == NULLPOST:
+            return NULLPOST, user, self.build_icon(user), None
+        if self.random.random() < 0.3:
+            user.sublocation = self.random.choice(self.locations[user.location])
+            user.position = self.random.choice(POSITIONS)
+        message = factory.build_chat_message(content=self.make_sentence(), location=user.location,
+                                             sublocation=user.sublocation, character=user.character,
+                                             sprite=user.sprite, position=user.position, color_id="0",
+                                             sprite_option="0", username=user.username)
+        return CHAT, user, message, None
+
+    def make_sentence(self):
+        return " ".join(self.random.choice(WORDS) for _ in range(self.random.randint(2, 15)))
+
+
+def load_characters(path="characters"):
+    """Reads the sprite names of every character from the icon atlas its settings.ini names, without loading any
+    image. The settings come from the asset manifest when the client cached them, from settings.ini otherwise."""
+    asset_manifest.ensure_loaded()
+    characters = {}
+    for name in os.listdir(path):
+        directory = os.path.join(path, name)
+        if not os.path.isdir(directory):
+            continue
+        settings = asset_manifest.get(CHARACTERS, name, directory)
+        icons = settings['icons'] if settings is not None else read_icons_setting(directory)
+        if icons is None:
+            continue
+        try:
+            with open(os.path.join(directory, icons), encoding='utf-8') as atlas_file:
+                pages = json.load(atlas_file)
+        except (OSError, ValueError):
+            continue
+        characters[name] = sorted(sprite for page in pages.values() for sprite in page)
+    return characters
+
+
+def read_icons_setting(directory):
+    """The icons entry of the character section of settings.ini, None when it can't be read."""
+    config = configparser.ConfigParser(interpolation=None)
+    try:
+        config.read(os.path.join(directory, "settings.ini"), encoding='utf-8')
+        return config['character']['icons']
+    except (configparser.Error, KeyError, UnicodeDecodeError):
+        return None
+
+
+def load_locations(path="locations"):
+    locations = {}
+    for name in os.listdir(path):
+        location_path = os.path.join(path, name)
+        if not os.path.isdir(location_path):
+            continue
+        locations[name] = sorted(os.path.splitext(file)[0] for file in os.listdir(location_path)
+                                 if not os.path.splitext(file)[0].endswith("_foreground"))
+    return locations
+
+
+class LoadClients:
+    """One IRC connection per fake user, sending what the script decides."""
+
+    def __init__(self, script, host, port, channel, pm_target=None):
+        self.script = script
+        self.channel = channel
+        self.pm_target = pm_target
+        self.reactor = irc.client.Reactor()
+        self.connections = {}
+        self.joined = set()
+        self.sent = 0
+        self.host = host
+        self.port = port
+        self.reactor.add_global_handler("welcome", self.on_welcome)
+        self.reactor.add_global_handler("join", self.on_join)
+
+    def connect(self, usernames):
+        for username in usernames:
+            self.connections[username] = self.reactor.server().connect(self.host, self.port, username)
+
+    def on_welcome(self, connection, event):
+        connection.join(self.channel)
+
+    def on_join(self, connection, event):
+        if event.source.nick == connection.get_nickname():
+            self.joined.add(connection.get_nickname())
+
+    def wait_for_joins(self, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while len(self.joined) < len(self.connections) and time.monotonic() < deadline:
+            self.reactor.process_once(0.05)
+        return len(self.joined)
+
+    def send(self, user, message, target=None):
+        connection = self.connections[user.username]
+        if target is not None:
+            if self.pm_target is not None:
+                target = self.pm_target
+            connection.privmsg(target, message)
+        else:
+            connection.privmsg(self.channel, message.to_irc())
+        self.sent += 1
+
+    def run(self, duration, interval=0.1):
+        for user, message in self.script.spawn(list(self.connections)):
+            self.send(user, message)
+        start = last = time.monotonic()
+        while time.monotonic() - start < duration:
+            self.reactor.process_once(interval)
+            now = time.monotonic()
+            for kind, user, message, target in self.script.tick(now - last):
+                self.send(user, message, target)
+            last = now
+
+    def disconnect(self):
+        self.reactor.disconnect_all("Load test over")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic Mystery Online load")
+    parser.add_argument('--server', default=None, help="HOST:PORT, a local server is started when omitted")
+    parser.add_argument('--channel', default="#mysteryonline-load")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--chat-rate', type=float, default=1.0)
+    parser.add_argument('--nullpost-rate', type=float, default=1.0)
+    parser.add_argument('--move-rate', type=float, default=0.1)
+    parser.add_argument('--ooc-rate', type=float, default=0.2)
+    parser.add_argument('--pm-rate', type=float, default=0.1)
+    parser.add_argument('--pm-target', default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = None
+    if args.server is None:
+        from MysteryOnline.irc_server import LocalIrcServer
+        server = LocalIrcServer(port=6667)
+        try:
+            host, port = server.start()
+        except OSError as e:
+            logger.error("Couldn't start a local server on port 6667 (%s), use --server to reach a running one", e)
+            return
+        logger.info("Started a local server on %s:%s", host, port)
+    else:
+        host, port = args.server.rsplit(':', 1)
+        port = int(port)
+    script = LoadScript(load_characters(), load_locations(), args.chat_rate, args.nullpost_rate, args.move_rate,
+                        args.ooc_rate, args.pm_rate, args.seed)
+    clients = LoadClients(script, host, port, args.channel, args.pm_target)
+    clients.connect(["LoadUser{}".format(i) for i in range(args.users)])
+    logger.info("%s of %s fake users joined %s", clients.wait_for_joins(), args.users, args.channel)
+    try:
+        clients.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    logger.info("Sent %s messages", clients.sent)
+    clients.disconnect()
+    if server is not None:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,96 @@
 import os
+from functools import partial
 
 from kivy.graphics.texture import Texture
 from kivy.uix.image import Image
 from kivy.config import ConfigParser
+from kivy.logger import Logger
+
+from MysteryOnline.async_image import load_image_async
+from MysteryOnline.room_state import UserStack
+from MysteryOnline.texture_cache import texture_cache, texture_bytes, BACKGROUND
+from MysteryOnline.manifest import asset_manifest, LOCATIONS
 
 
 class SubLocation:
 
-    def __init__(self, name, img_path):
+    def __init__(self, name, img_path, foreground_path=None, find_foreground=True):
         self.name = name
         self.img_path = img_path
-        self.foreground_path: str = None
+        self.foreground_path: str = foreground_path
 
-        dir_path: str = os.path.dirname(img_path)
-        foreground_png: str = os.path.join(dir_path, name+"_foreground.png")  # We only support png
+        if find_foreground:
+            dir_path: str = os.path.dirname(img_path)
+            foreground_png: str = os.path.join(dir_path, name+"_foreground.png")  # We only support png
 
-        if os.path.exists(foreground_png):
-            self.foreground_path = foreground_png
+            if os.path.exists(foreground_png):
+                self.foreground_path = foreground_png
 
-        self.c_users = []
-        self.l_users = []
-        self.r_users = []
-        self.o_users = []
+        self.c_users = UserStack()
+        self.l_users = UserStack()
+        self.r_users = UserStack()
+        self.o_users = UserStack()
+        self.images = {}
 
     def get_img(self):
-        return Image(source=self.img_path)
+        return self.load_image(self.img_path)
 
     def get_foreground_img(self):
-        return Image(source=self.foreground_path)
+        return self.load_image(self.foreground_path)
+
+    def is_loaded(self) -> bool:
+        """True when the background, and the foreground if any, can be shown without decoding."""
+        return self.img_path in self.images and (not self.has_foreground() or self.foreground_path in self.images)
+
+    def load_async(self, callback):
+        """Decodes the background and foreground on Kivy's loader threads, then calls callback() once both are in.
+
+        An image that can't be decoded is kept as an empty one, so the sublocation shows without it. When the loader
+        times out nothing is kept and callback isn't called, the next load_async tries again.
+        """
+        paths = [path for path in (self.img_path, self.foreground_path) if path is not None and path not in self.images]
+        if not paths:
+            callback()
+            return
+        waiting = set(paths)
+
+        def on_load(path, image):
+            if path not in self.images:
+                self.add_image(path, image)
+            on_done(path)
+
+        def on_error(path, error):
+            Logger.error('Location: Could not load {}: {}'.format(path, error))
+            if path not in self.images:
+                self.add_image(path, Image())
+            on_done(path)
+
+        def on_timeout(path, error):
+            Logger.warning('Location: {}'.format(error))
+
+        def on_done(path):
+            waiting.discard(path)
+            if not waiting:
+                callback()
+
+        for path in paths:
+            load_image_async(path, partial(on_load, path), partial(on_error, path), partial(on_timeout, path))
+
+    def load_image(self, path):
+        """Decodes the image once and keeps it until the texture cache evicts it."""
+        image = self.images.get(path)
+        if image is None:
+            image = Image(source=path)
+            self.add_image(path, image)
+        else:
+            texture_cache.touch((BACKGROUND, path))
+        return image
+
+    def add_image(self, path, image):
+        self.images[path] = image
+        texture = image.texture
+        size = texture_bytes(texture.width, texture.height) if texture is not None else 0
+        texture_cache.add((BACKGROUND, path), size, lambda: self.images.pop(path, None))
 
     def has_foreground(self) -> bool:
         return self.foreground_path is not None
@@ -48,35 +111,31 @@ class SubLocation:
         self.r_users.append(user)
 
     def get_c_user(self):
-        return self.c_users[-1]
+        return self.c_users.last()
 
     def get_l_user(self):
-        return self.l_users[-1]
+        return self.l_users.last()
 
     def get_r_user(self):
-        return self.r_users[-1]
+        return self.r_users.last()
 
     def get_o_user(self):
-        return self.o_users[-1]
+        return self.o_users.last()
 
     def get_users(self) -> []:
-        return self.o_users + self.l_users + self.c_users + self.r_users
+        return [*self.o_users, *self.l_users, *self.c_users, *self.r_users]
 
     def remove_o_user(self, user):
-        if user in self.o_users:
-            self.o_users.remove(user)
+        self.o_users.discard(user)
 
     def remove_c_user(self, user):
-        if user in self.c_users:
-            self.c_users.remove(user)
+        self.c_users.discard(user)
 
     def remove_l_user(self, user):
-        if user in self.l_users:
-            self.l_users.remove(user)
+        self.l_users.discard(user)
 
     def remove_r_user(self, user):
-        if user in self.r_users:
-            self.r_users.remove(user)
+        self.r_users.discard(user)
 
 
 class LocationManager:
@@ -88,10 +147,17 @@ class LocationManager:
     def load_locations(self):
         if self.is_loaded:
             return
+        asset_manifest.ensure_loaded()
         self.locations = {name: Location(name)
                           for name in os.listdir("locations") if os.path.isdir("locations/" + name)}
-        for location_name in self.locations:
-            self.locations[location_name].load()
+        for location_name, location in self.locations.items():
+            layout = asset_manifest.get(LOCATIONS, location_name, location.path)
+            if layout is None:
+                layout = location.read_layout()
+                asset_manifest.put(LOCATIONS, location_name, location.path, (), layout)
+            location.load_layout(layout)
+        asset_manifest.prune(LOCATIONS, self.locations)
+        asset_manifest.save()
         self.is_loaded = True
 
     def get_locations(self):
@@ -116,11 +182,25 @@ class Location:
         self.placeholder_subloc = SubLocation('Missingno',  "misc_img/Missingno.jpg")
 
     def load(self):
-        for file in os.listdir(self.path):
+        self.load_layout(self.read_layout())
+
+    def read_layout(self) -> dict:
+        """Maps every sublocation to its image file and foreground file (None without one), as the manifest keeps."""
+        files = os.listdir(self.path)
+        names = set(files)
+        layout = {}
+        for file in files:
             strip: str = self.strip_ext(file)
             if strip.endswith("_foreground"):
                 continue
-            self.sublocations[strip] = SubLocation(strip, self.path+file)
+            foreground = strip + "_foreground.png"  # We only support png
+            layout[strip] = [file, foreground if foreground in names else None]
+        return layout
+
+    def load_layout(self, layout):
+        for name, (file, foreground) in layout.items():
+            foreground_path = self.path + foreground if foreground is not None else None
+            self.sublocations[name] = SubLocation(name, self.path+file, foreground_path, find_foreground=False)
 
     @staticmethod
     def strip_ext(name: str) -> str:
@@ -4,7 +4,7 @@ import re
 from MysteryOnline import get_version, get_dev
 from MysteryOnline.character import characters
 from MysteryOnline.character_select import CharacterSelect
-from MysteryOnline.irc_mo import IrcConnection, ConnectionManager
+from MysteryOnline.irc_mo import IrcConnection, ConnectionManager, ReplayConnection
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.config import ConfigParser
@@ -92,8 +92,16 @@ class LoginScreen(Screen):
         self.create_irc_connection()
 
     def create_irc_connection(self):
-        user_handler = App.get_running_app().get_user_handler()
-        connection = IrcConnection(self.server, self.port, self.channel, self.username, self.password)
+        app = App.get_running_app()
+        user_handler = app.get_user_handler()
+        if app.replay_file is not None:
+            connection = ReplayConnection(app.replay_file, app.replay_speed, self.channel, self.username,
+                                          app.get_message_factory())
+        else:
+            connection = IrcConnection(self.server, self.port, self.channel, self.username, self.password,
+                                      app.get_message_factory())
+            if app.record_file is not None:
+                connection.start_recording(app.record_file)
         user_handler.set_connection_manager(ConnectionManager(connection))
         self.manager.irc_connection = connection
 
@@ -11,6 +11,21 @@ if len(sys.argv) > 1 and sys.argv[1] == "--dev":
     set_dev(True)
     del sys.argv[1]
 
+
+def pop_option(name, default=None):
+    """Removes "name value" from the command line, before Kivy parses it, and returns the value."""
+    if name not in sys.argv[:-1]:
+        return default
+    index = sys.argv.index(name)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+
+RECORD_FILE = pop_option("--record")
+REPLAY_FILE = pop_option("--replay")
+REPLAY_SPEED = float(pop_option("--speed", 1))
+
 #
 # wrong_path = os.environ['GST_PLUGIN_PATH']
 # right_path = os.getcwd()
@@ -53,6 +68,7 @@ import MysteryOnline.settings_types
 from MysteryOnline.mopopup import MOPopup
 from MysteryOnline.mopopup import MOPopupYN
 from MysteryOnline.location import location_manager
+from MysteryOnline.texture_cache import texture_cache, MEGABYTE
 from os import listdir
 
 from MysteryOnline.commands import command_processor
@@ -76,24 +92,34 @@ class MainScreenManager(ScreenManager):
     def __init__(self, **kwargs):
         super(MainScreenManager, self).__init__(**kwargs)
         self.popup_ = MOPopup("Connection", "Connecting to IRC", "K", False)
+        self.is_main_screen_ready = False
 
     def on_irc_connection(self, *args):
         """Called when the IRC connection is created"""
 
         self.set_handlers()
         self.main_screen.user = App.get_running_app().get_user()
+        self.main_screen.room_state.local_username = self.main_screen.user.username
+        if App.get_running_app().config.getdefaultint('other', 'network_thread', 1):
+            self.irc_connection.start_network_thread()
         Clock.schedule_interval(self.process_irc, 1.0 / 60.0)
         self.popup_.open()
 
     def set_handlers(self):
         connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
         self.irc_connection.on_join_handler = connection_manager.on_join
+        self.irc_connection.on_self_join_handler = connection_manager.on_channel_joined
         self.irc_connection.on_users_handler = connection_manager.on_join_users
+        self.irc_connection.on_users_end_handler = connection_manager.on_join_users_end
         self.irc_connection.on_disconnect_handler = connection_manager.on_disconnect
+        self.irc_connection.on_connection_lost_handler = connection_manager.get_disconnected
 
     def on_connected(self, *args):
         """Called when MO connects to the IRC channel"""
 
+        if not self.connected or self.is_main_screen_ready:
+            return  # Reconnections are handled by the ConnectionManager
+        self.is_main_screen_ready = True
         self.unset_the_r_flag()
         self.popup_.dismiss()
         del self.popup_
@@ -104,6 +130,7 @@ class MainScreenManager(ScreenManager):
         self.current = "main"
         self.main_screen.on_ready()
         connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        self.main_screen.text_box.bind(on_text_displayed=connection_manager.on_text_displayed)
         Clock.schedule_interval(connection_manager.update_chat, 1.0 / 60.0)
 
     def unset_the_r_flag(self):
@@ -113,7 +140,8 @@ class MainScreenManager(ScreenManager):
         self.irc_connection.send_mode(username, "-R")
 
     def process_irc(self, dt):
-        self.irc_connection.process()
+        if not self.irc_connection.is_threaded():
+            self.irc_connection.process()
         self.connected = self.irc_connection.is_connected()
 
 
@@ -127,6 +155,9 @@ class MysteryOnlineApp(App):
         self.main_screen = None
         self.user_handler = None
         self.message_factory = MessageFactory()
+        self.record_file = RECORD_FILE
+        self.replay_file = REPLAY_FILE
+        self.replay_speed = REPLAY_SPEED
         self.keyboard_listener = None
         self.fav_chars = None
         self.fav_sfx = None
@@ -136,9 +167,17 @@ class MysteryOnlineApp(App):
     def build(self):
         msm = MainScreenManager()
         self.keyboard_listener = KeyboardListener()
+        self.config.add_callback(self.set_texture_budget, 'other', 'texture_budget_mb')
+        self.set_texture_budget()
         location_manager.load_locations()
         return msm
 
+    def set_texture_budget(self, *args):
+        try:
+            texture_cache.set_budget(self.config.getdefaultint('other', 'texture_budget_mb', 512) * MEGABYTE)
+        except ValueError:
+            Logger.warning('Textures: Invalid texture budget')
+
     def build_config(self, config):
         config.setdefaults('display', {
             'resolution': '1366x768',
@@ -169,7 +208,14 @@ class MysteryOnlineApp(App):
             'fav_characters': [],
             'fav_sfx': [],
             'fav_subloc': [],
-            'suppress_rainbow': 0
+            'suppress_rainbow': 0,
+            'chat_frame_budget': 8,
+            'catch_up_instant_depth': 5,
+            'catch_up_log_depth': 15,
+            'network_thread': 1,
+            'send_burst': 5,
+            'send_interval': 500,
+            'texture_budget_mb': 512
         })
         config.setdefaults('command-shortcuts', {
             '>': "/color green '>"
@@ -245,6 +291,8 @@ class MysteryOnlineApp(App):
             pass
         if self.main_screen:
             self.main_screen.on_stop()
+        if self.root is not None and self.root.irc_connection is not None:
+            self.root.irc_connection.stop_recording()
         config.write()
         super(MysteryOnlineApp, self).on_stop()
         App.get_running_app().get_main_screen().ooc_window.music_tab.reset_music()
@@ -349,12 +397,15 @@ class MysteryOnlineApp(App):
 
     def send_current_nullpost(self):
         """Sends your current parameters as a nullpost. Useful for sending your parameters to new users."""
+        self.user_handler.get_connection_manager().send_msg(self.build_current_nullpost())
+
+    def build_current_nullpost(self):
         np_message = self.message_factory \
             .build_icon_message(location=self.user.get_loc().name, sublocation=self.user_handler.get_current_subloc_name(),
-                                character=self.user.get_char().name, sprite=self.user.get_current_sprite().name,
+                                character=self.user.get_char().name, sprite=self.user.get_current_sprite_source()[1],
                                 position=self.user.get_pos(), sprite_option=self.user_handler.get_current_sprite_option(),
                                 dance=self.user.get_dance())
-        self.user_handler.get_connection_manager().send_msg(np_message)
+        return np_message
 
     @staticmethod
     def exponential_volume(volume):
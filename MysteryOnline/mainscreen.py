@@ -10,6 +10,7 @@ from MysteryOnline.character_select import CharacterSelect
 from MysteryOnline.DownloadableCharactersScreen import DownloadableCharactersScreen
 from MysteryOnline.location import location_manager
 from MysteryOnline.debug_mode import DebugModePopup
+from MysteryOnline.room_state import RoomState
 
 from kivy.uix.dropdown import DropDown
 from kivy.uix.button import Button
@@ -103,6 +104,7 @@ class MainScreen(Screen):
         super(MainScreen, self).__init__(**kwargs)
         self.user = None
         self.users = {}
+        self.room_state = RoomState()
         self.last_input = None
         self.character_list_for_dlc = []
         App.get_running_app().set_main_screen(self)
@@ -183,6 +185,7 @@ class MainScreen(Screen):
             message = message_factory.build_character_message(char.name, char.link, char.version)
             connection_manager.send_msg(message)
             connection_manager.update_char(self, char.name, self.user.username, char.link, char.version)
+            self.room_state.set_character(self.user.username, char.name, char.link, char.version)
         except AttributeError:
             red_herring = characters['RedHerring']
             self.on_new_char(red_herring)
@@ -0,0 +1,98 @@
+"""On-disk cache of what startup reads from the asset directories, so launching does not parse every pack again.
+
+Every entry remembers the modification times of the directory and of the files it was built from. An entry
+whose times still match is used as is, anything else is rebuilt from the files and written back on save().
+The manifest is a single JSON file:
+{"version": 1, "characters": {name: {"mtimes": {".": ..., "settings.ini": ...}, "data": {...}}}, "locations": {...}}
+"""
+import json
+import os
+
+from kivy.logger import Logger
+
+MANIFEST_FILE = "asset_manifest.json"
+MANIFEST_VERSION = 1
+
+CHARACTERS = 'characters'
+LOCATIONS = 'locations'
+
+
+def get_mtimes(directory, files=()):
+    """Modification times of the directory (as ".") and of the given files in it, None for missing files."""
+    mtimes = {}
+    for name in ('.',) + tuple(files):
+        try:
+            mtimes[name] = os.stat(os.path.join(directory, name)).st_mtime_ns
+        except OSError:
+            mtimes[name] = None
+    return mtimes
+
+
+class Manifest:
+
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = path
+        self.sections = {CHARACTERS: {}, LOCATIONS: {}}
+        self.dirty = False
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def load(self):
+        self.loaded = True
+        try:
+            with open(self.path, encoding='utf-8') as manifest_file:
+                data = json.load(manifest_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            Logger.warning("Manifest: Ignoring the asset manifest {}: {}".format(self.path, e))
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        for section in self.sections:
+            self.sections[section] = data.get(section, {})
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {'version': MANIFEST_VERSION}
+        data.update(self.sections)
+        temporary = self.path + ".tmp"
+        try:
+            with open(temporary, 'w', encoding='utf-8') as manifest_file:
+                json.dump(data, manifest_file, separators=(',', ':'))
+            os.replace(temporary, self.path)
+        except OSError as e:
+            Logger.warning("Manifest: Couldn't write the asset manifest {}: {}".format(self.path, e))
+            return
+        self.dirty = False
+
+    def get(self, section, name, directory):
+        """The cached data of that directory, None when it changed since it was cached."""
+        entry = self.sections[section].get(name)
+        if entry is not None:
+            mtimes = entry['mtimes']
+            if get_mtimes(directory, [file for file in mtimes if file != '.']) == mtimes:
+                self.hits += 1
+                return entry['data']
+        self.misses += 1
+        return None
+
+    def put(self, section, name, directory, files, data):
+        """Caches data built from the given files of the directory."""
+        self.sections[section][name] = {'mtimes': get_mtimes(directory, files), 'data': data}
+        self.dirty = True
+
+    def prune(self, section, names):
+        """Forgets the directories that are gone."""
+        for name in set(self.sections[section]) - set(names):
+            del self.sections[section][name]
+            self.dirty = True
+
+
+asset_manifest = Manifest()
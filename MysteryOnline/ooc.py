@@ -6,7 +6,6 @@ from datetime import datetime
 
 import requests
 import urllib
-from irc.client import MessageTooLong
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.core.audio import SoundLoader
@@ -21,6 +20,7 @@ from kivy.utils import platform
 from MysteryOnline.mopopup import MOPopup
 from MysteryOnline.private_message_screen import PrivateMessageScreen
 from MysteryOnline.user_box import UserBox
+from MysteryOnline.location import location_manager
 from requests.exceptions import Timeout, MissingSchema
 from MysteryOnline.mopopup import MOPopup
 
@@ -79,7 +79,8 @@ class MusicTab(TabbedPanelItem):
         if self.hide_title and sender == 'Default':
             track_name = "Hidden track"
         if url is None:
-            if len(self.url_input.text) > 400:
+            connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+            if len(self.url_input.text) > connection_manager.get_max_message_length(400):
                 popup = MOPopup("Warning", "URL too long", "OK")
                 popup.open()
                 return
@@ -88,20 +89,15 @@ class MusicTab(TabbedPanelItem):
             main_screen.music_name_display.text = "Playing: {}".format(track_name)
         else:
             main_screen.music_name_display.text = "Playing: URL Track"
-        try:
-            if send_to_all:
-                self.url_input.text = ""
-                connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
-                connection_manager.update_music(track_name, url)
-                main_screen.log_window.add_entry("You changed the music.\n")
-            if not any(s in url.lower() for s in ('mp3', 'wav', 'ogg', 'flac', 'watch')):  # watch is for yt links
-                Logger.warning("Music: The file you tried to play doesn't appear to contain music.")
-                self.is_loading_music = False
-                return
-        except MessageTooLong:
+        if send_to_all:
             self.url_input.text = ""
-            temp_pop = MOPopup("Error playing music", "Link too long", "OK")
-            temp_pop.open()
+            connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+            connection_manager.update_music(track_name, url)
+            main_screen.log_window.add_entry("You changed the music.\n")
+        if not any(s in url.lower() for s in ('mp3', 'wav', 'ogg', 'flac', 'watch')):  # watch is for yt links
+            Logger.warning("Music: The file you tried to play doesn't appear to contain music.")
+            self.is_loading_music = False
+            return
 
         def play_song(root):
             config_ = App.get_running_app().config
@@ -257,8 +253,9 @@ class OOCWindow(TabbedPanel):
         self.pm_open_sound_volume = 0
         self.ooc_play = True
         self.chat = PrivateMessageScreen()
-        self.muted_users = []
         self.pm_buttons = []
+        self.changed_users = set()
+        self.refresh_users_trigger = Clock.create_trigger(self.refresh_users)
         self.ooc_chat = OOCLogLabel()
         self.counter = 0
 
@@ -289,6 +286,7 @@ class OOCWindow(TabbedPanel):
             self.chat.irc = main_scr.manager.irc_connection
         self.chat.username = main_scr.user.username
         Clock.schedule_interval(self.update_private_messages, 1.0 / 60.0)
+        main_scr.room_state.subscribe(self.on_room_change)
         self.user_list.bind(minimum_height=self.user_list.setter('height'))
 
     def on_blip_volume_change(self, s, k, v):
@@ -344,6 +342,31 @@ class OOCWindow(TabbedPanel):
             self.user_list.add_widget(user_box)
             self.online_users[user.username] = user_box
 
+    def on_room_change(self, event, username):
+        self.changed_users.add(username)
+        self.refresh_users_trigger()
+
+    def refresh_users(self, *args):
+        """Redraws the labels of every user that changed since the last frame, once."""
+        room_state = App.get_running_app().get_main_screen().room_state
+        for username in self.changed_users:
+            user_state = room_state.get_user(username)
+            if user_state is None:
+                continue
+            self.update_char(username, user_state.character or "")
+            self.update_loc(username, user_state.location or "")
+            self.update_subloc(username, user_state.sublocation or self.get_entry_sub(user_state.location))
+        self.changed_users.clear()
+
+    @staticmethod
+    def get_entry_sub(location_name):
+        """The sublocation shown for a user who entered a location and didn't say where in it yet."""
+        if not location_name:
+            return ""
+        if location_manager.has_location(location_name):
+            return location_manager.get_locations()[location_name].get_real_first_sub()
+        return "Missingno"
+
     def update_char(self, username, char):
         user_box = self.online_users.get(username, None)
         if user_box is None:
@@ -375,11 +398,8 @@ class OOCWindow(TabbedPanel):
     def restore_pm_button_to_normal(self, pm):
         pm.background_normal = 'atlas://data/images/defaulttheme/button'
 
-    def muted_sender(self, pm, muted_users):  # Checks whether the sender of a pm is muted
-        for x in range(len(muted_users)):
-            if pm.sender == muted_users[x].username:
-                return True
-        return False
+    def muted_sender(self, pm):  # Checks whether the sender of a pm is muted
+        return App.get_running_app().get_main_screen().room_state.is_muted(pm.sender)
 
     def update_private_messages(self, *args):  # Acts on arrival of PMs
         main_scr = App.get_running_app().get_main_screen()
@@ -387,7 +407,7 @@ class OOCWindow(TabbedPanel):
         pm = irc.get_pm()
         if pm is not None:
             if pm.sender != self.chat.username:
-                if not self.muted_sender(pm, self.muted_users):
+                if not self.muted_sender(pm):
                     if not self.chat.pm_window_open_flag:
                         for btn in self.pm_buttons:
                             if pm.sender == btn.id:
@@ -405,12 +425,10 @@ class OOCWindow(TabbedPanel):
                     self.chat.update_conversation(pm.sender, pm.msg)
 
     def mute_user(self, user, btn):
-        if user in self.muted_users:
-            self.muted_users.remove(user)
-            btn.text = 'Mute'
-        else:
-            self.muted_users.append(user)
-            btn.text = 'Unmute'
+        room_state = App.get_running_app().get_main_screen().room_state
+        muted = not room_state.is_muted(user.username)
+        room_state.set_muted(user.username, muted)
+        btn.text = 'Unmute' if muted else 'Mute'
 
     def delete_user(self, username):
         try:
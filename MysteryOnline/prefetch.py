@@ -0,0 +1,113 @@
+"""Warms sprite pages and icon atlases in the background before anything needs to show them.
+
+When a user enters our location or changes character, the page holding their current sprite (the one named in
+their last message, or the character's first sprite) is decoded ahead of their first chat line. The character
+highlighted in the character select gets its icon atlas decoded. Requests are handled one at a time, and are
+dropped while the texture cache is close to its budget, so prefetching never pushes out what is on screen.
+A request that doesn't finish within the timeout is given up on, so the next ones still run.
+"""
+from collections import OrderedDict
+from functools import partial
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+from MysteryOnline.texture_cache import texture_cache
+
+SPRITE = 'sprite'
+ICONS = 'icons'
+
+
+class Prefetcher:
+
+    def __init__(self, cache=texture_cache, headroom=0.8, timeout=30.0):
+        self.cache = cache
+        self.headroom = headroom
+        self.timeout = timeout
+        self.queue = OrderedDict()
+        self.busy = False
+        self.job_id = 0
+        self.watchdog = None
+        self.warmed = 0
+        self.dropped = 0
+        self.timed_out = 0
+        self.trigger = Clock.create_trigger(self.process)
+
+    def has_room(self):
+        return self.cache.used < self.cache.budget * self.headroom
+
+    def enqueue(self, key, job):
+        """job(done) starts the background work and calls done() once it is over."""
+        if key in self.queue:
+            return
+        self.queue[key] = job
+        self.trigger()
+
+    def warm_user(self, user):
+        character, sprite_name = user.get_current_sprite_source()
+        self.warm_sprite(character, sprite_name)
+
+    def warm_sprite(self, character, sprite_name):
+        character.load_without_icons()
+        index = character.sprites.load_index()
+        if not index:
+            return
+        if sprite_name not in index:
+            sprite_name = min(index)
+        if character.sprites.is_loaded(sprite_name):
+            return
+        self.enqueue((SPRITE, character.name, sprite_name),
+                     lambda done: character.load_sprite_async(sprite_name, done))
+
+    def warm_location(self, location_name, main_screen):
+        """Warms every user the room state places in that location."""
+        for user_state in main_screen.room_state.get_users_in(location_name):
+            user = main_screen.users.get(user_state.username)
+            if user is not None and user.get_char() is not None:
+                self.warm_user(user)
+
+    def warm_icons(self, character):
+        if character.loaded_icons:
+            return
+        self.enqueue((ICONS, character.name), character.load_icons_async)
+
+    def process(self, *args):
+        if self.busy or not self.queue:
+            return
+        if not self.has_room():
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            return
+        key, job = self.queue.popitem(last=False)
+        self.busy = True
+        self.job_id += 1
+        job_id = self.job_id
+        self.watchdog = Clock.schedule_once(partial(self.on_timeout, job_id, key), self.timeout)
+        try:
+            job(partial(self.on_done, job_id))
+        except Exception as e:
+            Logger.warning('Prefetch: Could not warm {}: {}'.format(key, e))
+            self.on_done(job_id)
+
+    def on_done(self, job_id):
+        if job_id != self.job_id or not self.busy:
+            return
+        self.watchdog.cancel()
+        self.busy = False
+        self.warmed += 1
+        self.trigger()
+
+    def on_timeout(self, job_id, key, *args):
+        """Stops waiting on a job that never finished, its late done() is then ignored."""
+        if job_id != self.job_id or not self.busy:
+            return
+        Logger.warning('Prefetch: Gave up on {} after {}s'.format(key, self.timeout))
+        self.busy = False
+        self.timed_out += 1
+        self.trigger()
+
+    def clear(self):
+        self.queue.clear()
+
+
+prefetcher = Prefetcher()
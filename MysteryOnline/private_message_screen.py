@@ -148,8 +148,9 @@ class PrivateMessageScreen(ModalView):
         user = App.get_running_app().get_user()
         self.avatar = Image(source=user.get_char().avatar, size_hint_x=None, width=60)
         if self.current_conversation is not None:
-            if self.text_box.text != "" and len(self.text_box.text) <= 400:
-                    receiver = self.current_conversation.username
+            receiver = self.current_conversation.username
+            max_length = self.irc.connection_manager.get_max_message_length(400, receiver)
+            if self.text_box.text != "" and len(self.text_box.text) <= max_length:
                     self.irc.send_private_msg(receiver, sender, self.text_box.text)
                     msg = self.text_box.text
                     if 'www.' in msg or 'http://' in msg or 'https://' in msg:
@@ -0,0 +1,719 @@
+"""The MysteryOnline wire protocol: how messages are encoded to and decoded from IRC lines.
+
+This module doesn't depend on Kivy, so bots, tests and benchmarks can use it without starting the client.
+The client subclasses these messages in irc_mo to give them their behavior.
+"""
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class IncorrectMessageTypeError(Exception):
+    pass
+
+
+class MessageTooLong(ValueError):
+    """Raised when a message doesn't fit in the fragments a receiver accepts."""
+
+
+# Presence protocol. Its messages are sent as CTCP, which older clients silently ignore.
+PROTOCOL_VERSION = 4
+PRESENCE_MAX_LENGTH = 380
+PRESENCE_FIELD_SEPARATOR = '\x1f'
+PRESENCE_ENTRY_SEPARATOR = '\x1e'
+
+# Chat and icon messages only carry the fields that changed once every client in the channel understands it.
+DELTA_PROTOCOL_VERSION = 2
+DELTA_KEYFRAME_INTERVAL = 8
+
+# Lines longer than this many bytes are split into fragments when every client in the channel can reassemble them.
+# Fragments start with a control character nobody types, so a plain line starting with "f#" stays a plain line.
+FRAGMENT_PROTOCOL_VERSION = 3
+FRAGMENT_PREFIX = '\x1ef#'
+MAX_LINE_BYTES = 400
+FRAGMENT_HEADER_BYTES = 16
+FRAGMENT_MAX_COUNT = 16
+FRAGMENT_TIMEOUT = 30
+FRAGMENT_MEMORY_LIMIT = 64 * 1024
+MAX_MESSAGE_LENGTH = (MAX_LINE_BYTES - FRAGMENT_HEADER_BYTES) * FRAGMENT_MAX_COUNT // 4
+
+# Several messages packed in a single line, applied together by the receivers.
+FRAME_PROTOCOL_VERSION = 4
+
+
+# Lanes of the client's message scheduler, in the order they get drained.
+STATE_LANE = 'state'
+OOC_LANE = 'ooc'
+CHAT_LANE = 'chat'
+
+
+def encode_delta(prefix, previous, values, tail=None):
+    """Joins the values that differ from the previous ones, preceded by a hexadecimal mask of their indices."""
+    mask = 0
+    changed = []
+    for i, (old, new) in enumerate(zip(previous, values)):
+        if old != new:
+            mask |= 1 << i
+            changed.append(new)
+    parts = [prefix, format(mask, 'x')] + changed
+    if tail is not None:
+        parts.append(tail)
+    return '#'.join(parts)
+
+
+def decode_delta(message, previous, has_tail=False):
+    """Rebuilds the full values from a delta and the previous values; returns them with the tail if there is one."""
+    if previous is None:
+        raise IncorrectMessageTypeError("Delta without a keyframe")
+    parts = message.split('#', 2)
+    try:
+        mask = int(parts[1], 16)
+    except (IndexError, ValueError):
+        raise IncorrectMessageTypeError(message)
+    rest = parts[2] if len(parts) > 2 else ''
+    changed_count = bin(mask).count('1')
+    if has_tail:
+        changed = rest.split('#', changed_count)
+    elif changed_count:
+        changed = rest.split('#')
+    else:
+        changed = []
+    if len(changed) != changed_count + int(has_tail) or mask >> len(previous):
+        raise IncorrectMessageTypeError(message)
+    values = list(previous)
+    changed_values = iter(changed)
+    for i in range(len(previous)):
+        if mask & (1 << i):
+            values[i] = next(changed_values)
+    tail = next(changed_values, None)
+    return tuple(values), tail
+
+
+class PendingFragments:
+
+    def __init__(self, count):
+        self.count = count
+        self.chunks = {}
+        self.size = 0
+        self.created = time.monotonic()
+
+
+class FragmentBuffer:
+    """Collects the fragments of long messages until they are complete.
+
+    Incomplete messages are dropped after the timeout, or oldest first when the buffered chunks take more
+    characters than the memory limit.
+    """
+
+    def __init__(self, timeout=FRAGMENT_TIMEOUT, memory_limit=FRAGMENT_MEMORY_LIMIT):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.pending = OrderedDict()
+        self.size = 0
+
+    def add(self, sender, line):
+        try:
+            prefix, msg_id, index, count, chunk = line.split('#', 4)
+            index = int(index)
+            count = int(count)
+        except ValueError:
+            raise IncorrectMessageTypeError(line)
+        if not 0 <= index < count <= FRAGMENT_MAX_COUNT:
+            raise IncorrectMessageTypeError(line)
+        self.expire()
+        key = (sender, msg_id)
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = PendingFragments(count)
+        elif pending.count != count:
+            raise IncorrectMessageTypeError(line)
+        if index not in pending.chunks:
+            pending.chunks[index] = chunk
+            pending.size += len(chunk)
+            self.size += len(chunk)
+        if len(pending.chunks) == count:
+            self.discard(key)
+            return ''.join(pending.chunks[i] for i in range(count))
+        while self.size > self.memory_limit:
+            key = next(iter(self.pending))
+            logger.warning('IRC: Dropping incomplete message {} from {}, too many fragments waiting'.format(key[1],
+                                                                                                         key[0]))
+            self.discard(key)
+        return None
+
+    def expire(self):
+        limit = time.monotonic() - self.timeout
+        while self.pending:
+            key, pending = next(iter(self.pending.items()))
+            if pending.created > limit:
+                break
+            logger.warning('IRC: Incomplete message {} from {} timed out'.format(key[1], key[0]))
+            self.discard(key)
+
+    def discard(self, key):
+        pending = self.pending.pop(key)
+        self.size -= pending.size
+
+    def get_size(self):
+        return self.size
+
+
+class MessageRecord:
+    """A message sent in the channel, as a slotted record that isn't modified once built.
+
+    field_names lists the attributes sent after the prefix, in the order of the constructor arguments;
+    it drives both the encoding and the decoding.
+    """
+    __slots__ = ('sender',)
+    lane = STATE_LANE
+    prefix = None
+    field_names = ()
+
+    def to_irc(self):
+        values = [str(getattr(self, name)) for name in self.field_names]
+        if self.prefix is not None:
+            values.insert(0, self.prefix)
+        return '#'.join(values)
+
+    @classmethod
+    def from_fields(cls, sender, fields):
+        if len(fields) != len(cls.field_names):
+            raise ValueError("{} expects {} fields".format(cls.__name__, len(cls.field_names)))
+        return cls(sender, *fields)
+
+
+def remove_line_breaks(text):
+    if text is None:
+        return None
+    if '\n' in text or '\r' in text:
+        text = text.replace('\n', ' ')
+        text = text.replace('\r', ' ')
+    return text
+
+
+class ChatMessage(MessageRecord):
+    lane = CHAT_LANE
+    field_names = ('location', 'sublocation', 'character', 'sprite', 'position', 'color_id', 'sprite_option',
+                   'sfx_name', 'content')
+    __slots__ = field_names
+    delta_prefix = 'cd'
+
+    def __init__(self, sender, location=None, sublocation=None, character=None, sprite=None, position=None,
+                 color_id=None, sprite_option=None, sfx_name=None, content=None):
+        self.sender = sender
+        self.location = location
+        self.sublocation = sublocation
+        self.character = character
+        self.sprite = sprite
+        self.position = position
+        self.color_id = color_id
+        self.sprite_option = sprite_option
+        self.sfx_name = None if sfx_name == '0' else sfx_name
+        self.content = remove_line_breaks(content)
+
+    def to_irc(self):
+        sfx_name = '0' if self.sfx_name is None else self.sfx_name
+        msg = "{}#{}#{}#{}#{}#{}#{}#{}#{}".format(self.location, self.sublocation, self.character, self.sprite,
+                                                  self.position, self.color_id, self.sprite_option, sfx_name,
+                                                  self.content)
+        return msg
+
+    def get_delta_values(self):
+        values = (self.location, self.sublocation, self.character, self.sprite, self.position, self.color_id,
+                  self.sprite_option, '0' if self.sfx_name is None else self.sfx_name)
+        return tuple(str(value) for value in values)
+
+    def to_delta(self, previous):
+        return encode_delta(self.delta_prefix, previous, self.get_delta_values(), self.content)
+
+    @classmethod
+    def from_delta(cls, sender, message, previous):
+        values, content = decode_delta(message, previous, has_tail=True)
+        return cls(sender, *values, content)
+
+
+class IconMessage(MessageRecord):
+    prefix = 'sc'
+    field_names = ('location', 'sublocation', 'character', 'sprite', 'position', 'sprite_option', 'dance')
+    __slots__ = field_names
+    delta_prefix = 'sd'
+
+    def __init__(self, sender, location=None, sublocation=None, character=None, sprite=None, position=None,
+                 sprite_option=None, dance=None):
+        self.sender = sender
+        self.location = location
+        self.sublocation = sublocation
+        self.character = character
+        self.sprite = sprite
+        self.position = position
+        self.sprite_option = sprite_option
+        self.dance = dance
+
+    @classmethod
+    def from_fields(cls, sender, fields):
+        if len(fields) == 6:
+            # Sent by clients older than dancing
+            fields = fields + [False]
+        return super().from_fields(sender, fields)
+
+    def get_delta_values(self):
+        values = (self.location, self.sublocation, self.character, self.sprite, self.position, self.sprite_option,
+                  self.dance)
+        return tuple(str(value) for value in values)
+
+    def to_delta(self, previous):
+        return encode_delta(self.delta_prefix, previous, self.get_delta_values())
+
+    @classmethod
+    def from_delta(cls, sender, message, previous):
+        values, tail = decode_delta(message, previous)
+        return cls(sender, *values)
+
+
+class ChoiceMessage(MessageRecord):
+    prefix = 'ch'
+    field_names = ('text', 'options', 'list_of_users')
+    __slots__ = field_names
+
+    def __init__(self, sender, text=None, options=None, list_of_users=None):
+        if text is None:
+            text = 'Text'
+        if options is None:
+            options = 'Options'
+        if list_of_users is None:
+            list_of_users = 'everyone'
+        self.sender = sender
+        self.text = text
+        self.options = options
+        self.list_of_users = list_of_users
+
+
+class ChoiceReturnMessage(MessageRecord):
+    prefix = 'ch2'
+    field_names = ('questioner', 'whisper', 'selected_option')
+    __slots__ = field_names
+
+    def __init__(self, sender, questioner=None, whisper=False, selected_option=None):
+        self.questioner = questioner
+        self.whisper = whisper
+        self.selected_option = selected_option
+        self.sender = sender
+
+
+class CharacterMessage(MessageRecord):
+    prefix = 'c'
+    field_names = ('character', 'character_link', 'version')
+    __slots__ = field_names
+
+    def __init__(self, sender, character=None, link=None, version=None):
+        self.sender = sender
+        self.character = character
+        self.character_link = link
+        self.version = version
+
+    @classmethod
+    def from_fields(cls, sender, fields):
+        # Older clients only send the character, or the character and its link
+        if not 1 <= len(fields) <= 3:
+            raise ValueError("CharacterMessage expects 1 to 3 fields")
+        link = fields[1] if len(fields) > 1 else None
+        version = fields[2] if len(fields) > 2 else ''
+        return cls(sender, fields[0], link, version)
+
+
+class LocationMessage(MessageRecord):
+    prefix = 'l'
+    field_names = ('location',)
+    __slots__ = field_names
+
+    def __init__(self, sender, location=None):
+        self.sender = sender
+        self.location = location
+
+
+class OOCMessage(MessageRecord):
+    lane = OOC_LANE
+    prefix = 'OOC'
+    field_names = ('content',)
+    __slots__ = field_names
+
+    def __init__(self, sender, content=None):
+        self.sender = sender
+        self.content = remove_line_breaks(content)
+
+
+class LOOCMessage(MessageRecord):
+    lane = OOC_LANE
+    prefix = 'LOOC'
+    field_names = ('location', 'content')
+    __slots__ = field_names
+
+    def __init__(self, sender, location=None, content=None):
+        self.sender = sender
+        self.location = location
+        self.content = remove_line_breaks(content)
+
+
+class MusicMessage(MessageRecord):
+    prefix = 'm'
+    field_names = ('track_name', 'url')
+    __slots__ = field_names
+
+    def __init__(self, sender, track_name=None, url=None):
+        self.sender = sender
+        self.track_name = None if track_name == "0" else track_name
+        self.url = None if url == "0" else url
+
+    def to_irc(self):
+        track_name = "0" if self.track_name is None else self.track_name
+        url = "0" if self.url is None else self.url
+        msg = "m#{0}#{1}".format(track_name, url)
+        return msg
+
+    @classmethod
+    def from_fields(cls, sender, fields):
+        if len(fields) == 1:
+            fields = fields + [None]
+        return super().from_fields(sender, fields)
+
+
+class RollMessage(MessageRecord):
+    prefix = 'r'
+    field_names = ('roll',)
+    __slots__ = field_names
+
+    def __init__(self, sender, roll=None):
+        self.sender = sender
+        self.roll = roll
+
+
+class ItemMessage(MessageRecord):
+    prefix = 'i'
+    field_names = ('item',)
+    __slots__ = field_names
+
+    def __init__(self, sender, item=None):
+        self.sender = sender
+        self.item = remove_line_breaks(item)
+
+
+class ClearMessage(MessageRecord):
+    prefix = 'cl'
+    field_names = ('location',)
+    __slots__ = field_names
+
+    def __init__(self, sender, location=None):
+        self.sender = sender
+        self.location = location
+
+
+class FrameMessage(MessageRecord):
+    """Several messages sent in one line, like the location, character and nullpost answering a join.
+
+    Every packed line is prefixed by its length, so they can contain anything.
+    """
+    prefix = 'fr'
+    __slots__ = ('messages',)
+
+    def __init__(self, sender, messages=None):
+        if messages is None:
+            messages = []
+        self.sender = sender
+        self.messages = messages
+
+    @classmethod
+    def pack(cls, lines):
+        return cls.prefix + '#' + ''.join("{}:{}".format(len(line), line) for line in lines)
+
+    @classmethod
+    def unpack(cls, message):
+        lines = []
+        position = len(cls.prefix) + 1
+        while position < len(message):
+            separator = message.find(':', position)
+            try:
+                length = int(message[position:separator])
+            except ValueError:
+                raise IncorrectMessageTypeError(message)
+            start = separator + 1
+            if separator == -1 or length < 0 or start + length > len(message):
+                raise IncorrectMessageTypeError(message)
+            lines.append(message[start:start + length])
+            position = start + length
+        return lines
+
+    def to_irc(self):
+        return self.pack([msg.to_irc() for msg in self.messages])
+
+
+class HelloMessage:
+    """Sent by a client when it joins, so the others know it understands presence summaries."""
+    __slots__ = ('sender', 'version')
+    lane = STATE_LANE
+    ctcp_type = 'MOHELLO'
+
+    def __init__(self, sender, version=None):
+        self.sender = sender
+        self.version = version
+
+    def to_ctcp(self):
+        return self.ctcp_type, str(self.version)
+
+    @classmethod
+    def from_ctcp(cls, sender, data):
+        try:
+            version = int(data)
+        except ValueError:
+            version = 0
+        return cls(sender, version)
+
+
+class PresenceMessage:
+    """Compact summary of the room state, answering the join of the target user.
+
+    Every entry is (username, location, sublocation, position, character, sprite, sprite_option, dance, link,
+    version, protocol); fields that aren't known are empty. Entries from version 1 clients lack the protocol.
+    """
+    __slots__ = ('sender', 'target', 'entries')
+    lane = STATE_LANE
+    ctcp_type = 'MOSTATE'
+
+    def __init__(self, sender, target=None, entries=None):
+        if entries is None:
+            entries = []
+        self.sender = sender
+        self.target = target
+        self.entries = entries
+
+    def to_ctcp(self):
+        entries = [PRESENCE_FIELD_SEPARATOR.join(str(field) for field in entry) for entry in self.entries]
+        return self.ctcp_type, PRESENCE_ENTRY_SEPARATOR.join([self.target] + entries)
+
+    @classmethod
+    def from_ctcp(cls, sender, data):
+        parts = data.split(PRESENCE_ENTRY_SEPARATOR)
+        entries = []
+        for part in parts[1:]:
+            entry = part.split(PRESENCE_FIELD_SEPARATOR)
+            if len(entry) == 10:
+                entry.append('1')
+            if len(entry) == 11:
+                entries.append(tuple(entry))
+        return cls(sender, parts[0], entries)
+
+
+PROTOCOL_MESSAGES = (ChatMessage, IconMessage, ChoiceMessage, ChoiceReturnMessage, CharacterMessage, LocationMessage,
+                     OOCMessage, LOOCMessage, MusicMessage, RollMessage, ItemMessage, ClearMessage, FrameMessage,
+                     HelloMessage, PresenceMessage)
+
+
+class MessageFactory:
+    """Builds, encodes and decodes messages.
+
+    message_classes can replace any protocol message with a subclass, which is then what the factory builds;
+    that's how the client adds the behavior of every message.
+    """
+    message_classes = PROTOCOL_MESSAGES
+
+    def __init__(self, strict=False):
+        self.strict = strict
+        self.classes = {message_type: message_type for message_type in PROTOCOL_MESSAGES}
+        for message_class in self.message_classes:
+            for base in message_class.__mro__:
+                if base in self.classes:
+                    self.classes[base] = message_class
+        self.decoders = {message_type.prefix: self.classes[message_type] for message_type in
+                         (IconMessage, CharacterMessage, LocationMessage, OOCMessage, LOOCMessage, MusicMessage,
+                          RollMessage, ItemMessage, ClearMessage, ChoiceMessage, ChoiceReturnMessage)}
+        self.delta_decoders = {message_type.delta_prefix: self.classes[message_type] for message_type in
+                               (ChatMessage, IconMessage)}
+        self.sent_states = {}
+        self.received_states = {}
+        self.fragment_id = 0
+        self.fragments = FragmentBuffer()
+
+    def fragment(self, line):
+        """Splits a line that is too long for IRC into numbered fragments, FRAGMENT_PREFIX<id>#<index>#<count>#<chunk>.
+
+        Raises MessageTooLong if it needs more than FRAGMENT_MAX_COUNT fragments.
+        """
+        if len(line.encode('utf-8')) <= MAX_LINE_BYTES:
+            return [line]
+        chunk_bytes = MAX_LINE_BYTES - FRAGMENT_HEADER_BYTES
+        chunks = []
+        chunk = []
+        size = 0
+        for char in line:
+            char_size = len(char.encode('utf-8'))
+            if size + char_size > chunk_bytes:
+                chunks.append(''.join(chunk))
+                chunk = []
+                size = 0
+            chunk.append(char)
+            size += char_size
+        chunks.append(''.join(chunk))
+        if len(chunks) > FRAGMENT_MAX_COUNT:
+            raise MessageTooLong("Message needs {} fragments".format(len(chunks)))
+        self.fragment_id = (self.fragment_id + 1) % 0x10000
+        return ["{}{:x}#{}#{}#{}".format(FRAGMENT_PREFIX, self.fragment_id, i, len(chunks), chunk)
+                for i, chunk in enumerate(chunks)]
+
+    def reassemble(self, line, username):
+        """Returns the line itself, the whole message if it was its last fragment, or None if more are expected."""
+        if not line.startswith(FRAGMENT_PREFIX):
+            return line
+        return self.fragments.add(username, line)
+
+    def encode(self, msg, delta=False):
+        """Returns the line to send for a message.
+
+        Chat and icon messages only send what changed since the last one of their kind when delta is True,
+        with a full keyframe every DELTA_KEYFRAME_INTERVAL messages.
+        """
+        if isinstance(msg, FrameMessage):
+            return FrameMessage.pack([self.encode(sub_message, delta) for sub_message in msg.messages])
+        if not isinstance(msg, (ChatMessage, IconMessage)):
+            return msg.to_irc()
+        values = msg.get_delta_values()
+        previous, count = self.sent_states.get(msg.delta_prefix, (None, 0))
+        if not delta or previous is None or count >= DELTA_KEYFRAME_INTERVAL:
+            self.sent_states[msg.delta_prefix] = (values, 1)
+            return msg.to_irc()
+        self.sent_states[msg.delta_prefix] = (values, count + 1)
+        return msg.to_delta(previous)
+
+    def reset_sent_states(self):
+        """Makes the next chat and icon messages keyframes, for clients that don't know our state yet."""
+        self.sent_states.clear()
+
+    def forget_sender(self, username):
+        self.received_states.pop((username, ChatMessage.delta_prefix), None)
+        self.received_states.pop((username, IconMessage.delta_prefix), None)
+
+    def build_chat_message(self, **kwargs):
+        username = kwargs.pop('username', None)
+        if username is not None:
+            result = self.classes[ChatMessage](username, **kwargs)
+        else:
+            result = self.classes[ChatMessage]("default", **kwargs)
+        return result
+
+    def build_icon_message(self, **kwargs):
+        username = kwargs.pop('username', None)
+        if username is not None:
+            result = self.classes[IconMessage](username, **kwargs)
+        else:
+            result = self.classes[IconMessage]("default", **kwargs)
+        return result
+
+    def build_character_message(self, character, link=None, version=None, username="default"):
+        result = self.classes[CharacterMessage](username, character, link, version)
+        return result
+
+    def build_location_message(self, location, username="default"):
+        result = self.classes[LocationMessage](username, location)
+        return result
+
+    def build_ooc_message(self, content, username="default"):
+        result = self.classes[OOCMessage](username, content)
+        return result
+
+    def build_looc_message(self, location, content):
+        result = self.classes[LOOCMessage]("default", location, content)
+        return result
+
+    def build_music_message(self, track_name, url):
+        result = self.classes[MusicMessage]("default", track_name, url)
+        return result
+
+    def build_roll_message(self, roll):
+        result = self.classes[RollMessage]("default", roll)
+        return result
+
+    def build_item_message(self, item):
+        result = self.classes[ItemMessage]("default", item)
+        return result
+
+    def build_clear_message(self, location):
+        result = self.classes[ClearMessage]("default", location)
+        return result
+
+    def build_choice_message(self, sender, text, options, list_of_users):
+        result = self.classes[ChoiceMessage](sender, text, options, list_of_users)
+        return result
+
+    def build_choice_return_message(self, sender, questioner, whisper, selected_option):
+        result = self.classes[ChoiceReturnMessage](sender, questioner, whisper, selected_option)
+        return result
+
+    def build_hello_message(self):
+        result = self.classes[HelloMessage]("default", PROTOCOL_VERSION)
+        return result
+
+    def build_presence_message(self, target, entries):
+        result = self.classes[PresenceMessage]("default", target, entries)
+        return result
+
+    def build_frame_message(self, messages, username="default"):
+        result = self.classes[FrameMessage](username, messages)
+        return result
+
+    def build_from_ctcp(self, arguments, username):
+        ctcp_type = arguments[0]
+        data = arguments[1] if len(arguments) > 1 else ''
+        if ctcp_type == HelloMessage.ctcp_type:
+            return self.classes[HelloMessage].from_ctcp(username, data)
+        elif ctcp_type == PresenceMessage.ctcp_type:
+            return self.classes[PresenceMessage].from_ctcp(username, data)
+        raise IncorrectMessageTypeError(ctcp_type)
+
+    def build_from_irc(self, irc_message, username):
+        """Builds the message received from username, or returns None if it was an incomplete fragment."""
+        irc_message = self.reassemble(irc_message, username)
+        if irc_message is None:
+            return None
+        if irc_message.startswith(FrameMessage.prefix + '#'):
+            lines = FrameMessage.unpack(irc_message)
+            if any(line.startswith(FrameMessage.prefix + '#') for line in lines):
+                raise IncorrectMessageTypeError("Nested frame")
+            return self.classes[FrameMessage](username, [self.build_from_line(line, username) for line in lines])
+        return self.build_from_line(irc_message, username)
+
+    def build_from_line(self, irc_message, username):
+        prefix, separator, body = irc_message.partition('#')
+        if prefix in self.delta_decoders:
+            previous = self.received_states.get((username, prefix))
+            result = self.delta_decoders[prefix].from_delta(username, irc_message, previous)
+        else:
+            message_type = self.decoders.get(prefix) if separator else None
+            result = self.decode(message_type, irc_message, body, username)
+        if isinstance(result, (ChatMessage, IconMessage)):
+            self.received_states[(username, result.delta_prefix)] = result.get_delta_values()
+        return result
+
+    def decode(self, message_type, irc_message, body, username):
+        """Splits the body once and hands its fields to the message type.
+
+        Lines without a known prefix are chat messages when they have all their fields. Anything else is shown
+        as OOC, unless the factory is strict. Strict factories also reject the shorter legacy formats.
+        """
+        if message_type is None:
+            message_type = self.classes[ChatMessage]
+            field_count = len(ChatMessage.field_names)
+            fields = irc_message.split('#', field_count - 1)
+            if len(fields) != field_count:
+                if self.strict:
+                    raise IncorrectMessageTypeError(irc_message)
+                message_type = self.classes[OOCMessage]
+                fields = [irc_message]
+        else:
+            field_count = len(message_type.field_names)
+            fields = body.split('#', field_count - 1)
+            if self.strict and len(fields) != field_count:
+                raise IncorrectMessageTypeError(irc_message)
+        try:
+            return message_type.from_fields(username, fields)
+        except (ValueError, IndexError):
+            raise IncorrectMessageTypeError(irc_message)
@@ -0,0 +1,218 @@
+"""Headless model of the room: who is where, as which character and sprite, and who is muted.
+
+RoomState applies decoded protocol messages without touching any widget and tells its subscribers what changed,
+so the Kivy layer can collect the changes and redraw once per frame instead of once per message, and benchmarks
+can simulate crowded rooms without a window. Users are indexed by location, so finding who is in a location
+takes constant time however crowded the room is.
+"""
+from MysteryOnline import protocol
+
+# Change events, passed to subscribers along with the username
+USER_ADDED = 'user_added'
+USER_REMOVED = 'user_removed'
+LOCATION_CHANGED = 'location_changed'
+SUBLOCATION_CHANGED = 'sublocation_changed'
+CHARACTER_CHANGED = 'character_changed'
+SPRITE_CHANGED = 'sprite_changed'
+MUTE_CHANGED = 'mute_changed'
+
+POSITIONS = ('left', 'center', 'right')
+
+
+class UserState:
+    """What the room knows about a user. Fields that were never announced are None."""
+    __slots__ = ('username', 'location', 'sublocation', 'position', 'character', 'character_link', 'version',
+                 'sprite', 'sprite_option', 'dance')
+
+    def __init__(self, username):
+        self.username = username
+        self.location = None
+        self.sublocation = None
+        self.position = None
+        self.character = None
+        self.character_link = None
+        self.version = None
+        self.sprite = None
+        self.sprite_option = None
+        self.dance = False
+
+
+class UserStack:
+    """Users in the order they arrived, with constant time membership tests, removal and access to the latest one."""
+    __slots__ = ('users',)
+
+    def __init__(self, users=()):
+        self.users = dict.fromkeys(users)
+
+    def append(self, user):
+        """Puts the user on top, moving them there if they already were in."""
+        self.users.pop(user, None)
+        self.users[user] = None
+
+    def remove(self, user):
+        try:
+            del self.users[user]
+        except KeyError:
+            raise ValueError("{!r} is not in the stack".format(user)) from None
+
+    def discard(self, user):
+        self.users.pop(user, None)
+
+    def last(self):
+        """The user that arrived last, None when empty."""
+        return next(reversed(self.users), None)
+
+    def __contains__(self, user):
+        return user in self.users
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+    def __eq__(self, other):
+        if isinstance(other, UserStack):
+            return list(self.users) == list(other.users)
+        if isinstance(other, list):
+            return list(self.users) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return "UserStack({!r})".format(list(self.users))
+
+
+class RoomState:
+
+    def __init__(self, local_username=None):
+        self.local_username = local_username
+        self.users = {}
+        self.muted = set()
+        self.by_location = {}
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """callback(event, username) is called for every change, as it happens."""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        try:
+            self.subscribers.remove(callback)
+        except ValueError:
+            pass
+
+    def notify(self, event, username):
+        for callback in self.subscribers:
+            callback(event, username)
+
+    def add_user(self, username):
+        user = self.users.get(username)
+        if user is None:
+            user = self.users[username] = UserState(username)
+            self.notify(USER_ADDED, username)
+        return user
+
+    def remove_user(self, username):
+        user = self.users.pop(username, None)
+        if user is None:
+            return
+        self.unindex_location(user)
+        self.muted.discard(username)
+        self.notify(USER_REMOVED, username)
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def set_muted(self, username, muted):
+        if muted == (username in self.muted):
+            return
+        if muted:
+            self.muted.add(username)
+        else:
+            self.muted.discard(username)
+        self.notify(MUTE_CHANGED, username)
+
+    def is_muted(self, username):
+        return username in self.muted
+
+    def get_users_in(self, location):
+        return [self.users[username] for username in self.by_location.get(location, ())]
+
+    def apply(self, msg):
+        """Updates the room from a decoded message, ignoring the ones that change nothing. Our own messages come
+        from "default" and are recorded under local_username once it is known."""
+        sender = msg.sender
+        if sender == "default":
+            sender = self.local_username
+            if sender is None:
+                return
+        if isinstance(msg, protocol.FrameMessage):
+            for sub_message in msg.messages:
+                self.apply(sub_message)
+        elif isinstance(msg, (protocol.ChatMessage, protocol.IconMessage)):
+            self.apply_sprite(sender, msg)
+        elif isinstance(msg, protocol.LocationMessage):
+            self.set_location(sender, msg.location)
+        elif isinstance(msg, protocol.CharacterMessage):
+            self.set_character(sender, msg.character, msg.character_link, msg.version)
+
+    def apply_sprite(self, username, msg):
+        user = self.add_user(username)
+        if user.location != msg.location:
+            self.set_location(username, msg.location)
+        self.set_spot(user, msg.sublocation, msg.position)
+        if user.character != msg.character:
+            user.character = msg.character
+            self.notify(CHARACTER_CHANGED, user.username)
+        dance = getattr(msg, 'dance', None)
+        if dance is not None:
+            dance = dance in ("True", True, 1, "true")
+        else:
+            dance = user.dance
+        if (user.sprite, user.sprite_option, user.dance) != (msg.sprite, msg.sprite_option, dance):
+            user.sprite = msg.sprite
+            user.sprite_option = msg.sprite_option
+            user.dance = dance
+            self.notify(SPRITE_CHANGED, user.username)
+
+    def set_location(self, username, location):
+        user = self.add_user(username)
+        if user.location == location:
+            return
+        self.unindex_location(user)
+        user.location = location
+        user.sublocation = None
+        if location is not None:
+            self.by_location.setdefault(location, set()).add(username)
+        self.notify(LOCATION_CHANGED, username)
+
+    def set_character(self, username, character, link=None, version=None):
+        user = self.add_user(username)
+        user.character_link = link
+        user.version = version
+        if user.character == character:
+            return
+        user.character = character
+        self.notify(CHARACTER_CHANGED, username)
+
+    def set_spot(self, user, sublocation, position):
+        if position not in POSITIONS:
+            position = 'center'
+        if (user.sublocation, user.position) == (sublocation, position):
+            return
+        user.sublocation = sublocation
+        user.position = position
+        self.notify(SUBLOCATION_CHANGED, user.username)
+
+    def unindex_location(self, user):
+        discard_from(self.by_location, user.location, user.username)
+
+
+def discard_from(index, key, username):
+    """Removes username from the set index[key], dropping the key once nobody is left."""
+    usernames = index.get(key)
+    if usernames is None:
+        return
+    usernames.discard(username)
+    if not usernames:
+        del index[key]
@@ -10,13 +10,17 @@ from kivy.config import ConfigParser
 
 from MysteryOnline.location import SubLocation
 from MysteryOnline.sprite_organizer import SpriteOrganizer
+from MysteryOnline.texture_cache import texture_cache, BACKGROUND
 import copy
+import weakref
+from functools import partial
 
 
 class NullSprite:
 
     def __init__(self, name):
         self.name = name
+        self.cache_key = None
 
     def unset_nsfw(self):
         pass
@@ -53,9 +57,10 @@ class NullSprite:
 
 class Sprite:
 
-    def __init__(self, name, texture):
+    def __init__(self, name, texture, cache_key=None):
         self.name = name
         self.texture = texture
+        self.cache_key = cache_key
         self.nsfw = False
         self.spoiler = False
         self.cg = False
@@ -134,7 +139,9 @@ class SpriteSettings(BoxLayout):
         super(SpriteSettings, self).__init__(**kwargs)
         self.functions = {"flip_h": self.flip_sprite}
         self.activated = []
-        self.flipped = []
+        # (cache key, sprite name) -> weak reference to the flipped Sprite, so evicted pages aren't kept alive.
+        # A page decoded again brings new, unflipped sprites, which don't match the reference.
+        self.flipped = {}
         self.pos_drop = None
         self.subloc_drop = None
         self.create_pos_drop()
@@ -142,14 +149,17 @@ class SpriteSettings(BoxLayout):
 
     def apply_post_processing(self, sprite, setting):
         try:
+            key = (sprite.cache_key, sprite.name)
+            flipped = self.flipped.get(key)
+            is_flipped = flipped is not None and flipped() is sprite
             if setting == 0:
-                if sprite not in self.flipped:
+                if not is_flipped:
                     self.flip_sprite(sprite.texture)
-                    self.flipped.append(sprite)
+                    self.flipped[key] = weakref.ref(sprite)
             else:
-                if sprite in self.flipped:
+                if is_flipped:
                     self.flip_sprite(sprite.texture)
-                    self.flipped.remove(sprite)
+                self.flipped.pop(key, None)
         except AttributeError:
             pass
         return sprite
@@ -243,8 +253,16 @@ class SpritePreview(Image):
     def __init__(self, **kwargs):
         super(SpritePreview, self).__init__(**kwargs)
 
+    def pin(self, slot, key):
+        """Keeps what the slot shows out of the texture cache's evictions."""
+        texture_cache.pin((self, slot), key)
+
+    def unpin(self, slot):
+        texture_cache.unpin((self, slot))
+
     def set_subloc(self, sub):
         self.texture = sub.get_img().texture
+        self.pin('background', (BACKGROUND, sub.img_path))
 
     def set_sprite(self, sprite):
         user_handler = App.get_running_app().get_user_handler()
@@ -253,6 +271,7 @@ class SpritePreview(Image):
         sprite = main_scr.sprite_settings.apply_post_processing(sprite, sprite_option)
         self.center_sprite.texture = None
         self.center_sprite.texture = sprite.get_texture()
+        self.pin('center', sprite.cache_key)
         self.center_sprite.opacity = 1
         self.center_sprite.size = (self.center_sprite.texture.width / 3,
                                    self.center_sprite.texture.height / 3)
@@ -282,11 +301,22 @@ class SpriteWindow(Widget):
         self.sprite_organizer.add_sprite(self.right_sprite)
         self.sprite_organizer.add_sprite(self.foreground)
         self.sprite_organizer.add_sprite(self.overlay)
+        self.refresh_trigger = Clock.create_trigger(lambda dt: self.refresh_sub())
+
+    def is_sprite_ready(self, user, callback=None):
+        """False while the user's sprite is decoded in the background, callback (or a refresh) follows once ready.
+
+        Until then, whatever the slot showed before stays on screen.
+        """
+        if user.is_sprite_loaded():
+            return True
+        user.load_sprite_async(callback or self.refresh_trigger)
+        return False
 
     def set_sprite(self, user, display_sub=True):
-        sprite = user.get_current_sprite()
-        if sprite.is_cg():
-            self.set_cg(sprite, user)
+        if user.is_current_sprite_cg():
+            if self.is_sprite_ready(user, partial(self.set_sprite, user, display_sub)):
+                self.set_cg(user.get_current_sprite(), user)
             return
         subloc = user.get_subloc()
         pos = user.get_pos()
@@ -344,6 +374,7 @@ class SpriteWindow(Widget):
         sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
         self.center_sprite.texture = None
         self.center_sprite.texture = sprite.get_texture()
+        self.pin('center', sprite.cache_key)
         self.center_sprite.opacity = 1
         self.center_sprite.size = 800, 600
 
@@ -353,10 +384,29 @@ class SpriteWindow(Widget):
         self.center_sprite.opacity = value
         self.foreground.opacity = value
         self.overlay.opacity = value
+        if value == 0:
+            for slot in ('left', 'right', 'center', 'foreground', 'overlay'):
+                self.unpin(slot)
+
+    def pin(self, slot, key):
+        """Keeps what the slot shows out of the texture cache's evictions."""
+        texture_cache.pin((self, slot), key)
+
+    def unpin(self, slot):
+        texture_cache.unpin((self, slot))
 
     def set_subloc(self, subloc):
         self.subloc = subloc
+        if not subloc.is_loaded():
+            subloc.load_async(partial(self.on_subloc_loaded, subloc))
+            return
         self.background.texture = subloc.get_img().texture
+        self.pin('background', (BACKGROUND, subloc.img_path))
+
+    def on_subloc_loaded(self, subloc):
+        if self.subloc is subloc:
+            self.set_subloc(subloc)
+            self.refresh_trigger()
 
     def display_sub(self, subloc: SubLocation):
         if subloc is None:
@@ -366,32 +416,42 @@ class SpriteWindow(Widget):
         self.subloc = subloc
         if subloc.o_users:
             user = subloc.get_o_user()
-            if user.get_subloc() == subloc:
+            if user.get_subloc() != subloc:
+                subloc.remove_o_user(user)
+                self.overlay.opacity = 0
+                self.unpin('overlay')
+                self.overlay.texture = None
+            elif self.is_sprite_ready(user):
                 sprite = user.get_current_sprite()
                 option = user.get_sprite_option()
                 sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
                 if sprite is not None:
                     self.overlay.texture = None
                     self.overlay.texture = sprite.get_texture()
+                    self.pin('overlay', sprite.cache_key)
                     self.overlay.opacity = 1
                     self.overlay.size = self.overlay.texture.size
-            else:
-                subloc.remove_o_user(user)
-                self.overlay.opacity = 0
-                self.overlay.texture = None
         else:
             self.overlay.texture = None
             self.overlay.opacity = 0
+            self.unpin('overlay')
 
         self.foreground.opacity = 0
-        if subloc.has_foreground():
+        self.unpin('foreground')
+        if subloc.has_foreground() and subloc.is_loaded() and subloc.get_foreground_img().texture is not None:
             self.foreground.texture = None
             self.foreground.texture = subloc.get_foreground_img().texture
+            self.pin('foreground', (BACKGROUND, subloc.foreground_path))
             self.foreground.opacity = 1
 
         if subloc.c_users:
             user = subloc.get_c_user()
-            if user.get_subloc() == subloc:
+            if user.get_subloc() != subloc:
+                subloc.remove_c_user(user)
+                self.center_sprite.opacity = 0
+                self.unpin('center')
+                self.center_sprite.texture = None
+            elif self.is_sprite_ready(user):
                 sprite = user.get_current_sprite()
                 option = user.get_sprite_option()
                 sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
@@ -401,53 +461,57 @@ class SpriteWindow(Widget):
                         return
                     self.center_sprite.texture = None
                     self.center_sprite.texture = sprite.get_texture()
+                    self.pin('center', sprite.cache_key)
                     self.center_sprite.opacity = 1
                     self.center_sprite.size = self.center_sprite.texture.size
-            else:
-                subloc.remove_c_user(user)
-                self.center_sprite.opacity = 0
-                self.center_sprite.texture = None
         else:
             self.center_sprite.texture = None
             self.center_sprite.opacity = 0
+            self.unpin('center')
 
         if subloc.l_users:
             user = subloc.get_l_user()
-            if user.get_subloc() == subloc:
+            if user.get_subloc() != subloc:
+                subloc.remove_l_user(user)
+                self.left_sprite.opacity = 0
+                self.unpin('left')
+                self.left_sprite.texture = None
+            elif self.is_sprite_ready(user):
                 sprite = user.get_current_sprite()
                 option = user.get_sprite_option()
                 sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
                 if sprite is not None:
                     self.left_sprite.texture = None
                     self.left_sprite.texture = sprite.get_texture()
+                    self.pin('left', sprite.cache_key)
                     self.left_sprite.opacity = 1
                     self.left_sprite.size = self.left_sprite.texture.size
-            else:
-                subloc.remove_l_user(user)
-                self.left_sprite.opacity = 0
-                self.left_sprite.texture = None
         else:
             self.left_sprite.texture = None
             self.left_sprite.opacity = 0
+            self.unpin('left')
 
         if subloc.r_users:
             user = subloc.get_r_user()
-            if user.get_subloc() == subloc:
+            if user.get_subloc() != subloc:
+                subloc.remove_r_user(user)
+                self.right_sprite.opacity = 0
+                self.unpin('right')
+                self.right_sprite.texture = None
+            elif self.is_sprite_ready(user):
                 sprite = user.get_current_sprite()
                 option = user.get_sprite_option()
                 sprite = main_scr.sprite_settings.apply_post_processing(sprite, option)
                 if sprite is not None:
                     self.right_sprite.texture = None
                     self.right_sprite.texture = sprite.get_texture()
+                    self.pin('right', sprite.cache_key)
                     self.right_sprite.opacity = 1
                     self.right_sprite.size = self.right_sprite.texture.size
-            else:
-                subloc.remove_r_user(user)
-                self.right_sprite.opacity = 0
-                self.right_sprite.texture = None
         else:
             self.right_sprite.texture = None
             self.right_sprite.opacity = 0
+            self.unpin('right')
 
     def refresh_sub(self):
         self.display_sub(self.subloc)
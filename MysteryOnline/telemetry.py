@@ -0,0 +1,127 @@
+"""Timings of every stage of a message's life, kept as rolling percentiles to tell server lag from client lag.
+
+Incoming messages are timed when parsed, while waiting in the queue, while executed, until the text box starts
+displaying them and while it displays them. The connection itself is timed by the PING/PONG round trip and by how
+long our own messages wait for flood control before being sent.
+
+HandlerProfiler adds per message type counters: how often each is executed, for how long, and how many bytes of it
+were received.
+"""
+import json
+from collections import deque
+
+PARSE = 'parse'
+QUEUE = 'queue'
+EXECUTE = 'execute'
+DISPLAY_START = 'display_start'
+DISPLAY = 'display'
+RTT = 'rtt'
+SEND_WAIT = 'send_wait'
+
+STAGES = (PARSE, QUEUE, EXECUTE, DISPLAY_START, DISPLAY, RTT, SEND_WAIT)
+STAGE_NAMES = {PARSE: "Parse", QUEUE: "Queue wait", EXECUTE: "Execute", DISPLAY_START: "Receive to display",
+               DISPLAY: "Display", RTT: "Server round trip", SEND_WAIT: "Send wait"}
+
+
+class RollingPercentiles:
+    """Keeps the last size samples, in seconds."""
+
+    def __init__(self, size=500):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        """Returns the sample count and the p50, p95, p99 and max of the window, in milliseconds."""
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {'count': self.count, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+
+        def percentile(percent):
+            return ordered[min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))] * 1000
+
+        return {'count': self.count, 'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99),
+                'max': ordered[-1] * 1000}
+
+
+class Telemetry:
+
+    def __init__(self, size=500):
+        self.stages = {stage: RollingPercentiles(size) for stage in STAGES}
+
+    def record(self, stage, seconds):
+        self.stages[stage].add(seconds)
+
+    def summary(self):
+        return {stage: self.stages[stage].summary() for stage in STAGES}
+
+    def format_summary(self):
+        lines = []
+        for stage, summary in self.summary().items():
+            lines.append("{}: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, max {max:.1f} ms "
+                         "({count})".format(STAGE_NAMES[stage], **summary))
+        return "\n".join(lines)
+
+
+class HandlerStats:
+    __slots__ = ('calls', 'total', 'max', 'bytes', 'received')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.received = 0
+
+
+class HandlerProfiler:
+    """Counts calls, wall time and received bytes per message type.
+
+    Times are inclusive: a frame's time covers the messages it carries, which are also counted on their own.
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def get(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = HandlerStats()
+        return stats
+
+    def record_execute(self, name, seconds):
+        stats = self.get(name)
+        stats.calls += 1
+        stats.total += seconds
+        if seconds > stats.max:
+            stats.max = seconds
+
+    def record_received(self, name, size):
+        stats = self.get(name)
+        stats.received += 1
+        stats.bytes += size
+
+    def reset(self):
+        self.stats = {}
+
+    def summary(self):
+        """Returns {message type: counters}, times in milliseconds, the most expensive types first."""
+        ordered = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)
+        return {name: {'calls': stats.calls, 'total_ms': stats.total * 1000, 'max_ms': stats.max * 1000,
+                       'mean_ms': stats.total * 1000 / stats.calls if stats.calls else 0.0,
+                       'received': stats.received, 'bytes': stats.bytes}
+                for name, stats in ordered}
+
+    def format_summary(self):
+        lines = []
+        for name, stats in self.summary().items():
+            lines.append("{}: {calls} calls, {total_ms:.1f} ms total, {max_ms:.1f} ms max, {received} received, "
+                         "{bytes} bytes".format(name, **stats))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as dump_file:
+            json.dump(self.summary(), dump_file, indent=2)
@@ -23,6 +23,7 @@ class TextBox(Label):
     char_name = ObjectProperty(None)
 
     def __init__(self, **kwargs):
+        self.register_event_type('on_text_displayed')
         super(TextBox, self).__init__(**kwargs)
         self.msg = ""
         self.prev_user = None
@@ -108,7 +109,7 @@ class TextBox(Label):
             v = App.get_running_app().exponential_volume(config.getdefaultint('sound', 'blip_volume', 100))
         App.get_running_app().play_sound(sfx, volume=v)
 
-    def display_text(self, msg, user, color, sender):
+    def display_text(self, msg, user, color, sender, instant=False):
         self.is_displaying_msg = True
         if self.prev_user is not user or (len(self.text) + len(msg) > 240):
             self.clear_textbox()
@@ -127,7 +128,7 @@ class TextBox(Label):
                 yield c
 
         config = App.get_running_app().config
-        if user.color == 'ffffff' and config.getint('other', 'instant_text') == 0:
+        if user.color == 'ffffff' and config.getint('other', 'instant_text') == 0 and not instant:
             self.gen = text_gen(self.msg)
             config = App.get_running_app().config
             speed = config.getdefaultint('other', 'textbox_speed', 60)
@@ -136,29 +137,7 @@ class TextBox(Label):
         else:
             if user.color in self.sfx:
                 App.get_running_app().play_sound(self.sfx[user.color], volume=self.sfx_volume)
-
-            if user.color != 'rainbow':
-                self.msg = "[color={}]{}[/color]".format(user.color, self.msg)
-            else:
-                self.msg = self.msg.replace("&bl;", "[")
-                self.msg = self.msg.replace("&br;", "]")
-                self.msg = self.msg.replace("&amp;", "&")
-                msg_array = list(self.msg)
-                self.msg = ''
-                # ff5aac
-                if config.getint("other", "suppress_rainbow") == 0:
-                    color_spectrum = ['ff3333', 'ffa500', 'ffff00', '33cc33', '00adfc', '8b6fba', 'ee82ee']
-                else:
-                    color_spectrum = ['ff8181', 'ffd689', 'ffff89', 'a1e7a1', '86d9ff', 'b6a4d3', 'f093f0']
-                y = 0
-
-                for x in range(len(msg_array)):
-                    if y == 7:
-                        y = 0
-                    col = color_spectrum[y]
-                    self.msg += "[color={}]{}[/color]".format(col, escape_markup(msg_array[x]))
-                    if msg_array[x] != ' ':
-                        y = y + 1
+            self.msg = self.colorize(self.msg, user.color)
             self.text = self.msg
             self.text += " "
             self.is_displaying_msg = False
@@ -169,6 +148,42 @@ class TextBox(Label):
         user.color = 'ffffff'
         user.colored = False
 
+    def log_text(self, msg, user, color, sender):
+        """Sends a message straight to the log, leaving the text box alone."""
+        if color != 'ffffff':
+            msg = self.colorize(msg, color)
+        main_scr = App.get_running_app().get_main_screen()
+        main_scr.log_window.add_chat_entry(msg, user.username)
+        if sender == "default":
+            main_scr.toolbar.text_col_btn.text = 'color'
+        user.color = 'ffffff'
+        user.colored = False
+
+    def colorize(self, msg, color):
+        if color != 'rainbow':
+            return "[color={}]{}[/color]".format(color, msg)
+        config = App.get_running_app().config
+        msg = msg.replace("&bl;", "[")
+        msg = msg.replace("&br;", "]")
+        msg = msg.replace("&amp;", "&")
+        msg_array = list(msg)
+        msg = ''
+        # ff5aac
+        if config.getint("other", "suppress_rainbow") == 0:
+            color_spectrum = ['ff3333', 'ffa500', 'ffff00', '33cc33', '00adfc', '8b6fba', 'ee82ee']
+        else:
+            color_spectrum = ['ff8181', 'ffd689', 'ffff89', 'a1e7a1', '86d9ff', 'b6a4d3', 'f093f0']
+        y = 0
+
+        for x in range(len(msg_array)):
+            if y == 7:
+                y = 0
+            col = color_spectrum[y]
+            msg += "[color={}]{}[/color]".format(col, escape_markup(msg_array[x]))
+            if msg_array[x] != ' ':
+                y = y + 1
+        return msg
+
     def _animate(self, dt):
         try:
             self.sfx["ffffff"].play()
@@ -177,8 +192,13 @@ class TextBox(Label):
         except StopIteration:
             self.text += " "
             self.is_displaying_msg = False
+            self.dispatch('on_text_displayed')
             return False
 
+    def on_text_displayed(self, *args):
+        """Fired when the typewriter animation of a message is over."""
+        pass
+
     def unload_blip(self, delta):
         if platform != "win":
             self.sfx["ffffff"].unload()
@@ -217,7 +237,8 @@ class MainTextInput(TextInput):
         self.icon_change_spam = False
 
     def send_message(self, *args):
-        if len(self.text) > 250:
+        connection_manager = App.get_running_app().get_user_handler().get_connection_manager()
+        if len(self.text) > connection_manager.get_max_message_length(250):
             popup = MOPopup("Warning", "Message too long", "OK")
             popup.open()
             return
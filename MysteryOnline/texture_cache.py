@@ -0,0 +1,110 @@
+"""One memory budget for every decoded image: sprite atlas pages, sublocation backgrounds and icon atlases.
+
+Whoever decodes an image registers it with a release callback. Once the budget is exceeded, the least recently
+displayed entries are released first. Entries pinned by a widget that is showing them are never released.
+Sizes are estimated as the RGBA texture Kivy uploads, 4 bytes per pixel.
+"""
+from collections import OrderedDict
+
+PAGE = 'page'
+BACKGROUND = 'background'
+ICONS = 'icons'
+
+MEGABYTE = 1024 * 1024
+
+
+def texture_bytes(width, height):
+    return int(width) * int(height) * 4
+
+
+class CacheEntry:
+    __slots__ = ('size', 'release')
+
+    def __init__(self, size, release):
+        self.size = size
+        self.release = release
+
+
+class TextureCache:
+
+    def __init__(self, budget=512 * MEGABYTE):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.used = 0
+        self.pins = {}
+        self.pinned = {}
+        self.evictions = 0
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def add(self, key, size, release):
+        """Registers a decoded image, release() is called when it gets evicted."""
+        self.discard(key)
+        self.entries[key] = CacheEntry(size, release)
+        self.used += size
+        self.evict(keep=key)
+
+    def discard(self, key):
+        """Forgets an entry its owner dropped on its own, without calling its release."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.used -= entry.size
+
+    def touch(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+
+    def pin(self, holder, key):
+        """Marks key as displayed by holder, in place of whatever holder displayed before. None unpins."""
+        if self.pins.get(holder) == key:
+            self.touch(key)
+            return
+        self.unpin(holder)
+        if key is None:
+            return
+        self.pins[holder] = key
+        self.pinned[key] = self.pinned.get(key, 0) + 1
+        self.touch(key)
+
+    def unpin(self, holder):
+        key = self.pins.pop(holder, None)
+        if key is None:
+            return
+        count = self.pinned[key] - 1
+        if count:
+            self.pinned[key] = count
+        else:
+            del self.pinned[key]
+
+    def is_pinned(self, key):
+        return key in self.pinned
+
+    def evict(self, keep=None):
+        """Releases the least recently displayed entries until the budget is met, skipping pinned ones."""
+        if self.used <= self.budget:
+            return
+        for key in list(self.entries):
+            if self.used <= self.budget:
+                break
+            if key == keep or key in self.pinned:
+                continue
+            entry = self.entries.pop(key)
+            self.used -= entry.size
+            self.evictions += 1
+            entry.release()
+
+    def summary(self):
+        return {'entries': len(self.entries), 'used_mb': self.used / MEGABYTE, 'budget_mb': self.budget / MEGABYTE,
+                'pinned': len(self.pinned), 'evictions': self.evictions}
+
+    def format_summary(self):
+        return "Textures: {entries} entries, {used_mb:.1f} of {budget_mb:.0f} MB, {pinned} on screen, " \
+               "{evictions} evictions".format(**self.summary())
+
+
+texture_cache = TextureCache()
@@ -0,0 +1,89 @@
+"""Records the channel traffic a client receives and replays it, to reproduce stutters without a network.
+
+A capture is a JSON lines file, one IRC event per line with the seconds elapsed since the recording started:
+{"time": 1.25, "type": "pubmsg", "source": "Alice!alice@host", "target": "#channel", "arguments": ["..."]}
+Start the client with --record FILE to make one, and with --replay FILE [--speed N] to play it back.
+A speed of 0 replays as fast as possible.
+"""
+import json
+import time
+
+RECORDED_EVENTS = ("pubmsg", "privmsg", "ctcp", "join", "quit")
+
+
+class TrafficRecorder:
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8', buffering=1)
+        self.start = time.monotonic()
+
+    def on_event(self, connection, event):
+        """Global irc.client handler, called for every recorded event type."""
+        if self.file is None:
+            return
+        record = {"time": round(time.monotonic() - self.start, 6), "type": event.type, "source": str(event.source),
+                  "target": event.target, "arguments": list(event.arguments)}
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def load_capture(path):
+    with open(path, encoding='utf-8') as capture:
+        return [json.loads(line) for line in capture if line.strip()]
+
+
+class TrafficReplay:
+    """Hands out the events of a capture when they are due, speed times faster than they were recorded."""
+
+    def __init__(self, events, speed=1.0):
+        self.events = sorted(events, key=lambda event: event["time"])
+        self.speed = speed
+        self.position = 0
+        self.start = None
+
+    def due(self, now):
+        if self.start is None:
+            self.start = now
+        if self.speed > 0:
+            elapsed = (now - self.start) * self.speed
+        else:
+            elapsed = float('inf')
+        first = self.position
+        while self.position < len(self.events) and self.events[self.position]["time"] <= elapsed:
+            self.position += 1
+        return self.events[first:self.position]
+
+    def is_done(self):
+        return self.position >= len(self.events)
+
+
+class FrameTimes:
+    """Collects frame durations, in seconds, and summarizes them in milliseconds."""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, percent):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))
+        return ordered[index] * 1000
+
+    def summary(self):
+        if not self.samples:
+            return {'frames': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+        return {'frames': len(self.samples), 'mean': sum(self.samples) / len(self.samples) * 1000,
+                'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99),
+                'max': max(self.samples) * 1000}
+
+    def format_summary(self):
+        return "{frames} frames, mean {mean:.1f} ms, p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, " \
+               "max {max:.1f} ms".format(**self.summary())
@@ -1,6 +1,7 @@
 from MysteryOnline.character import characters
 from MysteryOnline.location import location_manager
 from MysteryOnline.inventory import UserInventory
+from MysteryOnline.prefetch import prefetcher
 
 from kivy.app import App
 
@@ -74,12 +75,28 @@ class User:
         self.current_sprite = num
 
     def get_current_sprite(self) -> Sprite:
+        character, sprite_name = self.get_current_sprite_source()
+        return character.get_sprite(sprite_name)
+
+    def get_current_sprite_source(self):
+        """The character and sprite name get_current_sprite hands out."""
         if self.character is not None:
-            return self.character.get_sprite(self.current_sprite)
-        else:
-            red_herring = characters["RedHerring"]
-            red_herring.load()
-            return red_herring.get_sprite("3")
+            return self.character, self.current_sprite
+        red_herring = characters["RedHerring"]
+        red_herring.load()
+        return red_herring, "3"
+
+    def is_sprite_loaded(self) -> bool:
+        character, sprite_name = self.get_current_sprite_source()
+        return character.is_sprite_loaded(sprite_name)
+
+    def load_sprite_async(self, callback):
+        character, sprite_name = self.get_current_sprite_source()
+        character.load_sprite_async(sprite_name, callback)
+
+    def is_current_sprite_cg(self) -> bool:
+        character, sprite_name = self.get_current_sprite_source()
+        return character.is_cg(sprite_name)
 
     def get_dance(self) -> bool:
         return self.dance
@@ -226,6 +243,10 @@ class CurrentUserHandler:
         message_factory = App.get_running_app().get_message_factory()
         message = message_factory.build_location_message(self.current_loc.name)
         self.connection_manager.send_msg(message)
+        main_scr = App.get_running_app().get_main_screen()
+        if main_scr is not None:
+            main_scr.room_state.set_location(self.user.username, self.current_loc.name)
+            prefetcher.warm_location(self.current_loc.name, main_scr)
 
     def on_current_subloc_name(self, *args):
         subloc = self.current_loc.get_sub(self.current_subloc_name)
@@ -0,0 +1,274 @@
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import irc.client
+from MysteryOnline import irc_mo
+from MysteryOnline.irc_mo import ConnectionManager, RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY, PROTOCOL_VERSION, \
+    CHAT_LANE, NORMAL_DISPLAY, INSTANT_DISPLAY, LOG_ONLY_DISPLAY
+
+
+class FakeConfig:
+
+    def getdefaultint(self, section, key, default):
+        return default
+
+    def add_callback(self, callback, section, key):
+        pass
+
+
+class FakeEvent:
+
+    def __init__(self, callback, delay):
+        self.callback = callback
+        self.delay = delay
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule_once(self, callback, delay=0):
+        event = FakeEvent(callback, delay)
+        self.scheduled.append(event)
+        return event
+
+    def schedule_interval(self, callback, interval):
+        return FakeEvent(callback, interval)
+
+
+class FakeLane:
+
+    def __init__(self):
+        self.depth = 0
+
+    def size(self):
+        return self.depth
+
+
+class FakeScheduler:
+
+    def __init__(self):
+        self.lanes = {CHAT_LANE: FakeLane()}
+        self.age = 0.0
+
+    def size(self):
+        return self.lanes[CHAT_LANE].depth
+
+    def oldest_age(self):
+        return self.age
+
+
+class FakeReactor:
+
+    def __init__(self):
+        self.mutex = threading.RLock()
+        self.scheduler = SimpleNamespace(execute_after=lambda delay, command: self.commands.append(command))
+        self.commands = []
+
+
+class FakeConnection:
+    reconnect_async = irc_mo.IrcConnection.reconnect_async
+
+    def __init__(self):
+        self.connection_manager = None
+        self.failures = 0
+        self.reconnects = 0
+        self.msg_q = FakeScheduler()
+        self.reactor = FakeReactor()
+        self.threaded = False
+
+    def is_threaded(self):
+        return self.threaded
+
+    def run_on_ui(self, callback, *args):
+        callback(*args)
+
+    def set_connection_manager(self, connection_manager):
+        self.connection_manager = connection_manager
+
+    def reconnect(self):
+        self.reconnects += 1
+        if self.failures:
+            self.failures -= 1
+            raise irc.client.ServerConnectionError("refused")
+
+
+class ConnectionManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.app = SimpleNamespace(config=FakeConfig(), get_main_screen=lambda: None)
+        patches = [mock.patch.object(irc_mo, 'Clock', self.clock),
+                   mock.patch.object(irc_mo.App, 'get_running_app', return_value=self.app)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.connection = FakeConnection()
+        self.manager = ConnectionManager(self.connection)
+
+
+class ReconnectTests(ConnectionManagerTestCase):
+
+    def test_backoff_doubles_up_to_the_limit(self):
+        delays = []
+        with mock.patch.object(irc_mo.random, 'uniform', side_effect=lambda low, high: high):
+            for _ in range(10):
+                self.manager.schedule_reconnect()
+                delays.append(self.clock.scheduled[-1].delay)
+        self.assertEqual([RECONNECT_BASE_DELAY * 2 ** i for i in range(6)], delays[:6])
+        self.assertEqual(RECONNECT_MAX_DELAY, max(delays))
+        self.assertEqual(RECONNECT_MAX_DELAY, delays[-1])
+
+    def test_delay_is_jittered(self):
+        self.manager.reconnect_attempt = 3
+        self.manager.schedule_reconnect()
+        delay = self.clock.scheduled[-1].delay
+        self.assertTrue(RECONNECT_BASE_DELAY * 4 <= delay <= RECONNECT_BASE_DELAY * 8)
+
+    def test_failed_attempt_schedules_the_next_one(self):
+        self.connection.failures = 1
+        self.manager.start_reconnecting()
+        self.assertTrue(self.manager.reconnecting)
+        self.assertEqual(1, self.manager.reconnect_attempt)
+        self.clock.scheduled[-1].callback()
+        self.assertEqual(1, self.connection.reconnects)
+        self.assertEqual(2, self.manager.reconnect_attempt)
+        self.assertEqual(self.manager.try_reconnect, self.clock.scheduled[-1].callback)
+
+    def test_threaded_reconnection_runs_on_the_network_thread(self):
+        self.connection.threaded = True
+        self.manager.start_reconnecting()
+        self.clock.scheduled[-1].callback()
+        self.assertEqual(0, self.connection.reconnects)
+        self.assertEqual(1, len(self.connection.reactor.commands))
+        self.connection.reactor.commands[0]()
+        self.assertEqual(1, self.connection.reconnects)
+        self.assertEqual(self.manager.on_reconnect_timeout, self.clock.scheduled[-1].callback)
+
+    def test_join_timeout_retries(self):
+        self.manager.start_reconnecting()
+        self.clock.scheduled[-1].callback()
+        self.assertEqual(self.manager.on_reconnect_timeout, self.clock.scheduled[-1].callback)
+        self.clock.scheduled[-1].callback()
+        self.assertEqual(2, self.manager.reconnect_attempt)
+        self.assertEqual(self.manager.try_reconnect, self.clock.scheduled[-1].callback)
+
+    def test_start_reconnecting_once(self):
+        self.manager.start_reconnecting()
+        self.manager.start_reconnecting()
+        self.assertEqual(1, self.manager.reconnect_attempt)
+
+    def test_joining_the_channel_resyncs(self):
+        self.app.get_message_factory = lambda: irc_mo.MessageFactory()
+        self.app.get_main_screen = lambda: SimpleNamespace(log_window=SimpleNamespace(add_entry=lambda text: None))
+        self.manager.start_reconnecting()
+        self.connection.send_ctcp = lambda *args: None
+        with mock.patch.object(self.manager, 'resync') as resync:
+            self.manager.on_channel_joined()
+        resync.assert_called_once_with()
+        self.assertFalse(self.manager.reconnecting)
+        self.assertEqual(0, self.manager.reconnect_attempt)
+        self.assertIsNone(self.manager.reconnect_event)
+
+
+class OutgoingTests(ConnectionManagerTestCase):
+
+    def test_ctcp_waits_for_a_token(self):
+        sent = []
+        self.connection.send_ctcp = lambda *args: sent.append(args)
+        self.connection.telemetry = SimpleNamespace(record=lambda *args: None)
+        self.app.get_message_factory = lambda: irc_mo.MessageFactory()
+        self.manager.outgoing.configure(1, 60)
+        self.manager.on_channel_joined()
+        self.manager.on_channel_joined()
+        self.assertEqual(1, len(sent))
+        self.assertEqual('MOHELLO', sent[0][0])
+        self.assertEqual(1, self.manager.outgoing.size())
+        self.assertEqual(self.manager.flush_outgoing, self.clock.scheduled[-1].callback)
+
+    def test_dropped_message_forces_a_keyframe(self):
+        message_factory = irc_mo.MessageFactory()
+        self.app.get_message_factory = lambda: message_factory
+        self.connection.telemetry = SimpleNamespace(record=lambda *args: None)
+
+        def send_msg(line):
+            raise irc.client.MessageTooLong()
+        self.connection.send_msg = send_msg
+        with mock.patch.object(irc_mo, 'MOPopup'):
+            self.manager.send_msg(message_factory.build_icon_message(sprite="1"))
+        self.assertEqual({}, message_factory.sent_states)
+
+
+class BacklogTests(ConnectionManagerTestCase):
+
+    def display_modes(self, depths):
+        modes = []
+        for depth in depths:
+            self.connection.msg_q.lanes[CHAT_LANE].depth = depth
+            modes.append(self.manager.get_chat_display_mode())
+        return modes
+
+    def test_display_mode_follows_depth(self):
+        self.assertEqual([NORMAL_DISPLAY, NORMAL_DISPLAY, INSTANT_DISPLAY, INSTANT_DISPLAY],
+                         self.display_modes([0, 4, 5, 14]))
+
+    def test_catching_up_lasts_until_the_queue_is_empty(self):
+        self.assertEqual([LOG_ONLY_DISPLAY, LOG_ONLY_DISPLAY, LOG_ONLY_DISPLAY, INSTANT_DISPLAY, NORMAL_DISPLAY],
+                         self.display_modes([15, 6, 1, 0, 0]))
+
+    def test_zero_depth_turns_catching_up_off(self):
+        self.manager.catch_up_instant_depth = 0
+        self.manager.catch_up_log_depth = 0
+        self.assertEqual([NORMAL_DISPLAY, NORMAL_DISPLAY], self.display_modes([0, 100]))
+
+    def test_backlog_warning_is_rate_limited(self):
+        scheduler = self.connection.msg_q
+        scheduler.lanes[CHAT_LANE].depth = 20
+        with mock.patch.object(irc_mo, 'Logger') as logger, mock.patch.object(irc_mo.time, 'monotonic') as now:
+            now.return_value = 100.0
+            scheduler.age = 1.0
+            self.manager.check_backlog()
+            self.assertEqual((20, 1.0), self.manager.get_backlog())
+            scheduler.age = 3.0
+            self.manager.check_backlog()
+            now.return_value = 105.0
+            self.manager.check_backlog()
+            now.return_value = 111.0
+            self.manager.check_backlog()
+        self.assertEqual(2, logger.warning.call_count)
+        self.assertIn("20 messages waiting", logger.warning.call_args[0][0])
+
+
+class PresenceEntryTests(ConnectionManagerTestCase):
+
+    def set_user(self, char, sprite_name):
+        def get_current_sprite():
+            raise AssertionError("the sprite's page shouldn't be decoded for its name")
+        user = SimpleNamespace(username="Alice", get_char=lambda: char, get_current_sprite=get_current_sprite,
+                               get_current_sprite_source=lambda: (char, sprite_name),
+                               get_pos=lambda: "left", get_dance=lambda: False)
+        user_handler = SimpleNamespace(get_user=lambda: user, get_current_loc=lambda: SimpleNamespace(name="Hall"),
+                                       get_current_subloc_name=lambda: "Stairs",
+                                       get_current_sprite_option=lambda: 0)
+        self.app.get_user_handler = lambda: user_handler
+
+    def test_own_entry(self):
+        self.set_user(SimpleNamespace(name="Kyoko", link="link", version="1.0"), "3")
+        self.assertEqual(("Alice", "Hall", "Stairs", "left", "Kyoko", "3", "0", "False", "link", "1.0",
+                          str(PROTOCOL_VERSION)), self.manager.get_own_presence_entry())
+
+    def test_own_entry_before_picking_a_character(self):
+        self.set_user(None, None)
+        self.assertEqual(("Alice", "Hall", "Stairs", "left", "", "", "0", "False", "", "", str(PROTOCOL_VERSION)),
+                         self.manager.get_own_presence_entry())
+
+
+if __name__ == '__main__':
+    unittest.main()
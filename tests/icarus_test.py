@@ -1,11 +1,15 @@
+from MysteryOnline import icarus, async_image
 from MysteryOnline.icarus import Icarus
+from MysteryOnline.sprite import NullSprite
 from kivy.app import App
 from kivy.uix.button import Button
 from kivy.clock import Clock
 import json
 import os
 import random
+import tempfile
 import unittest
+from unittest import mock
 
 
 PATH_PREFIX = "characters/"
@@ -120,5 +124,155 @@ class IcarusTests(unittest.TestCase):
         return meta, subs
 
 
+class FakeTexture:
+    width = 10
+    height = 10
+
+    def get_region(self, x, y, w, h):
+        return x, y, w, h
+
+
+class FakeImage:
+    decoded = []
+
+    def __init__(self, filename):
+        FakeImage.decoded.append(os.path.basename(filename))
+        self.texture = FakeTexture()
+
+
+class FakeProxy:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.loaded = False
+        self.image = None
+        self.handlers = {}
+
+    def bind(self, **handlers):
+        self.handlers.update(handlers)
+
+    def finish(self):
+        self.image = FakeImage(self.filename)
+        self.loaded = True
+        self.handlers['on_load'](self)
+
+    def fail(self):
+        self.image = FakeLoader.error_image
+        self.loaded = True
+        self.handlers['on_load'](self)
+
+
+class FakeLoader:
+    requested = []
+    error_image = object()
+
+    @staticmethod
+    def image(filename, load_callback=None):
+        proxy = FakeProxy(filename)
+        FakeLoader.requested.append(proxy)
+        return proxy
+
+    @staticmethod
+    def remove_from_cache(filename):
+        pass
+
+
+class IcarusPageCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "sprites.atlas")
+        with open(self.path, 'w') as fd:
+            json.dump({"sprites-0.png": {"1": [0, 0, 10, 10], "2": [10, 0, 10, 10]},
+                       "sprites-1.png": {"3": [0, 0, 10, 10]},
+                       "sprites-2.png": {"4": [0, 0, 10, 10]}}, fd)
+        for page in ("sprites-0.png", "sprites-1.png"):
+            open(os.path.join(self.directory.name, page), 'w').close()
+        self.previous_image = icarus.CoreImage
+        self.previous_loader = async_image.Loader
+        icarus.CoreImage = FakeImage
+        async_image.Loader = FakeLoader
+        FakeImage.decoded = []
+        FakeLoader.requested = []
+
+    def tearDown(self):
+        icarus.CoreImage = self.previous_image
+        async_image.Loader = self.previous_loader
+        self.directory.cleanup()
+
+    def test_index(self):
+        sprites = Icarus(self.path)
+        self.assertEqual(("sprites-1.png", (0, 0, 10, 10)), sprites.load_index()["3"])
+        self.assertEqual(4, len(sprites.index))
+
+    def test_pages_stay_decoded(self):
+        sprites = Icarus(self.path)
+        self.assertEqual((10, 0, 10, 10), sprites["2"].texture)
+        sprites["3"]
+        sprites["1"]
+        sprites["3"]
+        self.assertEqual(["sprites-0.png", "sprites-1.png"], FakeImage.decoded)
+
+    def test_least_recently_used_page_is_evicted(self):
+        sprites = Icarus(self.path, max_pages=2)
+        sprites["1"]
+        sprites["3"]
+        sprites["1"]
+        sprites["4"]
+        self.assertNotIn("3", sprites)
+        self.assertIn("2", sprites)
+        sprites["3"]
+        self.assertEqual(["sprites-0.png", "sprites-1.png", "sprites-2.png", "sprites-1.png"], FakeImage.decoded)
+
+    def test_load_async(self):
+        sprites = Icarus(self.path)
+        ready = []
+        sprites.load_async("1", lambda: ready.append("1"))
+        sprites.load_async("2", lambda: ready.append("2"))
+        self.assertFalse(sprites.is_loaded("1"))
+        self.assertEqual(1, len(FakeLoader.requested))
+        FakeLoader.requested[0].finish()
+        self.assertEqual(["1", "2"], ready)
+        self.assertTrue(sprites.is_loaded("2"))
+        sprites.load_async("2", lambda: ready.append("again"))
+        self.assertEqual(["1", "2", "again"], ready)
+        self.assertEqual(1, len(FakeLoader.requested))
+        self.assertEqual((10, 0, 10, 10), sprites["2"].texture)
+        self.assertEqual(["sprites-0.png"], FakeImage.decoded)
+
+    def test_load_async_failures(self):
+        sprites = Icarus(self.path)
+        ready = []
+        sprites.load_async("1", lambda: ready.append("1"))
+        FakeLoader.requested[0].fail()
+        sprites.load_async("4", lambda: ready.append("4"))
+        self.assertEqual(["1", "4"], ready)
+        self.assertEqual(1, len(FakeLoader.requested))
+        self.assertEqual({}, sprites.pending)
+        self.assertIsInstance(sprites["2"], NullSprite)
+        self.assertIsInstance(sprites["4"], NullSprite)
+
+    def test_load_async_timeout_is_retried(self):
+        sprites = Icarus(self.path)
+        ready = []
+        with mock.patch.object(async_image, 'Clock') as clock:
+            sprites.load_async("1", lambda: ready.append("1"))
+            on_watchdog = clock.schedule_once.call_args[0][0]
+            on_watchdog(0)
+            self.assertEqual(set(), sprites.failed)
+            self.assertFalse(sprites.is_loaded("1"))
+            sprites.load_async("2", lambda: ready.append("2"))
+        self.assertEqual(2, len(FakeLoader.requested))
+        FakeLoader.requested[0].finish()
+        FakeLoader.requested[1].finish()
+        self.assertEqual(["2"], ready)
+        self.assertTrue(sprites.is_loaded("1"))
+
+    def test_missing_sprite_and_atlas(self):
+        self.assertIsInstance(Icarus(self.path)["missing"], NullSprite)
+        self.assertIsInstance(Icarus(os.path.join(self.directory.name, "none.atlas"))["1"], NullSprite)
+        self.assertEqual([], FakeImage.decoded)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,156 @@
+import socket
+import time
+import unittest
+from MysteryOnline.irc_mo import IrcConnection, MessageFactory
+from MysteryOnline.irc_server import LocalIrcServer
+
+
+class RawClient:
+
+    def __init__(self, address, nick):
+        self.sock = socket.create_connection(address, timeout=5)
+        self.buffer = b""
+        self.nick = nick
+        self.send("NICK {}".format(nick))
+        self.send("USER {} 0 * :{}".format(nick, nick))
+        self.expect(" 001 ")
+
+    def send(self, line):
+        self.sock.sendall((line + "\r\n").encode('utf-8'))
+
+    def read_line(self):
+        while b"\r\n" not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("closed")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\r\n", 1)
+        return line.decode('utf-8')
+
+    def expect(self, text):
+        while True:
+            line = self.read_line()
+            if text in line:
+                return line
+
+    def close(self):
+        self.sock.close()
+
+
+class LocalIrcServerTests(unittest.TestCase):
+
+    def start_server(self, **kwargs):
+        server = LocalIrcServer(**kwargs)
+        self.address = server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def connect(self, nick):
+        client = RawClient(self.address, nick)
+        self.addCleanup(client.close)
+        return client
+
+    def test_channel_messages(self):
+        self.start_server()
+        alice = self.connect("Alice")
+        alice.send("JOIN #mo")
+        alice.expect(" 366 ")
+        bob = self.connect("Bob")
+        bob.send("JOIN #mo")
+        self.assertIn("@Alice Bob", bob.expect(" 353 "))
+        alice.expect(":Bob!Bob@localhost JOIN #mo")
+        bob.send("PRIVMSG #mo :hello")
+        self.assertEqual(":Bob!Bob@localhost PRIVMSG #mo :hello", alice.expect("PRIVMSG"))
+        alice.send("PRIVMSG Bob :\x01MOHELLO 4\x01")
+        self.assertIn("MOHELLO 4", bob.expect("PRIVMSG"))
+        bob.send("QUIT :bye")
+        self.assertEqual(":Bob!Bob@localhost QUIT :bye", alice.expect("QUIT"))
+
+    def test_ping_and_nick_in_use(self):
+        self.start_server()
+        alice = self.connect("Alice")
+        alice.send("PING :token")
+        self.assertTrue(alice.expect("PONG").endswith(":token"))
+        other = RawClient.__new__(RawClient)
+        other.sock = socket.create_connection(self.address, timeout=5)
+        other.buffer = b""
+        self.addCleanup(other.close)
+        other.send("NICK Alice")
+        other.expect(" 433 ")
+
+    def test_drop_rate(self):
+        server = self.start_server(drop_rate=1.0)
+        alice = self.connect("Alice")
+        bob = self.connect("Bob")
+        alice.send("PRIVMSG Bob :lost")
+        alice.send("PING :sync")
+        alice.expect("PONG")
+        self.assertEqual(1, server.dropped)
+
+    def test_latency(self):
+        self.start_server(latency=0.2)
+        alice = self.connect("Alice")
+        bob = self.connect("Bob")
+        start = time.monotonic()
+        alice.send("PRIVMSG Bob :late")
+        bob.expect("PRIVMSG")
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_jitter_keeps_order(self):
+        self.start_server(latency=0.01, jitter=0.05, seed=1)
+        alice = self.connect("Alice")
+        bob = self.connect("Bob")
+        for i in range(20):
+            alice.send("PRIVMSG Bob :{}".format(i))
+        self.assertEqual([str(i) for i in range(20)], [bob.expect("PRIVMSG").rsplit(':', 1)[1] for _ in range(20)])
+
+    def test_port_in_use(self):
+        server = self.start_server()
+        with self.assertRaises(OSError):
+            LocalIrcServer(port=server.port).start()
+
+    def test_excess_flood(self):
+        self.start_server(flood_burst=3, flood_interval=10)
+        alice = self.connect("Alice")
+        for i in range(3):
+            alice.send("PING :{}".format(i))
+        self.assertIn("Excess Flood", alice.expect("ERROR"))
+
+
+class IrcConnectionTests(unittest.TestCase):
+
+    def setUp(self):
+        server = LocalIrcServer()
+        self.host, self.port = server.start()
+        self.addCleanup(server.stop)
+
+    def connect(self, username):
+        connection = IrcConnection(self.host, self.port, "#mo", username, message_factory=MessageFactory())
+        self.addCleanup(connection.connection.disconnect)
+        connection.joined_users = []
+        connection.on_join_handler = connection.joined_users.append
+        connection.on_users_handler = lambda users: None
+        connection.on_disconnect_handler = lambda nick: None
+        return connection
+
+    def process_until(self, condition, *connections):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            for connection in connections:
+                connection.reactor.process_once(0.01)
+
+    def test_chat_between_clients(self):
+        alice = self.connect("Alice")
+        self.process_until(alice.is_connected, alice)
+        bob = self.connect("Bob")
+        self.process_until(lambda: bob.is_connected() and alice.joined_users == ["Bob"], alice, bob)
+        msg = bob.message_factory.build_ooc_message("hello")
+        bob.send_msg(msg.to_irc())
+        self.process_until(lambda: not alice.inbox.empty(), alice, bob)
+        received = alice.inbox.get()[0]
+        self.assertEqual(("Bob", "hello"), (received.sender, received.content))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from MysteryOnline import load_generator
+from MysteryOnline.load_generator import LoadScript, CHAT, NULLPOST, MOVE, OOC, PM, load_characters
+from MysteryOnline.manifest import Manifest
+from MysteryOnline.protocol import MessageFactory
+
+CHARACTERS = {"Kyoko": ["1", "2", "3"], "Hajime": ["1"], "Empty": []}
+LOCATIONS = {"Hall": ["Stairs", "Door"], "Garden": ["Pond"]}
+
+
+class LoadScriptTests(unittest.TestCase):
+
+    def setUp(self):
+        self.script = LoadScript(CHARACTERS, LOCATIONS, chat_rate=10, nullpost_rate=5, move_rate=1, ooc_rate=2,
+                                 pm_rate=1, seed=3)
+
+    def test_spawn_announces_users(self):
+        spawned = self.script.spawn(["Alice", "Bob"])
+        self.assertEqual(["Alice", "Bob"], [user.username for user, message in spawned])
+        for user, frame in spawned:
+            self.assertIn(user.character, ("Kyoko", "Hajime"))
+            self.assertEqual({user.username}, {msg.sender for msg in frame.messages} | {frame.sender})
+
+    def test_rates(self):
+        self.script.spawn(["Alice", "Bob", "Carol"])
+        actions = []
+        for _ in range(4):
+            actions.extend(self.script.tick(0.25))
+        kinds = [action[0] for action in actions]
+        self.assertEqual((10, 5, 1, 2, 1), tuple(kinds.count(kind) for kind in (CHAT, NULLPOST, MOVE, OOC, PM)))
+
+    def test_messages_decode(self):
+        self.script.spawn(["Alice", "Bob"])
+        factory = MessageFactory()
+        for kind, user, message, target in self.script.tick(1.0):
+            if kind == PM:
+                self.assertIn(target, ("Alice", "Bob"))
+                continue
+            decoded = factory.build_from_irc(message.to_irc(), user.username)
+            self.assertEqual(user.username, decoded.sender)
+
+    def test_messages_come_from_their_user(self):
+        self.script.spawn(["Alice", "Bob"])
+        for kind, user, message, target in self.script.tick(1.0):
+            if kind != PM:
+                self.assertEqual(user.username, message.sender)
+
+    def test_no_users_no_actions(self):
+        self.assertEqual([], self.script.tick(10.0))
+
+
+class LoadCharactersTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        manifest = Manifest(os.path.join(self.directory.name, "manifest.json"))
+        patch = mock.patch.object(load_generator, 'asset_manifest', manifest)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.characters = os.path.join(self.directory.name, "characters")
+
+    def add_character(self, name, icons):
+        directory = os.path.join(self.characters, name)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "settings.ini"), 'w') as settings:
+            settings.write("[character]\nname = {}\nseries = OC\n".format(name))
+            settings.write("sprites = sprites.atlas\nicons = {}\n".format(icons))
+        with open(os.path.join(directory, icons), 'w') as atlas:
+            json.dump({"icons-0.png": {"2": [0, 0, 1, 1], "1": [1, 0, 1, 1]}}, atlas)
+
+    def test_atlas_named_by_settings(self):
+        self.add_character("Kyoko", "kyoko_icons.atlas")
+        self.add_character("Hajime", "icons.atlas")
+        os.makedirs(os.path.join(self.characters, "Broken"))
+        self.assertEqual({"Kyoko": ["1", "2"], "Hajime": ["1", "2"]}, load_characters(self.characters))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+from MysteryOnline.manifest import Manifest, CHARACTERS, LOCATIONS, get_mtimes
+from MysteryOnline.location import Location
+
+
+class ManifestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pack = os.path.join(self.directory.name, "Kyoko")
+        os.mkdir(self.pack)
+        self.settings = os.path.join(self.pack, "settings.ini")
+        self.write(self.settings, "[character]\n")
+        self.manifest = Manifest(os.path.join(self.directory.name, "manifest.json"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def write(path, content):
+        with open(path, 'w') as file:
+            file.write(content)
+
+    def test_unchanged_directory_is_cached(self):
+        self.assertIsNone(self.manifest.get(CHARACTERS, "Kyoko", self.pack))
+        self.manifest.put(CHARACTERS, "Kyoko", self.pack, ["settings.ini"], {"name": "Kyoko"})
+        self.assertEqual({"name": "Kyoko"}, self.manifest.get(CHARACTERS, "Kyoko", self.pack))
+        self.assertEqual((1, 1), (self.manifest.hits, self.manifest.misses))
+
+    def test_changed_file_is_rebuilt(self):
+        self.manifest.put(CHARACTERS, "Kyoko", self.pack, ["settings.ini"], {"name": "Kyoko"})
+        mtime = os.stat(self.settings).st_mtime_ns
+        os.utime(self.settings, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+        self.assertIsNone(self.manifest.get(CHARACTERS, "Kyoko", self.pack))
+
+    def test_missing_files(self):
+        self.assertIsNone(get_mtimes(self.pack, ["sprites.atlas"])["sprites.atlas"])
+
+    def test_save_load_and_prune(self):
+        self.manifest.put(CHARACTERS, "Kyoko", self.pack, ["settings.ini"], {"name": "Kyoko"})
+        self.manifest.put(CHARACTERS, "Gone", self.pack, [], {})
+        self.manifest.prune(CHARACTERS, ["Kyoko"])
+        self.manifest.save()
+        self.assertFalse(self.manifest.dirty)
+        reloaded = Manifest(self.manifest.path)
+        reloaded.ensure_loaded()
+        self.assertEqual({"name": "Kyoko"}, reloaded.get(CHARACTERS, "Kyoko", self.pack))
+        self.assertIsNone(reloaded.get(CHARACTERS, "Gone", self.pack))
+
+    def test_corrupt_manifest_is_ignored(self):
+        self.write(self.manifest.path, "{not json")
+        self.manifest.load()
+        self.assertEqual({}, self.manifest.sections[LOCATIONS])
+
+
+class LocationLayoutTests(unittest.TestCase):
+
+    def test_layout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for file in ("Hall.jpg", "Hall_foreground.png", "Stairs.png"):
+                open(os.path.join(directory, file), 'w').close()
+            location = Location(os.path.basename(directory), os.path.dirname(directory))
+            layout = location.read_layout()
+            self.assertEqual({"Hall": ["Hall.jpg", "Hall_foreground.png"], "Stairs": ["Stairs.png", None]}, layout)
+            location.load_layout(layout)
+            self.assertEqual(location.path + "Hall_foreground.png", location.get_sub("Hall").foreground_path)
+            self.assertFalse(location.get_sub("Stairs").has_foreground())
+
+
+if __name__ == '__main__':
+    unittest.main()
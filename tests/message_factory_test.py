@@ -0,0 +1,200 @@
+import unittest
+import os
+from MysteryOnline.protocol import MessageTooLong, MessageFactory, ChatMessage, IconMessage, ItemMessage, FragmentBuffer, \
+    FrameMessage, LocationMessage, CharacterMessage, OOCMessage, ChoiceReturnMessage, IncorrectMessageTypeError, DELTA_KEYFRAME_INTERVAL, MAX_LINE_BYTES, MAX_MESSAGE_LENGTH, FRAGMENT_PREFIX
+
+
+def build_chat(content, sprite="1", sfx_name=None):
+    return ChatMessage("default", content=content, location="Hall", sublocation="Stairs", character="Kyoko",
+                       sprite=sprite, position="left", color_id=0, sprite_option=0, sfx_name=sfx_name)
+
+
+class DeltaEncodingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = MessageFactory()
+        self.receiver = MessageFactory()
+
+    def transmit(self, msg):
+        return self.receiver.build_from_irc(self.sender.encode(msg, delta=True), "Alice")
+
+    def test_first_message_is_keyframe(self):
+        msg = build_chat("Hello")
+        self.assertEqual(msg.to_irc(), self.sender.encode(msg, delta=True))
+
+    def test_delta_carries_only_changes(self):
+        self.transmit(build_chat("Hello"))
+        line = self.sender.encode(build_chat("Hi # there", sprite="2"), delta=True)
+        self.assertEqual("cd#8#2#Hi # there", line)
+        received = self.receiver.build_from_irc(line, "Alice")
+        self.assertEqual("2", received.sprite)
+        self.assertEqual("Hall", received.location)
+        self.assertEqual("Hi # there", received.content)
+        self.assertIsNone(received.sfx_name)
+
+    def test_keyframe_interval(self):
+        lines = [self.sender.encode(build_chat(str(i)), delta=True) for i in range(DELTA_KEYFRAME_INTERVAL + 1)]
+        self.assertFalse(lines[0].startswith("cd#"))
+        self.assertTrue(all(line.startswith("cd#") for line in lines[1:-1]))
+        self.assertFalse(lines[-1].startswith("cd#"))
+
+    def test_legacy_when_delta_not_allowed(self):
+        self.sender.encode(build_chat("Hello"), delta=True)
+        msg = build_chat("Again")
+        self.assertEqual(msg.to_irc(), self.sender.encode(msg, delta=False))
+
+    def test_icon_delta(self):
+        icon = dict(location="Hall", sublocation="Stairs", character="Kyoko", sprite="1", position="left",
+                    sprite_option=0, dance=False)
+        self.transmit(IconMessage("default", **icon))
+        icon['dance'] = True
+        line = self.sender.encode(IconMessage("default", **icon), delta=True)
+        self.assertEqual("sd#40#True", line)
+        self.assertEqual("True", self.receiver.build_from_irc(line, "Alice").dance)
+        self.assertEqual("sd#0", self.sender.encode(IconMessage("default", **icon), delta=True))
+
+    def test_delta_without_keyframe(self):
+        with self.assertRaises(IncorrectMessageTypeError):
+            self.receiver.build_from_irc("cd#0#Hello", "Alice")
+        self.transmit(build_chat("Hello"))
+        self.receiver.forget_sender("Alice")
+        with self.assertRaises(IncorrectMessageTypeError):
+            self.receiver.build_from_irc("cd#0#Hello", "Alice")
+
+    def test_reset_sent_states_forces_keyframe(self):
+        self.sender.encode(build_chat("Hello"), delta=True)
+        self.sender.reset_sent_states()
+        msg = build_chat("Again")
+        self.assertEqual(msg.to_irc(), self.sender.encode(msg, delta=True))
+
+    def test_legacy_chat_still_parses(self):
+        msg = self.receiver.build_from_irc("Hall#Stairs#Kyoko#1#left#0#0#0#Hello", "Alice")
+        self.assertIsInstance(msg, ChatMessage)
+        self.assertEqual("Hello", msg.content)
+
+
+class FragmentationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = MessageFactory()
+        self.receiver = MessageFactory()
+
+    def test_short_line_is_not_split(self):
+        self.assertEqual(["OOC#hi"], self.sender.fragment("OOC#hi"))
+
+    def test_long_item_round_trip(self):
+        item = ItemMessage("default", "Knife#" + "é" * 600 + "#link#Alice")
+        lines = self.sender.fragment(item.to_irc())
+        self.assertGreater(len(lines), 1)
+        self.assertTrue(all(len(line.encode('utf-8')) <= MAX_LINE_BYTES for line in lines))
+        results = [self.receiver.build_from_irc(line, "Alice") for line in reversed(lines)]
+        self.assertTrue(all(result is None for result in results[:-1]))
+        self.assertIsInstance(results[-1], ItemMessage)
+        self.assertEqual(item.item, results[-1].item)
+        self.assertEqual(0, self.receiver.fragments.get_size())
+
+    def test_max_message_length_fits(self):
+        self.assertGreater(len(self.sender.fragment("x" * MAX_MESSAGE_LENGTH * 4)), 1)
+        with self.assertRaises(MessageTooLong):
+            self.sender.fragment("x" * MAX_LINE_BYTES * 20)
+
+    def test_memory_limit_drops_oldest(self):
+        buffer = FragmentBuffer(memory_limit=10)
+        self.assertIsNone(buffer.add("Alice", "f#1#0#2#" + "a" * 8))
+        self.assertIsNone(buffer.add("Alice", "f#2#0#2#" + "b" * 8))
+        self.assertEqual([("Alice", "2")], list(buffer.pending))
+        self.assertIsNone(buffer.add("Alice", "f#1#1#2#a"))
+
+    def test_timeout(self):
+        buffer = FragmentBuffer(timeout=0)
+        buffer.add("Alice", "f#1#0#2#a")
+        self.assertIsNone(buffer.add("Alice", "f#1#1#2#b"))
+
+    def test_malformed_fragment(self):
+        with self.assertRaises(IncorrectMessageTypeError):
+            self.receiver.reassemble(FRAGMENT_PREFIX + "1#5#2#a", "Alice")
+
+    def test_plain_line_is_not_a_fragment(self):
+        self.assertEqual("f#1#0#2#hello", self.receiver.reassemble("f#1#0#2#hello", "Alice"))
+        self.assertEqual(0, self.receiver.fragments.get_size())
+
+
+class FrameMessageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = MessageFactory()
+        self.receiver = MessageFactory()
+
+    def test_round_trip(self):
+        icon = IconMessage("default", location="Hall", sublocation="Stairs", character="Kyoko", sprite="1",
+                           position="left", sprite_option=0, dance=False)
+        frame = self.sender.build_frame_message([LocationMessage("default", "Hall"),
+                                                 CharacterMessage("default", "Kyoko", "", "1.0"), icon])
+        received = self.receiver.build_from_irc(self.sender.encode(frame, delta=True), "Alice")
+        self.assertIsInstance(received, FrameMessage)
+        self.assertEqual([LocationMessage, CharacterMessage, IconMessage], [type(msg) for msg in received.messages])
+        self.assertEqual("Kyoko", received.messages[2].character)
+        self.assertTrue(all(msg.sender == "Alice" for msg in received.messages))
+
+    def test_pack_keeps_separators(self):
+        lines = ["12:#ab", "", "c#d"]
+        self.assertEqual(lines, FrameMessage.unpack(FrameMessage.pack(lines)))
+
+    def test_malformed_frames(self):
+        for line in ("fr#5:abc", "fr#x:abc", "fr#abc", FrameMessage.pack([FrameMessage.pack(["l#Hall"])])):
+            with self.assertRaises(IncorrectMessageTypeError):
+                self.receiver.build_from_irc(line, "Alice")
+
+
+class DecoderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = MessageFactory()
+        self.strict_factory = MessageFactory(strict=True)
+
+    def test_prefix_wins_over_hash_count(self):
+        msg = self.factory.build_from_irc("OOC#a#b#c#d#e#f#g#h", "Alice")
+        self.assertIsInstance(msg, OOCMessage)
+        self.assertEqual("a#b#c#d#e#f#g#h", msg.content)
+
+    def test_last_field_keeps_separators(self):
+        msg = self.factory.build_from_irc("ch2#Kaito#False#A#B", "Alice")
+        self.assertIsInstance(msg, ChoiceReturnMessage)
+        self.assertEqual("A#B", msg.selected_option)
+
+    def test_unknown_line(self):
+        msg = self.factory.build_from_irc("hello there", "Alice")
+        self.assertIsInstance(msg, OOCMessage)
+        self.assertEqual("hello there", msg.content)
+        with self.assertRaises(IncorrectMessageTypeError):
+            self.strict_factory.build_from_irc("hello there", "Alice")
+
+    def test_legacy_formats(self):
+        icon = self.factory.build_from_irc("sc#Hall#Stairs#Kyoko#3#center#0", "Alice")
+        self.assertFalse(icon.dance)
+        self.assertEqual("", self.factory.build_from_irc("c#Kyoko", "Alice").version)
+        for line in ("sc#Hall#Stairs#Kyoko#3#center#0", "c#Kyoko"):
+            with self.assertRaises(IncorrectMessageTypeError):
+                self.strict_factory.build_from_irc(line, "Alice")
+
+    def test_malformed_lines_are_rejected(self):
+        for line in ("ch2#Kaito", "LOOC#Hall", "sc#Hall"):
+            with self.assertRaises(IncorrectMessageTypeError):
+                self.factory.build_from_irc(line, "Alice")
+
+    def test_corpus(self):
+        corpus_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'channel_corpus.txt')
+        with open(corpus_path, encoding='utf-8') as corpus:
+            lines = [line.rstrip('\n').split('\t', 1) for line in corpus]
+        rejected = 0
+        for username, line in lines:
+            self.factory.build_from_irc(line, username)
+            try:
+                self.strict_factory.build_from_irc(line, username)
+            except IncorrectMessageTypeError:
+                rejected += 1
+        self.assertEqual(2, rejected)
+
+
+if __name__ == '__main__':
+    unittest.main()
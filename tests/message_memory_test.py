@@ -0,0 +1,62 @@
+import tracemalloc
+import unittest
+from MysteryOnline.irc_mo import MessageScheduler
+from MysteryOnline.protocol import ChatMessage, IconMessage, MessageFactory, CHAT_LANE
+
+FIELDS = dict(location="Hall", sublocation="Stairs", character="Kyoko", sprite="1", position="left", color_id="0",
+              sprite_option="0", sfx_name=None, content="Hello")
+
+
+class DictChatMessage:
+    """The layout chat messages used to have: a kwargs dict kept next to a copy of every field."""
+    lane = CHAT_LANE
+
+    def __init__(self, sender, **kwargs):
+        self.components = kwargs
+        self.sender = sender
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+
+def measure(build, count=2000):
+    """Returns the bytes allocated per message kept alive by build."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        messages = [build() for _ in range(count)]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del messages
+    return allocated / count
+
+
+class MessageMemoryTests(unittest.TestCase):
+
+    def test_messages_have_no_instance_dict(self):
+        for msg in (ChatMessage("Alice", **FIELDS), IconMessage("Alice", location="Hall")):
+            self.assertFalse(hasattr(msg, '__dict__'))
+
+    def test_slotted_messages_allocate_less(self):
+        slotted = measure(lambda: ChatMessage("Alice", **FIELDS))
+        with_dict = measure(lambda: DictChatMessage("Alice", **FIELDS))
+        self.assertLess(slotted, with_dict / 2)
+
+    def test_decoded_backlog(self):
+        factory = MessageFactory()
+        scheduler = MessageScheduler()
+        line = ChatMessage("default", **FIELDS).to_irc()
+        names = ChatMessage.field_names
+
+        def decode_and_queue():
+            scheduler.enqueue(factory.build_from_irc(line, "Alice"))
+
+        def split_and_queue():
+            scheduler.enqueue(DictChatMessage("Alice", **dict(zip(names, line.split('#', len(names) - 1)))))
+
+        self.assertLess(measure(decode_and_queue, 1000), measure(split_and_queue, 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
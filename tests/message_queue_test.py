@@ -0,0 +1,173 @@
+import unittest
+from MysteryOnline.irc_mo import MessageQueue, MessageScheduler, OutgoingQueue, STATE_LANE, OOC_LANE, CHAT_LANE, \
+    IconMessage, OOCMessage, ChatMessage
+
+
+class MockMessage:
+
+    def __init__(self, lane):
+        self.lane = lane
+
+
+class MessageQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.msg_q = MessageQueue()
+
+    def test_first_in_first_out(self):
+        for i in range(3):
+            self.msg_q.enqueue(i)
+        self.assertEqual(3, self.msg_q.size())
+        self.assertEqual([0, 1, 2], [self.msg_q.dequeue() for _ in range(3)])
+        self.assertTrue(self.msg_q.is_empty())
+
+    def test_dequeue_empty(self):
+        self.assertIsNone(self.msg_q.dequeue())
+        self.assertIsNone(self.msg_q.peek())
+        self.assertEqual(0.0, self.msg_q.oldest_age())
+
+    def test_put_back_goes_to_head(self):
+        self.msg_q.enqueue("first")
+        self.msg_q.enqueue("second")
+        msg = self.msg_q.dequeue()
+        self.msg_q.put_back(msg)
+        self.assertIs(msg, self.msg_q.peek())
+        self.assertEqual("first", self.msg_q.dequeue())
+
+    def test_put_back_keeps_enqueue_time(self):
+        self.msg_q.enqueue("first")
+        enqueue_time = self.msg_q.messages[0][0]
+        self.msg_q.put_back(self.msg_q.dequeue())
+        self.assertEqual(enqueue_time, self.msg_q.messages[0][0])
+
+    def test_oldest_age(self):
+        self.msg_q.enqueue("first")
+        self.assertGreaterEqual(self.msg_q.oldest_age(), 0.0)
+
+    def test_enqueue_time_is_kept(self):
+        self.msg_q.enqueue("first", 12.5)
+        self.msg_q.dequeue()
+        self.assertEqual(12.5, self.msg_q.last_enqueue_time)
+
+
+class MessageSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = MessageScheduler()
+
+    def test_state_lane_drained_first(self):
+        chat = MockMessage(CHAT_LANE)
+        ooc = MockMessage(OOC_LANE)
+        state = MockMessage(STATE_LANE)
+        for msg in (chat, ooc, state):
+            self.scheduler.enqueue(msg)
+        self.assertEqual([state, ooc, chat], [self.scheduler.dequeue() for _ in range(3)])
+
+    def test_held_chat_does_not_block_state(self):
+        chat = MockMessage(CHAT_LANE)
+        state = MockMessage(STATE_LANE)
+        self.scheduler.enqueue(chat)
+        self.scheduler.put_back(self.scheduler.dequeue())
+        self.scheduler.enqueue(state)
+        self.assertTrue(self.scheduler.has_ready())
+        self.assertIs(state, self.scheduler.dequeue())
+        self.assertFalse(self.scheduler.has_ready())
+        self.assertIsNone(self.scheduler.dequeue())
+        self.assertEqual(1, self.scheduler.size())
+
+    def test_wake_chat(self):
+        chat = MockMessage(CHAT_LANE)
+        self.scheduler.enqueue(chat)
+        self.scheduler.hold_chat()
+        self.assertIsNone(self.scheduler.dequeue())
+        self.scheduler.wake_chat()
+        self.assertIs(chat, self.scheduler.dequeue())
+        self.assertTrue(self.scheduler.is_empty())
+
+    def test_chat_behind_newer_state_is_superseded(self):
+        old_chat = ChatMessage("Alice", content="hi", sprite="1")
+        icon = IconMessage("Alice", sprite="2")
+        new_chat = ChatMessage("Alice", content="there", sprite="2")
+        other_chat = ChatMessage("Bob", content="hey")
+        for msg in (old_chat, icon, new_chat, other_chat):
+            self.scheduler.enqueue(msg)
+        self.assertIs(icon, self.scheduler.dequeue())
+        self.assertIs(old_chat, self.scheduler.dequeue())
+        self.assertTrue(self.scheduler.is_superseded(old_chat))
+        self.scheduler.put_back(old_chat)
+        self.scheduler.wake_chat()
+        self.assertIs(old_chat, self.scheduler.dequeue())
+        self.assertTrue(self.scheduler.is_superseded(old_chat))
+        self.assertIs(new_chat, self.scheduler.dequeue())
+        self.assertFalse(self.scheduler.is_superseded(new_chat))
+        self.assertIs(other_chat, self.scheduler.dequeue())
+        self.assertFalse(self.scheduler.is_superseded(other_chat))
+
+
+class OutgoingQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.outgoing = OutgoingQueue(burst=2, interval=60, max_size=3)
+
+    def test_burst_then_wait(self):
+        for i in range(3):
+            self.outgoing.enqueue(OOCMessage("default", str(i)))
+        self.assertIsNotNone(self.outgoing.dequeue())
+        self.assertIsNotNone(self.outgoing.dequeue())
+        self.assertIsNone(self.outgoing.dequeue())
+        self.assertGreater(self.outgoing.time_until_ready(), 0)
+        self.assertEqual(1, self.outgoing.size())
+
+    def test_latest_icon_wins(self):
+        self.outgoing.enqueue(IconMessage("default", sprite="1"))
+        self.outgoing.enqueue(OOCMessage("default", "hi"))
+        self.outgoing.enqueue(IconMessage("default", sprite="2"))
+        self.assertEqual(2, self.outgoing.size())
+        msg, args = self.outgoing.dequeue()
+        self.assertEqual("hi", msg.content)
+        msg, args = self.outgoing.dequeue()
+        self.assertEqual("2", msg.sprite)
+        self.assertEqual(1, self.outgoing.get_metrics()['coalesced'])
+
+    def test_coalesced_icon_goes_behind_later_chat(self):
+        self.outgoing.enqueue(IconMessage("default", sprite="1"))
+        self.outgoing.enqueue(ChatMessage("default", content="hi", sprite="1"))
+        self.outgoing.enqueue(IconMessage("default", sprite="2"))
+        self.assertEqual([ChatMessage, IconMessage], [type(msg) for msg, args, time in self.outgoing.messages])
+
+    def test_full_queue_drops_oldest(self):
+        for i in range(4):
+            self.outgoing.enqueue(OOCMessage("default", str(i)))
+        metrics = self.outgoing.get_metrics()
+        self.assertEqual(4, metrics['queued'])
+        self.assertEqual(1, metrics['dropped'])
+        msg, args = self.outgoing.dequeue()
+        self.assertEqual("1", msg.content)
+
+    def test_full_queue_keeps_chat(self):
+        self.outgoing.enqueue(ChatMessage("default", content="hi"))
+        self.outgoing.enqueue(ChatMessage("default", content="there"))
+        self.outgoing.enqueue(OOCMessage("default", "ooc"))
+        self.outgoing.enqueue(OOCMessage("default", "later"))
+        self.assertEqual(["hi", "there", "later"], [msg.content for msg, args, time in self.outgoing.messages])
+        self.outgoing.enqueue(ChatMessage("default", content="again"))
+        self.outgoing.enqueue(ChatMessage("default", content="more"))
+        self.assertEqual(["hi", "there", "again", "more"], [msg.content for msg, args, time in self.outgoing.messages])
+        self.assertEqual(2, self.outgoing.get_metrics()['dropped'])
+
+    def test_coalesced_message_keeps_its_place_in_time(self):
+        self.outgoing.enqueue(IconMessage("default", sprite="1"))
+        enqueue_time = self.outgoing.messages[0][2]
+        self.outgoing.enqueue(IconMessage("default", sprite="2"))
+        self.outgoing.dequeue()
+        self.assertEqual(enqueue_time, self.outgoing.last_enqueue_time)
+
+    def test_put_back_returns_token(self):
+        self.outgoing.enqueue(OOCMessage("default", "hi"))
+        msg, args = self.outgoing.dequeue()
+        self.outgoing.put_back(msg, args)
+        self.assertIs(msg, self.outgoing.dequeue()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
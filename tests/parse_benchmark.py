@@ -0,0 +1,58 @@
+"""Measures how many channel lines per second MessageFactory decodes.
+
+The corpus holds one "nickname<TAB>line" pair per line, as they came from the channel.
+Usage: python tests/parse_benchmark.py [--corpus FILE] [--repeat N] [--strict] [--min-rate LINES_PER_SECOND]
+It exits with an error when the rate falls below --min-rate, so a protocol change can't slow parsing down unnoticed.
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from MysteryOnline.protocol import MessageFactory, IncorrectMessageTypeError  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'channel_corpus.txt')
+
+
+def load_corpus(path=CORPUS):
+    with open(path, encoding='utf-8') as corpus:
+        return [tuple(line.rstrip('\n').split('\t', 1)) for line in corpus if '\t' in line]
+
+
+def decode_all(factory, corpus):
+    """Decodes every line of the corpus, returns how many were rejected."""
+    rejected = 0
+    for username, line in corpus:
+        try:
+            factory.build_from_irc(line, username)
+        except IncorrectMessageTypeError:
+            rejected += 1
+    return rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message decoding benchmark")
+    parser.add_argument('--corpus', default=CORPUS)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--strict', action='store_true')
+    parser.add_argument('--min-rate', type=float, default=0)
+    args = parser.parse_args()
+    corpus = load_corpus(args.corpus)
+    factory = MessageFactory(strict=args.strict)
+    rejected = decode_all(factory, corpus)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        decode_all(factory, corpus)
+    elapsed = time.perf_counter() - start
+    rate = len(corpus) * args.repeat / elapsed
+    print("{} lines x {}: {:.0f} lines/s, {} rejected per pass".format(len(corpus), args.repeat, rate, rejected))
+    if rate < args.min_rate:
+        print("Slower than {:.0f} lines/s".format(args.min_rate))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import unittest
+from MysteryOnline.prefetch import Prefetcher
+from MysteryOnline.texture_cache import TextureCache
+
+
+class FakeSprites:
+
+    def __init__(self, index):
+        self.index = index
+        self.loaded = set()
+
+    def load_index(self):
+        return self.index
+
+    def is_loaded(self, sprite_name):
+        return sprite_name in self.loaded
+
+
+class FakeCharacter:
+
+    def __init__(self, name, index):
+        self.name = name
+        self.sprites = FakeSprites(index)
+        self.loaded_icons = False
+        self.requests = []
+
+    def load_without_icons(self):
+        pass
+
+    def load_sprite_async(self, sprite_name, callback):
+        self.requests.append((sprite_name, callback))
+
+    def load_icons_async(self, callback):
+        self.requests.append(('icons', callback))
+
+
+class FakeUser:
+
+    def __init__(self, character, sprite_name):
+        self.character = character
+        self.sprite_name = sprite_name
+
+    def get_current_sprite_source(self):
+        return self.character, self.sprite_name
+
+
+class PrefetcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TextureCache(budget=100)
+        self.prefetcher = Prefetcher(self.cache)
+        self.kyoko = FakeCharacter("Kyoko", {"1": ("sprites-0.png", ()), "2": ("sprites-1.png", ())})
+
+    def test_one_request_at_a_time(self):
+        self.prefetcher.warm_user(FakeUser(self.kyoko, "2"))
+        self.prefetcher.warm_icons(self.kyoko)
+        self.prefetcher.process()
+        self.prefetcher.process()
+        self.assertEqual(["2"], [name for name, callback in self.kyoko.requests])
+        self.kyoko.requests[0][1]()
+        self.prefetcher.process()
+        self.assertEqual(["2", "icons"], [name for name, callback in self.kyoko.requests])
+
+    def test_unknown_sprite_warms_the_first_one(self):
+        self.prefetcher.warm_user(FakeUser(self.kyoko, "missing"))
+        self.prefetcher.process()
+        self.assertEqual("1", self.kyoko.requests[0][0])
+
+    def test_loaded_sprites_and_duplicates_are_skipped(self):
+        self.kyoko.sprites.loaded.add("1")
+        self.prefetcher.warm_sprite(self.kyoko, "1")
+        self.prefetcher.warm_sprite(self.kyoko, "2")
+        self.prefetcher.warm_sprite(self.kyoko, "2")
+        self.assertEqual(1, len(self.prefetcher.queue))
+
+    def test_nothing_is_warmed_near_the_budget(self):
+        self.cache.add('page', 90, lambda: None)
+        self.prefetcher.warm_sprite(self.kyoko, "2")
+        self.prefetcher.process()
+        self.assertEqual([], self.kyoko.requests)
+        self.assertEqual(1, self.prefetcher.dropped)
+
+    def test_failing_job_does_not_block(self):
+        def fail(done):
+            raise ValueError("broken atlas")
+        self.prefetcher.enqueue('broken', fail)
+        self.prefetcher.process()
+        self.assertFalse(self.prefetcher.busy)
+
+    def test_stuck_job_times_out(self):
+        self.prefetcher.warm_sprite(self.kyoko, "2")
+        self.prefetcher.warm_icons(self.kyoko)
+        self.prefetcher.process()
+        stuck = self.kyoko.requests[0][1]
+        self.prefetcher.on_timeout(self.prefetcher.job_id, "stuck")
+        self.assertFalse(self.prefetcher.busy)
+        self.prefetcher.process()
+        self.assertEqual(["2", "icons"], [name for name, callback in self.kyoko.requests])
+        stuck()
+        self.assertTrue(self.prefetcher.busy)
+        self.assertEqual((0, 1), (self.prefetcher.warmed, self.prefetcher.timed_out))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from types import SimpleNamespace
+from MysteryOnline.irc_mo import PresenceMessage, PresenceBook, HelloMessage, IconMessage, CharacterMessage
+from MysteryOnline.room_state import RoomState
+
+
+class PresenceMessageTests(unittest.TestCase):
+
+    def test_round_trip(self):
+        entries = [("Alice", "Hall", "Stairs", "left", "Kyoko", "3", "0", "False", "", "1.0", "2"),
+                   ("Bob", "Hall", "Door", "center", "Hajime", "1", "1", "True", "", "", "1")]
+        msg = PresenceMessage("default", "Carol", entries)
+        ctcp_type, data = msg.to_ctcp()
+        self.assertEqual(PresenceMessage.ctcp_type, ctcp_type)
+        received = PresenceMessage.from_ctcp("Alice", data)
+        self.assertEqual("Carol", received.target)
+        self.assertEqual(entries, received.entries)
+
+    def test_malformed_entries_are_dropped(self):
+        msg = PresenceMessage.from_ctcp("Alice", "Carol\x1eonly\x1ftwo")
+        self.assertEqual("Carol", msg.target)
+        self.assertEqual([], msg.entries)
+
+    def test_entries_without_protocol(self):
+        msg = PresenceMessage.from_ctcp("Alice", "Carol\x1e" + "\x1f".join(["Alice", "Hall", "Stairs", "left", "Kyoko",
+                                                                           "3", "0", "False", "", "1.0"]))
+        self.assertEqual("1", msg.entries[0][-1])
+
+    def test_apply_records_replayed_state(self):
+        executed = []
+        connection_manager = SimpleNamespace(presence_book=PresenceBook(),
+                                             execute=lambda msg, main_screen, user_handler: executed.append(msg))
+        main_screen = SimpleNamespace(room_state=RoomState())
+        user_handler = SimpleNamespace(get_user=lambda: SimpleNamespace(username="Carol"))
+        entries = [("Alice", "Hall", "Stairs", "left", "Kyoko", "3", "0", "False", "", "1.0", "2"),
+                   ("Carol", "Hall", "Door", "center", "Hajime", "1", "1", "True", "", "", "2")]
+        PresenceMessage("Bob", "Carol", entries).apply(connection_manager, main_screen, user_handler)
+        self.assertEqual(3, len(executed))
+        self.assertEqual(entries[0][:-1], connection_manager.presence_book.get_entry("Alice"))
+        self.assertIsNone(connection_manager.presence_book.get_entry("Carol"))
+        self.assertEqual("Stairs", main_screen.room_state.get_user("Alice").sublocation)
+
+    def test_hello_version(self):
+        msg = HelloMessage.from_ctcp("Alice", "not a number")
+        self.assertEqual(0, msg.version)
+        msg = HelloMessage.from_ctcp("Alice", HelloMessage("default", 3).to_ctcp()[1])
+        self.assertEqual(3, msg.version)
+
+
+class PresenceBookTests(unittest.TestCase):
+
+    def setUp(self):
+        self.book = PresenceBook()
+
+    def test_incomplete_state_has_no_entry(self):
+        self.book.observe(CharacterMessage("Alice", "Kyoko", "", "1.0"))
+        self.assertIsNone(self.book.get_entry("Alice"))
+        self.assertIsNone(self.book.get_entry("Bob"))
+
+    def test_entry_from_observed_messages(self):
+        self.book.observe(CharacterMessage("Alice", "Kyoko", "", "1.0"))
+        self.book.observe(IconMessage("Alice", location="Hall", sublocation="Stairs", character="Kyoko",
+                                      sprite="3", position="left", sprite_option="0", dance="False"))
+        self.assertEqual(("Alice", "Hall", "Stairs", "left", "Kyoko", "3", "0", "False", "", "1.0"),
+                         self.book.get_entry("Alice"))
+        self.book.forget("Alice")
+        self.assertIsNone(self.book.get_entry("Alice"))
+
+    def test_own_messages_are_ignored(self):
+        self.book.observe(IconMessage("default", location="Hall", character="Kyoko"))
+        self.assertEqual({}, self.book.states)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+import unittest
+
+
+class ProtocolImportTests(unittest.TestCase):
+
+    def test_import_does_not_load_kivy(self):
+        code = "import sys, MysteryOnline.protocol; print(any(m.split('.')[0] in ('kivy', 'irc') for m in sys.modules))"
+        output = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+        self.assertEqual("False", output.strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Measures how many messages per second RoomState applies in a crowded room, without a window.
+
+Usage: python tests/room_benchmark.py [--users N] [--messages N] [--locations N] [--min-rate MESSAGES_PER_SECOND]
+It exits with an error when the rate falls below --min-rate.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from MysteryOnline.protocol import IconMessage, LocationMessage, CharacterMessage  # noqa: E402
+from MysteryOnline.room_state import RoomState, POSITIONS  # noqa: E402
+
+
+def build_messages(users, count, locations, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        username = "user{}".format(rng.randrange(users))
+        location = "Location{}".format(rng.randrange(locations))
+        kind = rng.random()
+        if kind < 0.1:
+            messages.append(LocationMessage(username, location))
+        elif kind < 0.15:
+            messages.append(CharacterMessage(username, "Character{}".format(rng.randrange(50)), "", "1.0"))
+        else:
+            messages.append(IconMessage(username, location=location, sublocation="Sub{}".format(rng.randrange(4)),
+                                        character="Character{}".format(rng.randrange(50)),
+                                        sprite=str(rng.randrange(20)), position=rng.choice(POSITIONS),
+                                        sprite_option="0", dance="False"))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Room state benchmark")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--locations', type=int, default=10)
+    parser.add_argument('--min-rate', type=float, default=0)
+    args = parser.parse_args()
+    messages = build_messages(args.users, args.messages, args.locations)
+    room = RoomState()
+    changes = set()
+    room.subscribe(lambda event, username: changes.add(username))
+    start = time.perf_counter()
+    for msg in messages:
+        room.apply(msg)
+    elapsed = time.perf_counter() - start
+    rate = len(messages) / elapsed
+    print("{} users, {} messages: {:.0f} messages/s, {} users to redraw".format(len(room.users), len(messages), rate,
+                                                                               len(changes)))
+    if rate < args.min_rate:
+        print("Slower than {:.0f} messages/s".format(args.min_rate))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
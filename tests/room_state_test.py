@@ -0,0 +1,105 @@
+import unittest
+from MysteryOnline.protocol import ChatMessage, IconMessage, LocationMessage, CharacterMessage, FrameMessage, \
+    OOCMessage
+from MysteryOnline.room_state import RoomState, UserStack, USER_ADDED, LOCATION_CHANGED, SUBLOCATION_CHANGED, \
+    CHARACTER_CHANGED, SPRITE_CHANGED, USER_REMOVED, MUTE_CHANGED
+
+
+def build_icon(sender, sublocation="Stairs", position="left", sprite="1"):
+    return IconMessage(sender, location="Hall", sublocation=sublocation, character="Kyoko", sprite=sprite,
+                       position=position, sprite_option="0", dance="False")
+
+
+class RoomStateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.room = RoomState()
+        self.events = []
+        self.room.subscribe(lambda event, username: self.events.append((event, username)))
+
+    def test_icon_places_user(self):
+        self.room.apply(build_icon("Alice"))
+        user = self.room.get_user("Alice")
+        self.assertEqual(("Hall", "Stairs", "left", "Kyoko", "1"),
+                         (user.location, user.sublocation, user.position, user.character, user.sprite))
+        self.assertEqual([(USER_ADDED, "Alice"), (LOCATION_CHANGED, "Alice"), (SUBLOCATION_CHANGED, "Alice"),
+                          (CHARACTER_CHANGED, "Alice"), (SPRITE_CHANGED, "Alice")], self.events)
+
+    def test_repeated_state_is_silent(self):
+        self.room.apply(build_icon("Alice"))
+        self.events.clear()
+        self.room.apply(build_icon("Alice"))
+        self.assertEqual([], self.events)
+
+    def test_location_change_leaves_sublocation(self):
+        self.room.apply(build_icon("Alice"))
+        self.room.apply(LocationMessage("Alice", "Garden"))
+        self.assertIsNone(self.room.get_user("Alice").sublocation)
+        self.assertEqual(["Alice"], [user.username for user in self.room.get_users_in("Garden")])
+
+    def test_frame_and_character(self):
+        self.room.apply(FrameMessage("Alice", [LocationMessage("Alice", "Hall"),
+                                               CharacterMessage("Alice", "Hajime", "link", "1.0")]))
+        user = self.room.get_user("Alice")
+        self.assertEqual(("Hall", "Hajime", "link"), (user.location, user.character, user.character_link))
+
+    def test_ignored_messages(self):
+        self.room.apply(OOCMessage("Alice", "hi"))
+        self.room.apply(ChatMessage("default", content="hi", location="Hall", sublocation="Stairs",
+                                    character="Kyoko", sprite="1", position="left", color_id=0, sprite_option=0))
+        self.assertEqual({}, self.room.users)
+
+    def test_own_messages_use_local_username(self):
+        self.room.local_username = "Me"
+        self.room.apply(build_icon("default"))
+        self.room.apply(CharacterMessage("default", "Hajime", "link", "1.0"))
+        user = self.room.get_user("Me")
+        self.assertEqual(("Hall", "Stairs", "Hajime"), (user.location, user.sublocation, user.character))
+        self.assertIsNone(self.room.get_user("default"))
+
+    def test_remove_and_mute(self):
+        self.room.apply(build_icon("Alice"))
+        self.room.set_muted("Alice", True)
+        self.assertTrue(self.room.is_muted("Alice"))
+        self.room.remove_user("Alice")
+        self.assertFalse(self.room.is_muted("Alice"))
+        self.assertEqual([], self.room.get_users_in("Hall"))
+        self.assertEqual([(MUTE_CHANGED, "Alice"), (USER_REMOVED, "Alice")], self.events[-2:])
+
+    def test_indexes_follow_moves_and_quits(self):
+        self.room.apply(build_icon("Alice"))
+        self.room.apply(build_icon("Bob", sublocation="Door"))
+        self.assertEqual({"Alice", "Bob"}, {user.username for user in self.room.get_users_in("Hall")})
+        self.room.apply(build_icon("Alice", sublocation="Door", position="right"))
+        alice = self.room.get_user("Alice")
+        self.assertEqual(("Door", "right"), (alice.sublocation, alice.position))
+        self.room.remove_user("Alice")
+        self.room.apply(LocationMessage("Bob", "Garden"))
+        self.assertEqual([], self.room.get_users_in("Hall"))
+        self.assertEqual({"Garden"}, set(self.room.by_location))
+
+
+class UserStackTests(unittest.TestCase):
+
+    def test_latest_user_on_top(self):
+        stack = UserStack()
+        self.assertIsNone(stack.last())
+        stack.append("Alice")
+        stack.append("Bob")
+        self.assertEqual("Bob", stack.last())
+        stack.append("Alice")
+        self.assertEqual(["Bob", "Alice"], stack)
+
+    def test_remove(self):
+        stack = UserStack(["Alice", "Bob"])
+        stack.remove("Bob")
+        self.assertNotIn("Bob", stack)
+        self.assertEqual("Alice", stack.last())
+        self.assertRaises(ValueError, stack.remove, "Bob")
+        stack.discard("Bob")
+        stack.discard("Alice")
+        self.assertFalse(stack)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,7 @@
+import gc
 import unittest
+from types import SimpleNamespace
+from MysteryOnline.sprite import Sprite, SpriteSettings
 from MysteryOnline.sprite_organizer import SpriteOrganizer
 
 
@@ -43,5 +46,41 @@ class SpriteTest(unittest.TestCase):
         self.assertIs(ms2, self.so.get_sprites()[2])
 
 
+class FakeTexture:
+
+    def __init__(self):
+        self.flips = 0
+
+    def flip_horizontal(self):
+        self.flips += 1
+
+
+class FlipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = SimpleNamespace(flipped={}, flip_sprite=lambda texture: texture.flip_horizontal())
+
+    def apply(self, sprite, setting):
+        SpriteSettings.apply_post_processing(self.settings, sprite, setting)
+
+    def test_flip_once(self):
+        sprite = Sprite("1", FakeTexture(), cache_key="page")
+        self.apply(sprite, 0)
+        self.apply(sprite, 0)
+        self.assertEqual(1, sprite.texture.flips)
+        self.apply(sprite, 1)
+        self.assertEqual(2, sprite.texture.flips)
+        self.assertEqual({}, self.settings.flipped)
+
+    def test_reloaded_sprite_is_flipped_again(self):
+        sprite = Sprite("1", FakeTexture(), cache_key="page")
+        self.apply(sprite, 0)
+        del sprite
+        gc.collect()
+        reloaded = Sprite("1", FakeTexture(), cache_key="page")
+        self.apply(reloaded, 0)
+        self.assertEqual(1, reloaded.texture.flips)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+from MysteryOnline.telemetry import RollingPercentiles, Telemetry, HandlerProfiler, RTT, STAGES
+
+
+class TelemetryTests(unittest.TestCase):
+
+    def test_percentiles(self):
+        window = RollingPercentiles()
+        for ms in range(1, 101):
+            window.add(ms / 1000)
+        summary = window.summary()
+        self.assertEqual(100, summary['count'])
+        self.assertAlmostEqual(51.0, summary['p50'])
+        self.assertAlmostEqual(95.0, summary['p95'], delta=1.0)
+        self.assertAlmostEqual(100.0, summary['max'])
+
+    def test_window_rolls(self):
+        window = RollingPercentiles(size=3)
+        for seconds in (1.0, 0.001, 0.002, 0.003):
+            window.add(seconds)
+        self.assertEqual(4, window.summary()['count'])
+        self.assertAlmostEqual(3.0, window.summary()['max'])
+
+    def test_empty_summary(self):
+        telemetry = Telemetry()
+        telemetry.record(RTT, 0.25)
+        summary = telemetry.summary()
+        self.assertEqual(set(STAGES), set(summary))
+        self.assertAlmostEqual(250.0, summary[RTT]['p99'])
+        self.assertEqual(0, summary[STAGES[0]]['count'])
+        self.assertEqual(len(STAGES), len(telemetry.format_summary().splitlines()))
+
+
+class HandlerProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = HandlerProfiler()
+        for seconds in (0.001, 0.003):
+            self.profiler.record_execute("IconMessage", seconds)
+        self.profiler.record_execute("LocationMessage", 0.010)
+        self.profiler.record_received("IconMessage", 40)
+        self.profiler.record_received("IconMessage", 60)
+
+    def test_counters(self):
+        summary = self.profiler.summary()
+        self.assertEqual(["LocationMessage", "IconMessage"], list(summary))
+        icon = summary["IconMessage"]
+        self.assertEqual((2, 2, 100), (icon['calls'], icon['received'], icon['bytes']))
+        self.assertAlmostEqual(4.0, icon['total_ms'])
+        self.assertAlmostEqual(3.0, icon['max_ms'])
+        self.assertAlmostEqual(2.0, icon['mean_ms'])
+
+    def test_dump(self):
+        handle, path = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        self.profiler.dump(path)
+        with open(path) as dump_file:
+            self.assertEqual(1, json.load(dump_file)["LocationMessage"]["calls"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from MysteryOnline.texture_cache import TextureCache, texture_bytes
+
+
+class TextureCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TextureCache(budget=100)
+        self.released = []
+
+    def add(self, key, size):
+        self.cache.add(key, size, lambda: self.released.append(key))
+
+    def test_texture_bytes(self):
+        self.assertEqual(2048 * 2048 * 4, texture_bytes(2048, 2048))
+
+    def test_least_recently_displayed_is_released(self):
+        self.add('a', 40)
+        self.add('b', 40)
+        self.cache.touch('a')
+        self.add('c', 40)
+        self.assertEqual(['b'], self.released)
+        self.assertEqual(80, self.cache.used)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+
+    def test_pinned_entries_stay(self):
+        self.add('a', 40)
+        self.add('b', 40)
+        self.cache.pin('window', 'a')
+        self.add('c', 40)
+        self.assertEqual(['b'], self.released)
+        self.cache.pin('window', 'c')
+        self.assertFalse(self.cache.is_pinned('a'))
+        self.add('d', 40)
+        self.assertEqual(['b', 'a'], self.released)
+
+    def test_new_entry_is_kept_over_budget(self):
+        self.cache.pin('window', 'a')
+        self.add('a', 80)
+        self.add('b', 80)
+        self.assertEqual([], self.released)
+        self.assertEqual(160, self.cache.used)
+
+    def test_shared_pins(self):
+        self.add('a', 60)
+        self.cache.pin('left', 'a')
+        self.cache.pin('right', 'a')
+        self.cache.unpin('left')
+        self.add('b', 60)
+        self.assertEqual([], self.released)
+        self.cache.unpin('right')
+        self.cache.set_budget(60)
+        self.assertEqual(['a'], self.released)
+
+    def test_discard(self):
+        self.add('a', 60)
+        self.cache.discard('a')
+        self.add('b', 60)
+        self.assertEqual([], self.released)
+        self.assertEqual(60, self.cache.used)
+
+
+if __name__ == '__main__':
+    unittest.main()
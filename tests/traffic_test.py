@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+import irc.client
+from MysteryOnline.irc_mo import ReplayConnection, MessageFactory
+from MysteryOnline.traffic import TrafficRecorder, TrafficReplay, FrameTimes, load_capture
+
+
+class TrafficTests(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def record(self, events):
+        recorder = TrafficRecorder(self.path)
+        for event in events:
+            recorder.on_event(None, event)
+        recorder.close()
+
+    def test_round_trip(self):
+        self.record([irc.client.Event("pubmsg", irc.client.NickMask("Alice!a@host"), "#mo", ["hello"]),
+                     irc.client.Event("quit", irc.client.NickMask("Bob!b@host"), None, ["bye"])])
+        events = load_capture(self.path)
+        self.assertEqual(["pubmsg", "quit"], [event["type"] for event in events])
+        self.assertEqual("Alice!a@host", events[0]["source"])
+        self.assertEqual(["hello"], events[0]["arguments"])
+
+    def test_replay_speed(self):
+        events = [{"time": 0.0}, {"time": 1.0}, {"time": 10.0}]
+        replay = TrafficReplay(events, speed=10)
+        self.assertEqual(events[:1], replay.due(100.0))
+        self.assertEqual(events[1:2], replay.due(100.5))
+        self.assertFalse(replay.is_done())
+        self.assertEqual(events[2:], replay.due(101.0))
+        self.assertTrue(replay.is_done())
+
+    def test_max_speed(self):
+        replay = TrafficReplay([{"time": 5.0}, {"time": 0.0}], speed=0)
+        self.assertEqual([0.0, 5.0], [event["time"] for event in replay.due(0.0)])
+
+    def test_frame_times(self):
+        frames = FrameTimes()
+        for ms in range(1, 101):
+            frames.add(ms / 1000)
+        summary = frames.summary()
+        self.assertEqual(100, summary['frames'])
+        self.assertAlmostEqual(100.0, summary['max'])
+        self.assertAlmostEqual(95.0, summary['p95'], delta=1.0)
+
+    def test_replay_connection_decodes_capture(self):
+        factory = MessageFactory()
+        ooc = factory.build_ooc_message("hello")
+        self.record([irc.client.Event("pubmsg", irc.client.NickMask("Alice!a@host"), "#mo", [ooc.to_irc()])])
+        connection = ReplayConnection(self.path, 0, "#mo", "Bob", message_factory=MessageFactory())
+        connection.process()
+        self.assertTrue(connection.is_connected())
+        msg = connection.inbox.get_nowait()[0]
+        self.assertEqual(("Alice", "hello"), (msg.sender, msg.content))
+
+
+if __name__ == '__main__':
+    unittest.main()